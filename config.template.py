@@ -38,9 +38,18 @@ class Config(object):
     # for jobs of that courselab
     OUTPUT_FOLDER = "output"
 
+    # Uploaded files can be stored once by content hash in a directory
+    # on the same filesystem as COURSELABS, e.g.
+    # os.path.join(COURSELABS, ".store"), and hardlinked into the
+    # courselabs and job volumes. None stores uploads as plain files.
+    # Stored files no courselab links to are pruned every
+    # INPUT_STORE_PRUNE_INTERVAL seconds.
+    INPUT_STORE_DIR = None
+    INPUT_STORE_PRUNE_INTERVAL = 600
+
     # VMMS to use. Must be set to a VMMS implemented in vmms/ before
     # starting Tango.  Options are: "localDocker", "distDocker",
-    # "tashiSSH", and "ec2SSH"
+    # "agentDocker", "tashiSSH", and "ec2SSH"
     VMMS_NAME = "localDocker"
 
     # Update this to the 'volumes' directory of your Tango installation if
@@ -61,7 +70,7 @@ class Config(object):
     # Queue manager checks for new work every so many seconds
     DISPATCH_PERIOD = 0.2
 
-    # Timer polling interval used by timeout() function
+    # How often VMMS wait loops (e.g. waitVM) retry
     TIMER_POLL_INTERVAL = 1
 
     # Number of server threads
@@ -86,6 +95,86 @@ class Config(object):
     DOCKER_RM_TIMEOUT = 5
     DOCKER_HOST_USER = ""
 
+    # distDocker's worker hosts. If empty, they are the addresses that
+    # HOST_ALIAS resolves to.
+    DOCKER_HOSTS = []
+
+    # How distDocker picks the host for a VM: "least_loaded", or
+    # "two_choices" (the less loaded of two random hosts). Host load is
+    # probed every DOCKER_HOST_LOAD_INTERVAL seconds.
+    DOCKER_PLACEMENT = "least_loaded"
+    DOCKER_HOST_LOAD_INTERVAL = 10
+
+    # distDocker checks that each host answers every
+    # DOCKER_HOST_HEARTBEAT_INTERVAL seconds. A host that has not
+    # answered for DOCKER_HOST_FAILURE_TIMEOUT seconds is marked down:
+    # no VMs are placed on it, and the jobs running on it are
+    # rescheduled at once. It is re-admitted when it answers again.
+    DOCKER_HOST_HEARTBEAT_INTERVAL = 2
+    DOCKER_HOST_FAILURE_TIMEOUT = 6
+
+    # distDocker keeps DOCKER_SSH_CONNECTIONS multiplexed SSH connections
+    # open to each host, shared by the VMs on it. Idle connections
+    # close after DOCKER_SSH_PERSIST seconds, and connections are
+    # checked every DOCKER_SSH_CHECK_INTERVAL seconds.
+    DOCKER_SSH_CONNECTIONS = 2
+    DOCKER_SSH_PERSIST = 600
+    DOCKER_SSH_CHECK_INTERVAL = 30
+
+    # distDocker caches input files on each host, under
+    # DOCKER_VOLUME_PATH/.cache, so that a file (e.g. a lab's grader
+    # tarball) is sent to a host once rather than with every job. The
+    # least recently used files beyond DOCKER_HOST_CACHE_SIZE MB are
+    # evicted. 0 sends every file with every job.
+    DOCKER_HOST_CACHE_SIZE = 2048
+
+    # agentDocker talks to a Tango agent (tangoAgent.py) on each of
+    # DOCKER_HOSTS, at AGENT_PORT unless a host is given as host:port.
+    # Both ends must share AGENT_KEY. Each agent keeps
+    # AGENT_WARM_CONTAINERS idle containers running for every image.
+    AGENT_PORT = 3001
+    AGENT_KEY = ""
+    AGENT_WARM_CONTAINERS = 2
+
+    # How distDocker, ec2SSH, and tashiSSH reach their hosts: "binary"
+    # forks the ssh and scp binaries, "paramiko" runs SSH in-process
+    # over one connection per host (needs paramiko; falls back to
+    # "binary" without it). See vmms/sshTransport.py.
+    SSH_TRANSPORT = "binary"
+
+    # localDocker talks to the Docker Engine API over the daemon socket,
+    # through a pool of persistent connections, instead of running the
+    # docker CLI for every step
+    DOCKER_USE_API = False
+    DOCKER_API_POOL_SIZE = 20
+
+    # localDocker mounts a second, read-only volume at /home/shared in
+    # every container. Input files marked "shared" (lab artifacts such
+    # as the autograder tarball) are staged in it once, by content, for
+    # every job that uses them, and the job sees them as symlinks.
+    # Shared files no job has used for DOCKER_SHARED_ARTIFACTS_TTL
+    # seconds are removed.
+    DOCKER_SHARED_ARTIFACTS = False
+    DOCKER_SHARED_ARTIFACTS_TTL = 86400
+
+    # Size in MB of a tmpfs that localDocker mounts in every container
+    # to hold the job's working directories, unless the TangoMachine
+    # sets its own (tmpfs). Jobs whose input files take more than half
+    # of it run on disk instead. None runs every job on disk.
+    DOCKER_TMPFS_SIZE = None
+
+    # If True, localDocker pins each running job's container to
+    # physical cores, and the memory of a NUMA node, that no other
+    # running job uses, so that jobs do not disturb each other's
+    # timing. A job gets as many cores as its VM's cores setting, and
+    # runs unpinned if that many are not free on one node.
+    DOCKER_CORE_PINNING = False
+
+    # localDocker follows the docker event stream to track container
+    # states, so waitVM and safeDestroyVM wait on events instead of
+    # polling the daemon
+    DOCKER_TRACK_EVENTS = True
+
     # Docker autograding container resource limits
     DOCKER_CORES_LIMIT = None
     DOCKER_MEMORY_LIMIT = None  # in MB
@@ -96,6 +185,10 @@ class Config(object):
     # Maximum size for output file in bytes
     MAX_OUTPUT_FILE_SIZE = 1000 * 1024
 
+    # How often (in seconds) /streamOutput checks a running job's
+    # output for new bytes to push to the client
+    OUTPUT_STREAM_INTERVAL = 0.5
+
     # VM ulimit values
     VM_ULIMIT_FILE_SIZE = 100 * 1024 * 1024
     VM_ULIMIT_USER_PROC = 100
@@ -118,6 +211,40 @@ class Config(object):
     # Default vm pool size
     POOL_SIZE = 2
 
+    # Cores and memory (in MB) of the host the pools run on. Pools are
+    # not grown past what their VMs' cores and memory add up to. None
+    # leaves that resource unbounded; "detect" asks the VMMS for it
+    # (only localDocker can tell).
+    HOST_CORES = None
+    HOST_MEMORY = None
+
+    # Health check the free VMs of every pool this often (in seconds),
+    # replacing the ones that fail. None disables health checks.
+    POOL_HEALTH_CHECK_INTERVAL = 60
+
+    # Seconds between scans for pool VMs that have been idle too long
+    # (0 disables idle scale-down)
+    POOL_IDLE_CHECK_INTERVAL = 60
+
+    # Default seconds a free pool VM may sit idle before it is destroyed
+    # (None keeps idle VMs forever). Overridable per pool via /prealloc.
+    POOL_IDLE_TTL = None
+
+    # Default size below which idle scale-down never shrinks a pool
+    POOL_MIN_SIZE = 0
+
+    # Look for Tango containers that belong to no pool and no job this
+    # often (in seconds), and remove them. None disables the reaper.
+    ORPHAN_REAP_INTERVAL = 300
+
+    # Job images are validated against a catalog of the VMMS's images
+    # that is refreshed in the background this often (in seconds)
+    IMAGE_CATALOG_REFRESH_INTERVAL = 60
+
+    # An image missing from the catalog refreshes it at most this often
+    # (in seconds). Images built through /build are added right away.
+    IMAGE_CATALOG_MISS_INTERVAL = 10
+
     # Optionally log finer-grained timing information
     LOG_TIMING = False
 
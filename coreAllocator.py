@@ -0,0 +1,139 @@
+#
+# coreAllocator.py - Hands out disjoint sets of CPU cores to the jobs
+# running concurrently on a host.
+#
+# A VM's cores setting is enforced as a CFS quota, which still lets its
+# container run on any core. With pinning, each running job also gets
+# physical cores of its own (all hardware threads of each, so no two
+# jobs share a core's caches and execution units), taken from a single
+# NUMA node whose memory it is confined to. Cores are reserved when a
+# job starts and released when its worker detaches the VM.
+#
+import glob
+import logging
+import os
+import threading
+
+
+def parseCPUList(cpulist):
+    """parseCPUList - Turn a kernel CPU list such as "0-3,8" into a
+    sorted list of CPU numbers
+    """
+    cpus = set()
+    for part in cpulist.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            (first, last) = part.split("-")
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+def formatCPUList(cpus):
+    """formatCPUList - Turn CPU numbers into the list format taken by
+    docker's --cpuset-cpus
+    """
+    return ",".join(str(cpu) for cpu in sorted(cpus))
+
+
+def detectTopology(root="/sys/devices/system"):
+    """detectTopology - Returns {node: [physical core, ...]}, each
+    physical core being the tuple of its hardware threads, for the
+    CPUs this process may run on. Hosts without NUMA information are
+    treated as a single node 0.
+    """
+    usable = set(os.sched_getaffinity(0))
+    nodes = {}
+    for path in glob.glob(os.path.join(root, "node", "node[0-9]*", "cpulist")):
+        node = int(os.path.basename(os.path.dirname(path))[4:])
+        with open(path) as f:
+            cpus = [cpu for cpu in parseCPUList(f.read()) if cpu in usable]
+        if cpus:
+            nodes[node] = cpus
+    if not nodes:
+        nodes = {0: sorted(usable)}
+
+    topology = {}
+    for (node, cpus) in nodes.items():
+        cores = []
+        seen = set()
+        for cpu in cpus:
+            if cpu in seen:
+                continue
+            path = os.path.join(
+                root, "cpu", "cpu%d" % cpu, "topology", "thread_siblings_list"
+            )
+            try:
+                with open(path) as f:
+                    siblings = parseCPUList(f.read())
+            except OSError:
+                siblings = [cpu]
+            core = tuple(sibling for sibling in siblings if sibling in cpus)
+            seen.update(core)
+            cores.append(core)
+        topology[node] = cores
+    return topology
+
+
+class CoreAllocator(object):
+    def __init__(self, topology=None):
+        if topology is None:
+            topology = detectTopology()
+        self.topology = topology
+        # node -> physical cores not held by any job
+        self.free = dict((node, list(cores)) for (node, cores) in topology.items())
+        # key -> (node, physical cores)
+        self.held = {}
+        self.lock = threading.Lock()
+        self.log = logging.getLogger("CoreAllocator")
+
+    def allocate(self, key, count):
+        """allocate - Reserve count physical cores on one NUMA node for
+        key. Picks the node with the fewest free cores that still has
+        enough, to leave room on the others for bigger jobs. Returns
+        (cpus, node), or None if no node has count free cores.
+        """
+        count = max(1, int(count))
+        with self.lock:
+            if key in self.held:
+                (node, cores) = self.held[key]
+                return (self._cpus(cores), node)
+            candidates = [
+                node for (node, cores) in self.free.items() if len(cores) >= count
+            ]
+            if not candidates:
+                self.log.info("No node has %d free cores for %s" % (count, key))
+                return None
+            node = min(candidates, key=lambda node: (len(self.free[node]), node))
+            cores = self.free[node][:count]
+            self.free[node] = self.free[node][count:]
+            self.held[key] = (node, cores)
+        self.log.debug("Allocated cores %s on node %d to %s" % (cores, node, key))
+        return (self._cpus(cores), node)
+
+    def release(self, key):
+        """release - Return the cores held by key, if any"""
+        with self.lock:
+            if key not in self.held:
+                return
+            (node, cores) = self.held.pop(key)
+            self.free[node] = sorted(self.free[node] + cores)
+        self.log.debug("Released cores %s on node %d from %s" % (cores, node, key))
+
+    def getStats(self):
+        """getStats - Returns the number of free and held physical
+        cores on each node
+        """
+        with self.lock:
+            stats = {}
+            for (node, cores) in self.topology.items():
+                stats[node] = {
+                    "cores": len(cores),
+                    "free": len(self.free[node]),
+                }
+            return stats
+
+    def _cpus(self, cores):
+        return sorted(cpu for core in cores for cpu in core)
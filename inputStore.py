@@ -0,0 +1,149 @@
+#
+# inputStore.py - Content-addressed store for uploaded input files
+#
+# Every file uploaded to a courselab is stored once, read-only, under
+# INPUT_STORE_DIR by the SHA-256 of its contents, and the courselab
+# file is a hardlink to it. Identical uploads (e.g. the same grader
+# tarball in many labs, or re-uploads) share one copy on disk, and the
+# VMMSs can stage a stored file into a job's volume with stage(), which
+# hardlinks or reflinks it instead of copying where it can. Stored
+# files that no course lab links to anymore are pruned every
+# INPUT_STORE_PRUNE_INTERVAL seconds.
+#
+import errno
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import stat
+import threading
+import time
+
+from config import Config
+
+# ioctl that makes dest share the data blocks of src (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+log = logging.getLogger("InputStore")
+
+# (device, inode, size, mtime) of a file passed to digest() -> the
+# SHA-256 of its contents
+_digests = {}
+_digestsLock = threading.Lock()
+
+
+class InputStore(object):
+    def __init__(self, root=None):
+        self.root = root or Config.INPUT_STORE_DIR
+        # Keeps prune from removing a stored file that add is linking
+        self.lock = threading.Lock()
+
+    def start(self):
+        """start - Prune the store every INPUT_STORE_PRUNE_INTERVAL
+        seconds in the background
+        """
+        thread = threading.Thread(target=self.__prune)
+        thread.daemon = True
+        thread.start()
+
+    def __prune(self):
+        while True:
+            time.sleep(Config.INPUT_STORE_PRUNE_INTERVAL)
+            try:
+                self.prune()
+            except Exception as e:
+                log.error("Pruning the input store failed: %s" % e)
+
+    def blobPath(self, digest):
+        """blobPath - returns where the file with this digest is stored"""
+        return os.path.join(self.root, digest[:2], digest)
+
+    def add(self, path, dest):
+        """add - Move the file at path into the store, unless a file with
+        the same contents is already there, and make dest a link to the
+        stored file. Returns the stored file's path.
+        """
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(chunk)
+        blob = self.blobPath(sha.hexdigest())
+
+        # Replace dest atomically, so readers never see it missing
+        tmp = "%s.%d.tmp" % (dest, os.getpid())
+        with self.lock:
+            try:
+                os.link(blob, tmp)
+                os.unlink(path)
+            except OSError as e:
+                # Not stored yet, or pruned by another process since
+                if e.errno != errno.ENOENT:
+                    raise
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                os.chmod(path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+                os.rename(path, blob)
+                os.link(blob, tmp)
+            os.rename(tmp, dest)
+        return blob
+
+    def prune(self, grace=60):
+        """prune - Remove stored files that nothing links to anymore and
+        that have not been added in the last grace seconds
+        """
+        now = time.time()
+        if not os.path.isdir(self.root):
+            return
+        for subdir in os.listdir(self.root):
+            for name in os.listdir(os.path.join(self.root, subdir)):
+                blob = os.path.join(self.root, subdir, name)
+                with self.lock:
+                    st = os.stat(blob)
+                    if st.st_nlink == 1 and now - st.st_ctime > grace:
+                        os.unlink(blob)
+                        log.debug("Pruned %s" % blob)
+
+
+def digest(path):
+    """digest - Returns the SHA-256 of the contents of the file at path.
+    A file is hashed once for as long as it does not change.
+    """
+    st = os.stat(path)
+    fileId = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+    with _digestsLock:
+        if fileId in _digests:
+            return _digests[fileId]
+
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    with _digestsLock:
+        _digests[fileId] = sha.hexdigest()
+    return sha.hexdigest()
+
+
+def stage(src, dest):
+    """stage - Make dest a copy of src as cheaply as possible: a
+    hardlink if src is read-only (as stored files are), otherwise a
+    reflink, and a plain copy if the filesystem supports neither.
+    """
+    if os.path.lexists(dest):
+        os.unlink(dest)
+    if not os.stat(src).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH):
+        try:
+            os.link(src, dest)
+            return
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+
+    try:
+        with open(src, "rb") as s, open(dest, "wb") as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        shutil.copymode(src, dest)
+        return
+    except OSError:
+        pass
+
+    shutil.copy(src, dest)
@@ -19,7 +19,6 @@ from datetime import datetime
 
 import tango  # Written this way to avoid circular imports
 from config import Config
-from tangoObjects import TangoQueue
 from worker import Worker
 from preallocator import Preallocator
 from jobQueue import JobQueue
@@ -59,11 +58,61 @@ class JobManager(object):
             self.nextId = 10000
         return id
 
+    def reapOrphans(self, suspects=()):
+        """reapOrphans - Remove the VMs that belong to no pool and to no
+        live job. A VM is only removed if it was already an orphan on
+        the previous call (its name is in suspects), so that VMs being
+        created or handed to a job are left alone. Returns the names of
+        the new suspects.
+        """
+        known = set()
+        for vmName in self.preallocator.machines.keys():
+            known.update(str(id) for id in self.preallocator.getPool(vmName)["total"])
+        for _, job in self.jobQueue.liveJobs.items():
+            if job.vm and job.vm.id is not None:
+                known.add(str(job.vm.id))
+
+        newSuspects = set()
+        for (vmms_name, vmms) in self.vmms.items():
+            if not hasattr(vmms, "destroyVMs"):
+                continue
+            orphans = [vm for vm in vmms.getVMs() if str(vm.id) not in known]
+            doomed = [vm for vm in orphans if vm.name in suspects]
+            if doomed:
+                self.log.warning(
+                    "Reaping orphaned %s VMs: %s"
+                    % (vmms_name, [vm.name for vm in doomed])
+                )
+                vmms.destroyVMs(doomed)
+            newSuspects.update(vm.name for vm in orphans if vm.name not in suspects)
+        return newSuspects
+
+    def __reap(self):
+        suspects = set()
+        while True:
+            time.sleep(Config.ORPHAN_REAP_INTERVAL)
+            try:
+                suspects = self.reapOrphans(suspects)
+            except Exception as err:
+                self.log.error("reapOrphans failed: %s" % err)
+
     def __manage(self):
         self.running = True
+        self.preallocator.start()
+        if Config.ORPHAN_REAP_INTERVAL:
+            thread = threading.Thread(target=self.__reap)
+            thread.daemon = True
+            thread.start()
+        # Jobs put back in the queue because their host had no room
+        deferred = set()
         while True:
             # Blocks until we get a next job
             job = self.jobQueue.getNextPendingJob()
+            if job.id in deferred:
+                # Every queued job has had a turn since this one was
+                # deferred, so wait a bit before the next pass
+                deferred.clear()
+                time.sleep(Config.DISPATCH_PERIOD)
 
             if not job.accessKey and Config.REUSE_VMS:
                 vm = None
@@ -72,6 +121,7 @@ class JobManager(object):
                     # Sleep for a bit and then check again
                     time.sleep(Config.DISPATCH_PERIOD)
 
+            reserved = False
             try:
 
                 # if the job has specified an account
@@ -89,10 +139,20 @@ class JobManager(object):
                     if Config.REUSE_VMS:
                         preVM = vm
                     else:
+                        # Without a free VM, the worker starts one of
+                        # its own if the host has room for it. If not,
+                        # the job waits for a later pass, and the jobs
+                        # behind it are dispatched meanwhile.
                         preVM = self.preallocator.allocVM(job.vm.name)
+                        if preVM is None:
+                            reserved = self.preallocator.reserveCapacity(job.vm, job.id)
+                            if not reserved:
+                                self.jobQueue.deferJob(job.id)
+                                deferred.add(job.id)
+                                continue
                     vmms = self.vmms[job.vm.vmms]  # Create new vmms object
 
-                if preVM.name is not None:
+                if preVM is not None and preVM.name is not None:
                     self.log.info(
                         "Dispatched job %s:%d to %s [try %d]"
                         % (job.name, job.id, preVM.name, job.retries)
@@ -108,10 +168,12 @@ class JobManager(object):
                     % (datetime.utcnow().ctime(), job.name, job.id, job.retries)
                 )
                 # Mark the job assigned
-                self.jobQueue.assignJob(job.id, preVM)
+                self.jobQueue.assignJob(job.id, preVM or job.vm)
                 Worker(job, vmms, self.jobQueue, self.preallocator, preVM).start()
 
             except Exception as err:
+                if reserved:
+                    self.preallocator.releaseCapacity(job.id)
                 self.jobQueue.makeDead(job.id, str(err))
 
 
@@ -127,7 +189,7 @@ if __name__ == "__main__":
         tango.log.debug("Resetting Tango VMs")
         tango.resetTango(tango.preallocator.vmms)
         for key in tango.preallocator.machines.keys():
-            tango.preallocator.machines.set(key, [[], TangoQueue(key)])
+            tango.preallocator.resetPool(key)
         jobs = JobManager(tango.jobQueue)
 
         print("Starting the stand-alone Tango JobManager")
@@ -56,6 +56,8 @@ class JobQueue(object):
         self.liveJobs = TangoDictionary("liveJobs")
         self.deadJobs = TangoDictionary("deadJobs")
         self.unassignedJobs = TangoQueue("unassignedLiveJobs")
+        # Resources used by finished jobs, per courselab and image
+        self.usage = TangoDictionary("jobUsage")
         self.queueLock = threading.Lock()
         self.preallocator = preallocator
         self.log = logging.getLogger("JobQueue")
@@ -296,6 +298,18 @@ class JobQueue(object):
         self.queueLock.release()
         self.log.debug("unassignJob| Released lock to job queue.")
 
+    def deferJob(self, jobId):
+        """deferJob - puts a job that cannot be dispatched yet back at
+        the end of the unassigned jobs queue. Unlike unassignJob, this
+        is not a retry.
+        """
+        self.queueLock.acquire()
+        self.log.debug("deferJob| Acquired lock to job queue.")
+        if jobId in self.liveJobs:
+            self.unassignedJobs.put(int(jobId))
+        self.queueLock.release()
+        self.log.debug("deferJob| Released lock to job queue.")
+
     def makeDead(self, id, reason):
         """makeDead - move a job from live queue to dead queue"""
         self.log.info("makeDead| Making dead job ID: " + str(id))
@@ -331,6 +345,43 @@ class JobQueue(object):
 
         return info
 
+    def recordUsage(self, job):
+        """recordUsage - add the resources a job used to the totals of
+        its courselab and image
+        """
+        if not job.usage:
+            return
+        key = "%s:%s" % (job.courselab, job.vm.image)
+        self.queueLock.acquire()
+        totals = self.usage.get(key)
+        if totals is None:
+            totals = {"courselab": job.courselab, "image": job.vm.image, "jobs": 0}
+        totals["jobs"] += 1
+        for (resource, amount) in job.usage.items():
+            totals[resource] = totals.get(resource, 0) + amount
+            peak = "max_%s" % resource
+            totals[peak] = max(totals.get(peak, 0), amount)
+        self.usage.set(key, totals)
+        self.queueLock.release()
+
+    def getUsage(self):
+        """getUsage - returns the resource totals and peaks of every
+        courselab and image, with the average use per job
+        """
+        result = []
+        for key in self.usage.keys():
+            totals = self.usage.get(key)
+            if totals is None:
+                continue
+            entry = dict(totals)
+            for (resource, amount) in totals.items():
+                if resource in ("courselab", "image", "jobs"):
+                    continue
+                if not resource.startswith("max_"):
+                    entry["avg_%s" % resource] = amount / totals["jobs"]
+            result.append(entry)
+        return result
+
     def reset(self):
         """reset - resets and clears all the internal dictionaries
         and queues
@@ -338,6 +389,7 @@ class JobQueue(object):
         self.liveJobs._clean()
         self.deadJobs._clean()
         self.unassignedJobs._clean()
+        self.usage._clean()
 
     def getNextPendingJob(self):
         """Gets the next unassigned live job. Note that this is a
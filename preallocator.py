@@ -6,34 +6,94 @@ import logging
 import time
 import copy
 
-from tangoObjects import TangoDictionary, TangoQueue, TangoIntValue
+from tangoObjects import TangoDictionary, TangoIntValue, TangoSet
 from config import Config
 
 #
 # Preallocator - This class maintains a pool of active VMs for future
-# job requests.  The pool is stored in dictionary called
+# job requests.  The pools are listed in a dictionary called
 # "machines". This structure keys off the name of the TangoMachine
-# (.name).  The values of this dictionary are two-element arrays:
-# Element 0 is the list of the IDs of the current VMs in this pool.
-# Element 1 is a queue of the VMs in this pool that are available to
-# be assigned to workers.
+# (.name), and its values are the TangoMachine each pool was created
+# from. The pool itself is stored in three further structures per name:
+# - "poolVMs:<name>" is the set of the IDs of the current VMs in this
+#   pool.
+# - "freeVMs:<name>" is a dictionary, keyed off VM ID, of the VMs in
+#   this pool that are available to be assigned to workers.
+# - "idleSince:<name>" is a dictionary, keyed off VM ID, of the time
+#   each VM was last returned to the free list.
+# Every add, remove, claim, and free is a single operation on one of
+# these structures, so the REST and JobManager processes can update a
+# pool concurrently without rewriting (and clobbering) a whole entry.
 #
 
 
 class Preallocator(object):
     def __init__(self, vmms):
         self.machines = TangoDictionary("machines")
+        self.pools = {}
+        self.poolStats = TangoDictionary("poolStats")
+        self.poolPolicies = TangoDictionary("poolPolicies")
+        # Capacity held for VMs outside the pools, keyed off job ID
+        self.reservations = TangoDictionary("reservations")
         self.lock = threading.Lock()
         self.nextID = TangoIntValue("nextID", 1000)
         self.vmms = vmms
         self.log = logging.getLogger("Preallocator")
 
+    def _pool(self, vmName):
+        """_pool - returns the (member set, free dictionary, idle time
+        dictionary) triple that stores the vmName pool
+        """
+        if vmName not in self.pools:
+            self.pools[vmName] = (
+                TangoSet("poolVMs:%s" % vmName),
+                TangoDictionary("freeVMs:%s" % vmName),
+                TangoDictionary("idleSince:%s" % vmName),
+            )
+        return self.pools[vmName]
+
+    def start(self):
+        """start - Start the thread that periodically health checks the
+        free VMs of every pool and scales down idle pools. Only one
+        process should call this.
+        """
+        tasks = []
+        if Config.POOL_HEALTH_CHECK_INTERVAL:
+            tasks.append((Config.POOL_HEALTH_CHECK_INTERVAL, self.checkPoolHealth))
+        if Config.POOL_IDLE_CHECK_INTERVAL:
+            tasks.append((Config.POOL_IDLE_CHECK_INTERVAL, self.scaleDownPool))
+        if not tasks:
+            return
+        thread = threading.Thread(target=self.__maintain, args=(tasks,))
+        thread.daemon = True
+        thread.start()
+
+    def __maintain(self, tasks):
+        """__maintain - Run each (interval, function) task over every
+        pool once every interval seconds
+        """
+        nextRun = [time.time() + interval for (interval, function) in tasks]
+        while True:
+            time.sleep(max(0, min(nextRun) - time.time()))
+            for (i, (interval, function)) in enumerate(tasks):
+                if time.time() < nextRun[i]:
+                    continue
+                for vmName in self.machines.keys():
+                    try:
+                        function(vmName)
+                    except Exception as err:
+                        self.log.error(
+                            "%s of pool %s failed: %s"
+                            % (function.__name__, vmName, err)
+                        )
+                nextRun[i] = time.time() + interval
+
     def poolSize(self, vmName):
         """poolSize - returns the size of the vmName pool, for external callers"""
         if vmName not in self.machines:
             return 0
         else:
-            return len(self.machines.get(vmName)[0])
+            return self._pool(vmName)[0].size()
 
     def update(self, vm, num):
         """update - Updates the number of machines of a certain type
@@ -46,11 +106,12 @@ class Preallocator(object):
         """
         self.lock.acquire()
         if vm.name not in self.machines:
-            self.machines.set(vm.name, [[], TangoQueue(vm.name)])
+            self.machines.set(vm.name, copy.deepcopy(vm))
+            self.resetPool(vm.name)
             self.log.debug("Creating empty pool of %s instances" % (vm.name))
         self.lock.release()
 
-        delta = num - len(self.machines.get(vm.name)[0])
+        delta = num - self.poolSize(vm.name)
         if delta > 0:
             # We need more self.machines, spin them up.
             self.log.debug("update: Creating %d new %s instances" % (delta, vm.name))
@@ -66,16 +127,56 @@ class Preallocator(object):
 
         # If delta == 0 then we are the perfect number!
 
+    def resetPool(self, vmName):
+        """resetPool - Empty the vmName pool, discarding any members and
+        free list it had before.
+        """
+        (members, freeVMs, idleSince) = self._pool(vmName)
+        members._clean()
+        for id in freeVMs.keys():
+            freeVMs.delete(id)
+        for id in idleSince.keys():
+            idleSince.delete(id)
+
+    def setPolicy(self, vmName, idleTTL=None, minSize=None):
+        """setPolicy - Set how long (in seconds) a VM of the vmName pool
+        may sit idle before it is destroyed, and the size below which
+        the pool is never scaled down. None means the Config default.
+        """
+        self.poolPolicies.set(vmName, {"idle_ttl": idleTTL, "min_size": minSize})
+
+    def getPolicy(self, vmName):
+        """getPolicy - returns the idle scale-down policy of a pool"""
+        policy = self.poolPolicies.get(vmName) or {}
+        if policy.get("idle_ttl") is None:
+            policy["idle_ttl"] = Config.POOL_IDLE_TTL
+        if policy.get("min_size") is None:
+            policy["min_size"] = Config.POOL_MIN_SIZE
+        return policy
+
+    def _claimFreeVM(self, vmName, id=None):
+        """_claimFreeVM - Remove a VM from a pool's free list and return
+        it, or None if there is nothing to claim. If id is None, any
+        free VM is claimed.
+        """
+        (members, freeVMs, idleSince) = self._pool(vmName)
+        ids = [id] if id is not None else freeVMs.keys()
+        for vmId in ids:
+            vm = freeVMs.get(vmId)
+            # delete() only succeeds for one caller, so a VM is never
+            # handed out twice even if another process races us.
+            if vm is None or not freeVMs.delete(vmId):
+                continue
+            # Drop VMs that were removed from the pool while free
+            if vmId in members:
+                return vm
+        return None
+
     def allocVM(self, vmName):
         """allocVM - Allocate a VM from the free list"""
         vm = None
         if vmName in self.machines:
-            self.lock.acquire()
-
-        if not self.machines.get(vmName)[1].empty():
-            vm = self.machines.get(vmName)[1].get_nowait()
-
-        self.lock.release()
+            vm = self._claimFreeVM(vmName)
 
         # If we're not reusing instances, then crank up a replacement
         if vm and not Config.REUSE_VMS:
@@ -85,38 +186,42 @@ class Preallocator(object):
 
     def freeVM(self, vm):
         """freeVM - Returns a VM instance to the free list"""
+        self._returnVM(vm, idle=True)
+
+    def _returnVM(self, vm, idle=False):
+        """_returnVM - Puts a VM back on the free list, and records that
+        it is idle from now on if idle is set
+        """
         # Sanity check: Return a VM to the free list only if it is
         # still a member of the pool.
         not_found = False
-        self.lock.acquire()
-        if vm and vm.id in self.machines.get(vm.name)[0]:
-            machine = self.machines.get(vm.name)
-            machine[1].put(vm)
-            self.machines.set(vm.name, machine)
+        (members, freeVMs, idleSince) = self._pool(vm.name)
+        if vm.id in members:
+            if idle:
+                idleSince.set(vm.id, time.time())
+            freeVMs.set(vm.id, vm)
         else:
             not_found = True
-        self.lock.release()
 
         # The VM is no longer in the pool.
         if not_found:
             vmms = self.vmms[vm.vmms]
             vmms.safeDestroyVM(vm)
 
+    def inPool(self, vm):
+        """inPool - returns True if vm is still a member of its pool"""
+        return vm.name in self.machines and vm.id in self._pool(vm.name)[0]
+
     def addVM(self, vm):
         """addVM - add a particular VM instance to the pool"""
-        self.lock.acquire()
-        machine = self.machines.get(vm.name)
-        machine[0].append(vm.id)
-        self.machines.set(vm.name, machine)
-        self.lock.release()
+        self._pool(vm.name)[0].add(vm.id)
 
     def removeVM(self, vm):
         """removeVM - remove a particular VM instance from the pool"""
-        self.lock.acquire()
-        machine = self.machines.get(vm.name)
-        machine[0].remove(vm.id)
-        self.machines.set(vm.name, machine)
-        self.lock.release()
+        (members, freeVMs, idleSince) = self._pool(vm.name)
+        members.remove(vm.id)
+        freeVMs.delete(vm.id)
+        idleSince.delete(vm.id)
 
     def _getNextID(self):
         """_getNextID - returns next ID to be used for a preallocated
@@ -143,17 +248,51 @@ class Preallocator(object):
         vmms = self.vmms[vm.vmms]
         self.log.debug("__create: Using VMMS %s " % (Config.VMMS_NAME))
         for i in range(cnt):
-            newVM = copy.deepcopy(vm)
-            newVM.id = self._getNextID()
+            newVM = self._newPoolVM(vm)
+            if newVM is None:
+                self.log.warning(
+                    "__create: Host capacity reached, created %d of %d %s instances"
+                    % (i, cnt, vm.name)
+                )
+                return
             self.log.debug("__create|calling initializeVM")
-            vmms.initializeVM(newVM)
+            self._initializeVM(vmms, newVM)
             self.log.debug("__create|done with initializeVM")
             time.sleep(Config.CREATEVM_SECS)
 
-            self.addVM(newVM)
             self.freeVM(newVM)
             self.log.debug("__create: Added vm %s to pool %s " % (newVM.id, newVM.name))
 
+    def _newPoolVM(self, vm, replacing=False):
+        """_newPoolVM - Add a new VM like vm to its pool and return it,
+        or None if it does not fit in what is left of its host's
+        capacity. The check and the addition are made under the lock,
+        so that concurrent creations cannot oversubscribe the host
+        between them. A VM that replaces a pool member (replacing) is
+        always added: it adds nothing once the member is removed.
+        """
+        id = self._getNextID()
+        self.lock.acquire()
+        try:
+            if not replacing and not self._fits(vm):
+                return None
+            newVM = copy.deepcopy(vm)
+            newVM.id = id
+            self.addVM(newVM)
+        finally:
+            self.lock.release()
+        return newVM
+
+    def _initializeVM(self, vmms, newVM):
+        """_initializeVM - Start a VM added by _newPoolVM, removing it
+        from the pool again if that fails
+        """
+        try:
+            vmms.initializeVM(newVM)
+        except Exception:
+            self.removeVM(newVM)
+            raise
+
     def __destroy(self, vm):
         """__destroy - Removes a VM from the pool
 
@@ -163,9 +302,7 @@ class Preallocator(object):
         it's possible we might not be able to satisfy the request if
         the free list is empty.
         """
-        self.lock.acquire()
-        dieVM = self.machines.get(vm.name)[1].get_nowait()
-        self.lock.release()
+        dieVM = self._claimFreeVM(vm.name)
 
         if dieVM:
             self.removeVM(dieVM)
@@ -178,14 +315,17 @@ class Preallocator(object):
         """
 
         vmms = self.vmms[vm.vmms]
-        newVM = copy.deepcopy(vm)
-        newVM.id = self._getNextID()
+        newVM = self._newPoolVM(vm, replacing=self.inPool(vm))
+        if newVM is None:
+            self.log.warning(
+                "createVM: Host capacity reached, not creating a %s instance" % vm.name
+            )
+            return
 
         self.log.info("createVM|calling initializeVM")
-        vmms.initializeVM(newVM)
+        self._initializeVM(vmms, newVM)
         self.log.info("createVM|done with initializeVM")
 
-        self.addVM(newVM)
         self.freeVM(newVM)
         self.log.debug("createVM: Added vm %s to pool %s" % (newVM.id, newVM.name))
 
@@ -199,25 +339,165 @@ class Preallocator(object):
             return -1
 
         dieVM = None
+        (members, freeVMs, idleSince) = self._pool(vmName)
         self.lock.acquire()
-        size = self.machines.get(vmName)[1].qsize()
-        if size == len(self.machines.get(vmName)[0]):
-            for i in range(size):
-                vm = self.machines.get(vmName)[1].get_nowait()
-                if vm.id != id:
-                    self.machines.get(vmName)[1].put(vm)
-                else:
-                    dieVM = vm
+        if len(freeVMs.keys()) == members.size():
+            dieVM = self._claimFreeVM(vmName, id)
         self.lock.release()
 
         if dieVM:
             self.removeVM(dieVM)
-            vmms = self.vmms[vm.vmms]
+            vmms = self.vmms[dieVM.vmms]
             vmms.safeDestroyVM(dieVM)
             return 0
         else:
             return -1
 
+    def checkPoolHealth(self, vmName):
+        """checkPoolHealth - Probe each free VM in the vmName pool
+        through its VMMS, and replace the ones that fail. VMs are
+        claimed from the free list while they are probed, so a job can
+        never be handed one mid-check. VMMSs that do not implement
+        checkVM are not checked.
+        """
+        vmms = self.vmms.get(self.machines.get(vmName).vmms)
+        if not hasattr(vmms, "checkVM"):
+            return
+
+        stats = {"checks": 0, "failures": 0}
+        for id in self._pool(vmName)[1].keys():
+            vm = self._claimFreeVM(vmName, id)
+            if vm is None:
+                # Allocated to a job since we listed the free list
+                continue
+
+            stats["checks"] += 1
+            if vmms.checkVM(vm):
+                self._returnVM(vm)
+                continue
+
+            stats["failures"] += 1
+            self.log.warning("Evicting unhealthy vm %s from pool %s" % (id, vmName))
+            vmms.safeDestroyVM(vm)
+            try:
+                self.createVM(vm)
+            finally:
+                # As in Worker.detachVM, remove the VM only once its
+                # replacement is in the pool, but remove it even if
+                # there is no replacement, or the pool is never
+                # quiescent again.
+                self.removeVM(vm)
+
+        self._updatePoolStats(vmName, "health", stats)
+
+    def scaleDownPool(self, vmName):
+        """scaleDownPool - Destroy the VMs of the vmName pool that have
+        been idle for longer than the pool's idle TTL, oldest first,
+        without shrinking the pool below its minimum size.
+        """
+        policy = self.getPolicy(vmName)
+        if not policy["idle_ttl"]:
+            return
+
+        (members, freeVMs, idleSince) = self._pool(vmName)
+        now = time.time()
+        idle = []
+        for id in freeVMs.keys():
+            since = idleSince.get(id)
+            if since is not None and now - since > policy["idle_ttl"]:
+                idle.append((since, id))
+
+        stats = {"destroyed": 0}
+        for (since, id) in sorted(idle):
+            if members.size() <= policy["min_size"]:
+                break
+            vm = self._claimFreeVM(vmName, id)
+            if vm is None:
+                # Allocated to a job since we listed the free list
+                continue
+            self.log.info(
+                "Destroying vm %s of pool %s after %d idle secs"
+                % (id, vmName, now - since)
+            )
+            self.removeVM(vm)
+            self.vmms[vm.vmms].safeDestroyVM(vm)
+            stats["destroyed"] += 1
+
+        self._updatePoolStats(vmName, "scale_down", stats)
+
+    def _updatePoolStats(self, vmName, kind, counts):
+        """_updatePoolStats - Add counts to the kind ("health" or
+        "scale_down") statistics of the vmName pool
+        """
+        poolStats = self.poolStats.get(vmName) or {}
+        stats = poolStats.get(kind, {"last_run": None})
+        for key in counts:
+            stats[key] = stats.get(key, 0) + counts[key]
+        stats["last_run"] = time.time()
+        poolStats[kind] = stats
+        self.poolStats.set(vmName, poolStats)
+
+    def getCapacity(self, vmmsName):
+        """getCapacity - returns the cores and memory (in MB) of the
+        host behind vmmsName, and how much of them its pools use. A
+        total of None means that resource is unbounded.
+        """
+        result = {"cores": Config.HOST_CORES, "memory": Config.HOST_MEMORY}
+        if "detect" in result.values():
+            vmms = self.vmms.get(vmmsName)
+            detected = (None, None)
+            if hasattr(vmms, "getHostCapacity"):
+                detected = vmms.getHostCapacity()
+            for (resource, amount) in zip(("cores", "memory"), detected):
+                if result[resource] == "detect":
+                    result[resource] = amount
+
+        result["used_cores"] = 0
+        result["used_memory"] = 0
+        for vmName in self.machines.keys():
+            machine = self.machines.get(vmName)
+            if machine is None or machine.vmms != vmmsName:
+                continue
+            size = self.poolSize(vmName)
+            result["used_cores"] += size * (machine.cores or 0)
+            result["used_memory"] += size * (machine.memory or 0)
+        for vm in self.reservations.values():
+            if vm.vmms == vmmsName:
+                result["used_cores"] += vm.cores or 0
+                result["used_memory"] += vm.memory or 0
+        return result
+
+    def reserveCapacity(self, vm, key):
+        """reserveCapacity - Hold host capacity under key for a VM like
+        vm that is not in a pool, such as the VM a worker starts for a
+        job when no pool VM is free. Returns False, reserving nothing,
+        if the VM does not fit.
+        """
+        self.lock.acquire()
+        try:
+            if not self._fits(vm):
+                return False
+            self.reservations.set(key, vm)
+            return True
+        finally:
+            self.lock.release()
+
+    def releaseCapacity(self, key):
+        """releaseCapacity - Release what reserveCapacity held under key"""
+        self.reservations.delete(key)
+
+    def _fits(self, vm):
+        """_fits - returns True if one more VM like vm fits in what is
+        left of its host's capacity
+        """
+        capacity = self.getCapacity(vm.vmms)
+        for resource in ("cores", "memory"):
+            need = getattr(vm, resource) or 0
+            total = capacity[resource]
+            if total is not None and capacity["used_" + resource] + need > total:
+                return False
+        return True
+
     def getAllPools(self):
         result = {}
         for vmName in self.machines.keys():
@@ -230,19 +510,11 @@ class Preallocator(object):
         if vmName not in self.machines:
             return result
 
-        result["total"] = []
-        result["free"] = []
-        free_list = []
-        self.lock.acquire()
-        size = self.machines.get(vmName)[1].qsize()
-        for i in range(size):
-            vm = self.machines.get(vmName)[1].get_nowait()
-            free_list.append(vm.id)
-            machine = self.machines.get(vmName)
-            machine[1].put(vm)
-            self.machines.set(vmName, machine)
-        self.lock.release()
-
-        result["total"] = self.machines.get(vmName)[0]
-        result["free"] = free_list
+        (members, freeVMs, idleSince) = self._pool(vmName)
+        poolStats = self.poolStats.get(vmName) or {}
+        result["total"] = sorted(int(id) for id in members.members())
+        result["free"] = sorted(int(id) for id in freeVMs.keys())
+        result["health"] = poolStats.get("health")
+        result["scale_down"] = poolStats.get("scale_down")
+        result["policy"] = self.getPolicy(vmName)
         return result
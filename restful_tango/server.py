@@ -2,11 +2,14 @@ import os
 import sys
 import inspect
 import hashlib
+import json
 
 import urllib.error
 import urllib.parse
 import urllib.request
 
+import tornado.ioloop
+import tornado.iostream
 import tornado.web
 from tempfile import NamedTemporaryFile
 from tangoREST import TangoREST
@@ -92,7 +95,64 @@ class GetPartialHandler(tornado.web.RequestHandler):
     def get(self, key, jobId):
         """get - Handles the get request to partialOutput"""
         self.set_header("Content-Type", "application/octet-stream")
-        self.write(tangoREST.getPartialOutput(key, jobId))
+        offset = self.get_argument("offset", "0")
+        self.write(tangoREST.getPartialOutput(key, jobId, offset))
+
+
+def readOutput(key, jobId, offset):
+    """readOutput - Returns whether the job is running, and then its
+    output from offset on. Liveness is checked first, so the read made
+    once the job has finished picks up all it wrote.
+    """
+    running = tangoREST.tango.jobQueue.liveJobs.get(jobId) is not None
+    return (running, tangoREST.getPartialOutput(key, jobId, offset))
+
+
+class StreamOutputHandler(tornado.web.RequestHandler):
+    async def get(self, key, jobId):
+        """get - Handles the get request to streamOutput. Pushes the
+        job's output as server-sent events while it runs, each with the
+        new output and the offset to resume from, and an "end" event
+        after a final read once the job is no longer running.
+        """
+        if not tangoREST.validateKey(key):
+            self.write(tangoREST.status.wrong_key)
+            return
+        # EventSource clients resume from the id of the last event seen
+        offset = self.request.headers.get(
+            "Last-Event-ID", self.get_argument("offset", "0")
+        )
+        try:
+            offset = int(offset)
+        except ValueError:
+            offset = -1
+        if offset < 0:
+            self.set_status(400)
+            self.write(tangoREST.status.invalid_offset)
+            return
+
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        loop = tornado.ioloop.IOLoop.current()
+        try:
+            while True:
+                # The reads block on Redis and the VMMS, so keep them
+                # off the IO loop
+                (running, result) = await loop.run_in_executor(
+                    None, readOutput, key, jobId, offset
+                )
+                if result["statusId"] == 0 and result["offset"] != offset:
+                    offset = result["offset"]
+                    data = {"output": result["output"], "offset": offset}
+                    self.write("id: %d\ndata: %s\n\n" % (offset, json.dumps(data)))
+                    await self.flush()
+                if not running:
+                    # The job has finished (or never existed)
+                    self.write("event: end\ndata: {}\n\n")
+                    break
+                await asyncio.sleep(Config.OUTPUT_STREAM_INTERVAL)
+        except tornado.iostream.StreamClosedError:
+            pass
 
 
 class InfoHandler(tornado.web.RequestHandler):
@@ -157,6 +217,7 @@ async def main(port: int):
             (r"/addJob/(%s)/(%s)/" % (SHA1_KEY, COURSELAB), AddJobHandler),
             (r"/poll/(%s)/(%s)/(%s)/" % (SHA1_KEY, COURSELAB, OUTPUTFILE), PollHandler),
             (r"/getPartialOutput/(%s)/(%s)/" % (SHA1_KEY, JOBID), GetPartialHandler),
+            (r"/streamOutput/(%s)/(%s)/" % (SHA1_KEY, JOBID), StreamOutputHandler),
             (r"/info/(%s)/" % (SHA1_KEY), InfoHandler),
             (r"/jobs/(%s)/(%s)/" % (SHA1_KEY, DEADJOBS), JobsHandler),
             (r"/pool/(%s)/" % (SHA1_KEY), PoolHandler),
@@ -19,6 +19,7 @@ sys.path.insert(0, parentdir)
 from config import Config
 from tangoObjects import TangoJob, TangoMachine, InputFile
 from tango import TangoServer
+from inputStore import InputStore
 
 
 class Status(object):
@@ -44,6 +45,7 @@ class Status(object):
         self.pool_not_found = self.create(-1, "Pool not found")
         self.prealloc_failed = self.create(-1, "Preallocate VM failed")
         self.image_build_failed = self.create(-1, "Image build failed")
+        self.invalid_offset = self.create(-1, "Invalid offset")
 
     def create(self, id, msg):
         """create - Constructs a dict with the given ID and message"""
@@ -75,6 +77,10 @@ class TangoREST(object):
 
         self.tango = TangoServer()
         self.status = Status()
+        self.inputStore = None
+        if Config.INPUT_STORE_DIR:
+            self.inputStore = InputStore()
+            self.inputStore.start()
 
     def validateKey(self, key):
         """validateKey - Validates key provided by client"""
@@ -115,9 +121,12 @@ class TangoREST(object):
         """createTangoMachine - Creates a tango machine object from image"""
         cores = getattr(Config, "DOCKER_CORES_LIMIT", None)
         memory = getattr(Config, "DOCKER_MEMORY_LIMIT", None)
+        tmpfs = None
         if vmObj and "cores" in vmObj and "memory" in vmObj:
             cores = vmObj["cores"]
             memory = vmObj["memory"]
+        if vmObj and "tmpfs" in vmObj:
+            tmpfs = vmObj["tmpfs"]
         return TangoMachine(
             name=image,
             vmms=vmms,
@@ -126,9 +135,10 @@ class TangoREST(object):
             memory=memory,
             disk=None,
             network=None,
+            tmpfs=tmpfs,
         )
 
-    def convertJobObj(self, dirName, jobObj):
+    def convertJobObj(self, dirName, jobObj, courselab=None):
         """convertJobObj - Converts a dictionary into a TangoJob object"""
 
         name = jobObj["jobName"]
@@ -152,6 +162,7 @@ class TangoREST(object):
             handinfile = InputFile(
                 localFile="%s/%s/%s" % (self.COURSELABS, dirName, inFile),
                 destFile=vmFile,
+                shared=bool(file.get("shared", False)),
             )
             input.append(handinfile)
 
@@ -180,6 +191,7 @@ class TangoREST(object):
             accessKey=accessKey,
             accessKeyId=accessKeyId,
             disableNetwork=disableNetwork,
+            courselab=courselab,
         )
 
         self.log.debug("inputFiles: %s" % [file.localFile for file in input])
@@ -206,6 +218,7 @@ class TangoREST(object):
         input = dict()
         input["destFile"] = inputFile.destFile
         input["localFile"] = inputFile.localFile
+        input["shared"] = getattr(inputFile, "shared", False)
         return input
 
     def convertTangoJobObj(self, tangoJobObj):
@@ -221,6 +234,7 @@ class TangoREST(object):
         job["timeout"] = tangoJobObj.timeout
         job["id"] = tangoJobObj.id
         job["trace"] = tangoJobObj.trace
+        job["usage"] = tangoJobObj.usage
 
         # Convert VM object
         job["vm"] = self.convertTangoMachineObj(tangoJobObj.vm)
@@ -280,7 +294,10 @@ class TangoREST(object):
                         os.unlink(tempfile)
                         return self.status.file_exists
                     absPath = "%s/%s" % (labPath, file)
-                    os.rename(tempfile, absPath)
+                    if self.inputStore:
+                        self.inputStore.add(tempfile, absPath)
+                    else:
+                        os.rename(tempfile, absPath)
                     self.log.info(
                         "Uploaded file to (%s, %s, %s)" % (key, courselab, file)
                     )
@@ -308,7 +325,7 @@ class TangoREST(object):
             labName = self.getDirName(key, courselab)
             try:
                 jobObj = json.loads(jobStr)
-                job = self.convertJobObj(labName, jobObj)
+                job = self.convertJobObj(labName, jobObj, courselab)
                 jobId = self.tango.addJob(job)
                 self.log.debug("Done adding job")
                 if jobId == -1:
@@ -328,14 +345,20 @@ class TangoREST(object):
             self.log.info("Key not recognized: %s" % key)
             return self.status.wrong_key
 
-    def getPartialOutput(self, key, jobId):
-        """getPartialOutput - Return the partial output of the job"""
-        self.log.debug("Received getPartialOutput request(%s, %s)" % (key, jobId))
+    def getPartialOutput(self, key, jobId, offset=0):
+        """getPartialOutput - Return the partial output of the job from
+        byte offset on, and the offset to ask for next
+        """
+        self.log.debug(
+            "Received getPartialOutput request(%s, %s, %s)" % (key, jobId, offset)
+        )
         if self.validateKey(key):
             try:
-                output = self.tango.getPartialOutput(jobId)
-                result = self.status.partial_output_obtained
+                (output, nextOffset) = self.tango.getPartialOutput(jobId, int(offset))
+                # Copied, as concurrent streams fill in their own
+                result = dict(self.status.partial_output_obtained)
                 result["output"] = output
+                result["offset"] = nextOffset
                 return result
             except Exception as e:
                 self.log.error("getPartialOutput request failed: %s" % str(e))
@@ -419,6 +442,7 @@ class TangoREST(object):
                     result = self.status.pool_not_found
 
             result["pools"] = pools
+            result["host_capacity"] = self.tango.getCapacity()
             return result
         else:
             self.log.info("Key not recognized: %s" % key)
@@ -428,13 +452,17 @@ class TangoREST(object):
         """prealloc - Create a pool of num instances spawned from image"""
         self.log.debug("Received prealloc request(%s, %s, %s)" % (key, image, num))
         if self.validateKey(key):
+            idleTTL = None
+            minSize = None
             if vmStr != "":
                 vmObj = json.loads(vmStr)
                 vm = self.createTangoMachine(image, vmObj=vmObj)
+                idleTTL = vmObj.get("idle_ttl")
+                minSize = vmObj.get("min_size")
             else:
                 vm = self.createTangoMachine(image)
 
-            ret = self.tango.preallocVM(vm, int(num))
+            ret = self.tango.preallocVM(vm, int(num), idleTTL, minSize)
 
             if ret == -1:
                 self.log.error("Prealloc failed")
@@ -480,6 +508,7 @@ class TangoREST(object):
                 return self.status.image_build_failed
 
             self.log.info("Successfully loaded image: %s" % (imageName))
+            self.tango.refreshImageCatalog()
             os.unlink(tempfile)
             return self.status.image_built
         else:
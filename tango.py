@@ -34,6 +34,7 @@
 #    the pool, the preallocator creates another instance and adds it
 #    to the pool. (preallocator.py)
 
+import codecs
 import threading
 import logging
 import time
@@ -74,6 +75,10 @@ class TangoServer(object):
             from vmms.distDocker import DistDocker
 
             vmms = DistDocker()
+        elif Config.VMMS_NAME == "agentDocker":
+            from vmms.agentDocker import AgentDocker
+
+            vmms = AgentDocker()
 
         self.preallocator = Preallocator({Config.VMMS_NAME: vmms})
         self.jobQueue = JobQueue(self.preallocator)
@@ -92,6 +97,16 @@ class TangoServer(object):
         self.log = logging.getLogger("TangoServer")
         self.log.info("Starting Tango server")
 
+        # Image name -> digest of each VMMS, so that validating a job
+        # does not have to list the VMMS's images
+        self.imageCatalog = {}
+        self.imageCatalogLock = threading.Lock()
+        # When a lookup miss last refreshed the catalog
+        self.imageCatalogMissed = 0
+        thread = threading.Thread(target=self.__maintainImageCatalog)
+        thread.daemon = True
+        thread.start()
+
     def addJob(self, job):
         """addJob - Add a job to the job queue"""
         Config.job_requests += 1
@@ -132,18 +147,66 @@ class TangoServer(object):
         except Exception as e:
             self.log.debug("getJobs: %s" % str(e))
 
-    def preallocVM(self, vm, num):
-        """preallocVM - Set the pool size for VMs of type vm to num"""
+    def refreshImageCatalog(self):
+        """refreshImageCatalog - Reload the image catalog of every VMMS.
+        Called in the background, and after an image is built.
+        """
+        for (vmms_name, vmms) in self.preallocator.vmms.items():
+            try:
+                if hasattr(vmms, "getImageDigests"):
+                    images = vmms.getImageDigests()
+                else:
+                    images = dict((image, None) for image in vmms.getImages())
+            except Exception as err:
+                self.log.error("refreshImageCatalog: %s failed: %s" % (vmms_name, err))
+                continue
+            with self.imageCatalogLock:
+                self.imageCatalog[vmms_name] = images
+
+    def __maintainImageCatalog(self):
+        while True:
+            self.refreshImageCatalog()
+            time.sleep(Config.IMAGE_CATALOG_REFRESH_INTERVAL)
+
+    def resolveImage(self, vmms_name, image):
+        """resolveImage - Look image up in the catalog of vmms_name.
+        Returns its digest (None if the VMMS has no digests), or raises
+        KeyError if there is no such image. An unknown image triggers a
+        refresh first, in case it was added some other way than /build,
+        but at most one every IMAGE_CATALOG_MISS_INTERVAL seconds.
+        """
+        with self.imageCatalogLock:
+            images = self.imageCatalog.get(vmms_name, {})
+            now = time.time()
+            refresh = (
+                image not in images
+                and now - self.imageCatalogMissed >= Config.IMAGE_CATALOG_MISS_INTERVAL
+            )
+            if refresh:
+                self.imageCatalogMissed = now
+        if refresh:
+            self.refreshImageCatalog()
+            with self.imageCatalogLock:
+                images = self.imageCatalog.get(vmms_name, {})
+        return images[image]
+
+    def preallocVM(self, vm, num, idleTTL=None, minSize=None):
+        """preallocVM - Set the pool size for VMs of type vm to num, and
+        optionally the idle TTL and minimum size used to scale it down
+        """
         self.log.debug("Received preallocVM(%s,%d)request" % (vm.name, num))
         try:
-            vmms = self.preallocator.vmms[vm.vmms]
             if not vm or num < 0:
                 return -2
-            if vm.image not in vmms.getImages():
+            try:
+                self.resolveImage(vm.vmms, vm.image)
+            except KeyError:
                 self.log.error("Invalid image name")
                 return -3
             (name, ext) = os.path.splitext(vm.image)
             vm.name = name
+            if idleTTL is not None or minSize is not None:
+                self.preallocator.setPolicy(vm.name, idleTTL, minSize)
             self.preallocator.update(vm, num)
             return 0
         except Exception as err:
@@ -192,6 +255,15 @@ class TangoServer(object):
             self.log.error("getPool request failed: %s" % err)
             return []
 
+    def getCapacity(self):
+        """getCapacity - return the host capacity and utilization of
+        each VMMS
+        """
+        return dict(
+            (vmmsName, self.preallocator.getCapacity(vmmsName))
+            for vmmsName in self.preallocator.vmms
+        )
+
     def getInfo(self):
         """getInfo - return various statistics about the Tango daemon"""
         stats = {}
@@ -204,20 +276,34 @@ class TangoServer(object):
         stats["runjob_errors"] = Config.runjob_errors
         stats["copyout_errors"] = Config.copyout_errors
         stats["num_threads"] = threading.activeCount()
+        stats["host_capacity"] = self.getCapacity()
+        stats["resource_usage"] = self.jobQueue.getUsage()
+        vmms = self.preallocator.vmms.get(Config.VMMS_NAME)
+        if hasattr(vmms, "getHostStats"):
+            stats["hosts"] = vmms.getHostStats()
 
         return stats
 
-    def getPartialOutput(self, jobid):
-        """getPartialOutput - Return the partial output of a job"""
+    def getPartialOutput(self, jobid, offset=0):
+        """getPartialOutput - Return the partial output of a job from
+        byte offset on, and the offset to continue reading from. A
+        UTF-8 character cut off at the end is left for the next read.
+        """
         try:
             jobInfo = self.jobQueue.liveJobs.get(jobid)
+            finished = False
+            if jobInfo is None:
+                # What a job wrote just before it finished can be read
+                # until its VM is recycled or destroyed
+                jobInfo = self.jobQueue.deadJobs.get(jobid)
+                finished = True
 
             if jobInfo is None:
                 raise Exception("Invalid job id")
 
             vm = jobInfo.vm
 
-            if not jobInfo.assigned or vm is None:
+            if (not finished and not jobInfo.assigned) or vm is None:
                 self.log.info(
                     "job %s %d is assigned %d, job dict: %s ID: %s]"
                     % (
@@ -233,7 +319,11 @@ class TangoServer(object):
                 raise Exception("Job %s does not have a vm id set" % jobid)
 
             vmms = self.preallocator.vmms[Config.VMMS_NAME]
-            return vmms.getPartialOutput(vm)
+            data = vmms.getPartialOutput(vm, offset)
+            decoder = codecs.getincrementaldecoder("utf-8")("replace")
+            output = decoder.decode(data)
+            (pending, _) = decoder.getstate()
+            return (output, offset + len(data) - len(pending))
         except Exception as err:
             self.log.error("getPartialOutput request failed: %s" % err)
             raise Exception("getPartialOutput request failed: %s" % err)
@@ -256,13 +346,15 @@ class TangoServer(object):
                 vobj = vmms[vmms_name]
                 vms = vobj.getVMs()
                 self.log.debug("Pre-existing VMs: %s" % [vm.name for vm in vms])
-                namelist = []
-                for vm in vms:
-                    if re.match("%s-" % Config.PREFIX, vm.name):
+                vms = [vm for vm in vms if re.match("%s-" % Config.PREFIX, vm.name)]
+                if hasattr(vobj, "destroyVMs"):
+                    vobj.destroyVMs(vms)
+                else:
+                    for vm in vms:
                         vobj.destroyVM(vm)
-                        # Need a consistent abstraction for a vm between
-                        # interfaces
-                        namelist.append(vm.name)
+                # Need a consistent abstraction for a vm between
+                # interfaces
+                namelist = [vm.name for vm in vms]
                 if namelist:
                     self.log.warning(
                         "Killed these %s VMs on restart: %s" % (vmms_name, namelist)
@@ -309,9 +401,9 @@ class TangoServer(object):
                 )
                 errors += 1
             else:
-                vobj = vmms[Config.VMMS_NAME]
-                imgList = vobj.getImages()
-                if job.vm.image not in imgList:
+                try:
+                    digest = self.resolveImage(Config.VMMS_NAME, job.vm.image)
+                except KeyError:
                     self.log.error("validateJob: Image not found: %s" % job.vm.image)
                     job.appendTrace(
                         "%s|validateJob: Image not found: %s"
@@ -321,6 +413,11 @@ class TangoServer(object):
                 else:
                     (name, ext) = os.path.splitext(job.vm.image)
                     job.vm.name = name
+                    if digest:
+                        job.appendTrace(
+                            "%s|validateJob: Image %s is %s"
+                            % (datetime.utcnow().ctime(), job.vm.image, digest)
+                        )
 
             if not job.vm.vmms:
                 self.log.error("validateJob: Missing job.vm.vmms")
@@ -0,0 +1,512 @@
+#
+# tangoAgent.py - Runs Tango jobs on a worker host for agentDocker
+#
+# The agent runs on each worker host and carries out the VMMS
+# operations that agentDocker asks of it over HTTP, with localDocker.
+# It keeps AGENT_WARM_CONTAINERS idle containers warm for every image
+# (and VM size) it has run jobs for, so that a job starts in a running
+# container. A Tango VM is bound to one of the agent's own VMs from
+# the moment it is acquired until its feedback is collected or it is
+# destroyed; the agent's VM then goes back to its pool.
+#
+# Every request must carry AGENT_KEY in the X-Tango-Agent-Key header.
+# Requests are JSON, as are replies but for input files (a gzipped
+# tar) and feedback and partial output (raw bytes). Running a job
+# returns at once; its result is then long-polled from /result. The
+# agent pushes events to Tango as server-sent events on /events: its
+# load every DOCKER_HOST_HEARTBEAT_INTERVAL seconds, which doubles as
+# its heartbeat, and the VMs it acquires and releases.
+#
+# Usage: python3 tangoAgent.py [port]
+#
+import asyncio
+import collections
+import hmac
+import itertools
+import json
+import logging
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import tornado.ioloop
+import tornado.iostream
+import tornado.locks
+import tornado.web
+
+from config import Config
+from tangoObjects import InputFile, TangoMachine
+from vmms.hostInventory import parseProbe, probeCommand
+from vmms.processSupervisor import run
+
+# Threads for the VMMS operations other than running jobs
+_THREADS = 64
+
+# Threads for running jobs. Each running job holds one.
+_JOB_THREADS = 64
+
+# Number of past events kept for clients that reconnect
+_EVENTS_KEPT = 1000
+
+
+class TangoAgent(object):
+    def __init__(self, vmms):
+        """vmms is the VMMS that runs the jobs (a LocalDocker)"""
+        self.vmms = vmms
+        self.executor = ThreadPoolExecutor(max_workers=_THREADS)
+        # Running jobs have their own threads, so that they cannot starve
+        # the requests that Tango makes meanwhile
+        self.jobs = ThreadPoolExecutor(max_workers=_JOB_THREADS)
+        self.ids = itertools.count(1)
+        # pool key -> the agent's idle VMs of that image and size
+        self.idle = {}
+        # pool key -> number of VMs being started for that pool
+        self.warming = {}
+        # Tango instance name -> (the agent's VM, pool key, Tango VM id)
+        self.bound = {}
+        # Tango instance name -> future of its running job
+        self.runs = {}
+        self.lock = threading.Lock()
+        # (sequence number, event) of the latest events
+        self.events = collections.deque(maxlen=_EVENTS_KEPT)
+        self.sequence = itertools.count(1)
+        self.changed = tornado.locks.Condition()
+        self.loop = None
+        self.log = logging.getLogger("TangoAgent")
+
+    def start(self):
+        """start - Remove what a previous agent left behind, and start
+        publishing the host's status. Must be called on the IO loop.
+        """
+        self.loop = tornado.ioloop.IOLoop.current()
+        vms = self.vmms.getVMs()
+        if vms:
+            self.log.warning("Removing leftover VMs %s" % [vm.name for vm in vms])
+            for vm in vms:
+                self.vmms.destroyVM(vm)
+        thread = threading.Thread(target=self.__status)
+        thread.daemon = True
+        thread.start()
+
+    def publish(self, event):
+        """publish - Push event to every client following /events"""
+        with self.lock:
+            self.events.append((next(self.sequence), event))
+        if self.loop:
+            self.loop.add_callback(self.changed.notify_all)
+
+    def eventsSince(self, sequence):
+        with self.lock:
+            return [(seq, event) for (seq, event) in self.events if seq > sequence]
+
+    def lastSequence(self):
+        with self.lock:
+            return self.events[-1][0] if self.events else 0
+
+    def __status(self):
+        while True:
+            try:
+                self.publish(self.status())
+            except Exception as e:
+                self.log.error("Status failed: %s" % e)
+            time.sleep(Config.DOCKER_HOST_HEARTBEAT_INTERVAL)
+
+    def status(self):
+        """status - Returns the host's load (see parseProbe), the idle
+        VMs in each pool, and the number of VMs bound to Tango VMs
+        """
+        result = run(
+            ["sh", "-c", probeCommand()],
+            Config.DOCKER_HOST_HEARTBEAT_INTERVAL,
+            capture=True,
+        )
+        with self.lock:
+            pools = dict((key, len(vms)) for (key, vms) in self.idle.items())
+            bound = len(self.bound)
+        return {
+            "type": "status",
+            "load": parseProbe(result.output),
+            "pools": pools,
+            "vms": bound,
+        }
+
+    #
+    # Warm pools
+    #
+    def _poolKey(self, spec):
+        return "%s/%s/%s" % (spec["image"], spec.get("cores"), spec.get("memory"))
+
+    def _newVM(self, spec, max_secs):
+        """_newVM - Start one of the agent's VMs. Returns it once its
+        container runs, or None if it does not come up in max_secs.
+        """
+        vm = TangoMachine(
+            name=spec["image"],
+            image=spec["image"],
+            vmms="localDocker",
+            cores=spec.get("cores"),
+            memory=spec.get("memory"),
+        )
+        vm.id = next(self.ids)
+        self.vmms.initializeVM(vm)
+        if self.vmms.waitVM(vm, max_secs) != 0:
+            self.vmms.destroyVM(vm)
+            return None
+        return vm
+
+    def _refill(self, key, spec):
+        """_refill - Start VMs in the background until key's pool has
+        AGENT_WARM_CONTAINERS, counting those already starting
+        """
+        with self.lock:
+            missing = (
+                Config.AGENT_WARM_CONTAINERS
+                - len(self.idle.get(key, []))
+                - self.warming.get(key, 0)
+            )
+            self.warming[key] = self.warming.get(key, 0) + max(missing, 0)
+        for i in range(missing):
+            self.executor.submit(self._warm, key, spec)
+
+    def _warm(self, key, spec):
+        try:
+            vm = self._newVM(spec, Config.WAITVM_TIMEOUT)
+        except Exception as e:
+            self.log.error("Failed to warm a VM for %s: %s" % (key, e))
+            vm = None
+        with self.lock:
+            self.warming[key] -= 1
+            if vm:
+                self.idle.setdefault(key, []).append(vm)
+
+    def _release(self, name):
+        """_release - Unbind the Tango VM name once its job is over,
+        and return the agent's VM to its pool with a fresh container,
+        or destroy it if the pool is full
+        """
+        with self.lock:
+            if name not in self.bound:
+                return
+            (vm, key, id) = self.bound.pop(name)
+            self.runs.pop(name, None)
+            keep = len(self.idle.get(key, [])) < Config.AGENT_WARM_CONTAINERS
+        if keep:
+            # Recycling starts before the VM is idle, so that waitVM
+            # waits for it when the VM is acquired again
+            self.vmms.recycleVM(vm)
+            with self.lock:
+                self.idle.setdefault(key, []).append(vm)
+        else:
+            self.vmms.destroyVM(vm)
+        self.publish({"type": "released", "name": name})
+
+    def _vm(self, name):
+        with self.lock:
+            if name not in self.bound:
+                raise KeyError("Unknown VM %s" % name)
+            return self.bound[name][0]
+
+    #
+    # VMMS operations, on Tango VMs by instance name
+    #
+    def acquire(self, name, spec, max_secs):
+        """acquire - Bind the Tango VM name to a running VM of the
+        agent, warm if there is one. Returns 0, or -1 if no VM is
+        running within max_secs.
+        """
+        start_time = time.time()
+        key = self._poolKey(spec)
+        self.destroy(name)
+        with self.lock:
+            idle = self.idle.get(key)
+            vm = idle.pop(0) if idle else None
+        # Warm VMs may still be recycling after their last job
+        if vm and self.vmms.waitVM(vm, max_secs) != 0:
+            self.vmms.destroyVM(vm)
+            vm = None
+        if not vm:
+            vm = self._newVM(spec, max_secs - (time.time() - start_time))
+        self._refill(key, spec)
+        if vm is None:
+            return -1
+
+        with self.lock:
+            self.bound[name] = (vm, key, spec.get("id"))
+        self.publish({"type": "acquired", "name": name})
+        return 0
+
+    def copyIn(self, name, tarPath, shared):
+        """copyIn - Copy the files in the gzipped tar at tarPath to the
+        VM, marking those named in shared as shared lab artifacts
+        """
+        vm = self._vm(name)
+        # Stage the files next to the volumes, so that they are linked
+        # rather than copied
+        incoming = tempfile.mkdtemp(
+            prefix=".incoming-", dir=Config.DOCKER_VOLUME_PATH or None
+        )
+        try:
+            with tarfile.open(tarPath, "r:gz") as tar:
+                members = [member for member in tar.getmembers() if member.isfile()]
+                for member in members:
+                    if os.path.basename(member.name) != member.name:
+                        raise ValueError("Bad input file name %s" % member.name)
+                tar.extractall(incoming, members)
+            inputFiles = []
+            for member in members:
+                path = os.path.join(incoming, member.name)
+                os.chmod(path, os.stat(path).st_mode & 0o555)
+                inputFiles.append(InputFile(path, member.name, member.name in shared))
+            return self.vmms.copyIn(vm, inputFiles)
+        finally:
+            shutil.rmtree(incoming, ignore_errors=True)
+
+    def runJob(self, name, runTimeout, maxOutputFileSize, disableNetwork):
+        """runJob - Start the job in the VM, and return at once. The
+        result is collected with result().
+        """
+        vm = self._vm(name)
+
+        def runJob():
+            ret = self.vmms.runJob(vm, runTimeout, maxOutputFileSize, disableNetwork)
+            usage = None
+            if hasattr(self.vmms, "getResourceUsage"):
+                usage = self.vmms.getResourceUsage(vm)
+            self.publish({"type": "finished", "name": name, "status": ret})
+            return {"status": ret, "usage": usage}
+
+        with self.lock:
+            self.runs[name] = self.jobs.submit(runJob)
+
+    def copyOut(self, name):
+        """copyOut - Returns (status, feedback) of the VM's job, and
+        releases the VM
+        """
+        vm = self._vm(name)
+        (fd, path) = tempfile.mkstemp(prefix="feedback")
+        os.close(fd)
+        try:
+            ret = self.vmms.copyOut(vm, path)
+            with open(path, "rb") as f:
+                feedback = f.read()
+        finally:
+            os.unlink(path)
+        self._release(name)
+        return (ret, feedback)
+
+    def destroy(self, name):
+        """destroy - Destroy the agent's VM bound to name"""
+        with self.lock:
+            entry = self.bound.pop(name, None)
+            self.runs.pop(name, None)
+        if entry:
+            self.vmms.destroyVM(entry[0])
+            self.publish({"type": "destroyed", "name": name})
+
+    def getPartialOutput(self, name, offset):
+        return self.vmms.getPartialOutput(self._vm(name), offset)
+
+    def getVMs(self):
+        """getVMs - Returns the Tango VMs bound to the agent's VMs"""
+        with self.lock:
+            return [
+                {"name": name, "id": id, "image": vm.image}
+                for (name, (vm, key, id)) in self.bound.items()
+            ]
+
+
+#
+# Request handlers
+#
+class AgentHandler(tornado.web.RequestHandler):
+    def initialize(self, agent):
+        self.agent = agent
+
+    def prepare(self):
+        key = self.request.headers.get("X-Tango-Agent-Key", "")
+        if not hmac.compare_digest(key.encode(), Config.AGENT_KEY.encode()):
+            raise tornado.web.HTTPError(403)
+
+    def call(self, function, *args):
+        """call - Run a blocking agent function off the IO loop"""
+        return tornado.ioloop.IOLoop.current().run_in_executor(
+            self.agent.executor, function, *args
+        )
+
+    def args(self):
+        return json.loads(self.request.body or b"{}")
+
+    def write_error(self, status_code, **kwargs):
+        error = self._reason
+        if "exc_info" in kwargs:
+            error = str(kwargs["exc_info"][1])
+        self.finish({"error": error})
+
+
+class StatusHandler(AgentHandler):
+    async def get(self):
+        self.write(await self.call(self.agent.status))
+
+
+class AcquireHandler(AgentHandler):
+    async def post(self, name):
+        args = self.args()
+        status = await self.call(self.agent.acquire, name, args["vm"], args["timeout"])
+        self.write({"status": status})
+
+
+@tornado.web.stream_request_body
+class InputHandler(AgentHandler):
+    def prepare(self):
+        super().prepare()
+        self.tempfile = tempfile.NamedTemporaryFile(prefix="input", delete=False)
+
+    def data_received(self, chunk):
+        self.tempfile.write(chunk)
+
+    async def put(self, name):
+        self.tempfile.close()
+        try:
+            status = await self.call(
+                self.agent.copyIn,
+                name,
+                self.tempfile.name,
+                self.get_arguments("shared"),
+            )
+        finally:
+            os.unlink(self.tempfile.name)
+        self.write({"status": status})
+
+
+class RunHandler(AgentHandler):
+    async def post(self, name):
+        args = self.args()
+        await self.call(
+            self.agent.runJob,
+            name,
+            args["runTimeout"],
+            args["maxOutputFileSize"],
+            args["disableNetwork"],
+        )
+        self.write({"status": 0})
+
+
+class ResultHandler(AgentHandler):
+    async def get(self, name):
+        """get - Returns the result of the VM's job once it is done,
+        waiting at most ?wait= seconds for it
+        """
+        future = self.agent.runs.get(name)
+        if future is None:
+            raise tornado.web.HTTPError(404, reason="No job running in %s" % name)
+        try:
+            result = await asyncio.wait_for(
+                asyncio.shield(asyncio.wrap_future(future)),
+                float(self.get_argument("wait", "0")),
+            )
+            self.write(dict(result, done=True))
+        except asyncio.TimeoutError:
+            self.write({"done": False})
+
+
+class OutputHandler(AgentHandler):
+    async def get(self, name):
+        (status, feedback) = await self.call(self.agent.copyOut, name)
+        self.set_header("Content-Type", "application/octet-stream")
+        self.set_header("X-Tango-Status", str(status))
+        self.write(feedback)
+
+
+class DestroyHandler(AgentHandler):
+    async def post(self, name):
+        await self.call(self.agent.destroy, name)
+        self.write({"status": 0})
+
+
+class PartialHandler(AgentHandler):
+    async def get(self, name):
+        offset = int(self.get_argument("offset", "0"))
+        self.set_header("Content-Type", "application/octet-stream")
+        self.write(await self.call(self.agent.getPartialOutput, name, offset))
+
+
+class VMsHandler(AgentHandler):
+    def get(self):
+        self.write({"vms": self.agent.getVMs()})
+
+
+class ImagesHandler(AgentHandler):
+    async def get(self):
+        self.write({"images": await self.call(self.agent.vmms.getImages)})
+
+
+class EventsHandler(AgentHandler):
+    async def get(self):
+        """get - Pushes the agent's events as server-sent events, from
+        the one after Last-Event-ID on, or from now
+        """
+        sequence = self.request.headers.get("Last-Event-ID")
+        sequence = int(sequence) if sequence else self.agent.lastSequence()
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        try:
+            while True:
+                for (sequence, event) in self.agent.eventsSince(sequence):
+                    self.write("id: %d\ndata: %s\n\n" % (sequence, json.dumps(event)))
+                await self.flush()
+                await self.agent.changed.wait(
+                    timeout=timedelta(seconds=Config.DOCKER_HOST_HEARTBEAT_INTERVAL)
+                )
+        except tornado.iostream.StreamClosedError:
+            pass
+
+
+def makeApplication(agent):
+    NAME = "[^/]+"
+    return tornado.web.Application(
+        [
+            (r"/status", StatusHandler, {"agent": agent}),
+            (r"/acquire/(%s)" % NAME, AcquireHandler, {"agent": agent}),
+            (r"/input/(%s)" % NAME, InputHandler, {"agent": agent}),
+            (r"/run/(%s)" % NAME, RunHandler, {"agent": agent}),
+            (r"/result/(%s)" % NAME, ResultHandler, {"agent": agent}),
+            (r"/output/(%s)" % NAME, OutputHandler, {"agent": agent}),
+            (r"/destroy/(%s)" % NAME, DestroyHandler, {"agent": agent}),
+            (r"/partial/(%s)" % NAME, PartialHandler, {"agent": agent}),
+            (r"/vms", VMsHandler, {"agent": agent}),
+            (r"/images", ImagesHandler, {"agent": agent}),
+            (r"/events", EventsHandler, {"agent": agent}),
+        ]
+    )
+
+
+async def main(port, agent):
+    agent.start()
+    makeApplication(agent).listen(port, max_buffer_size=Config.MAX_INPUT_FILE_SIZE)
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    if not Config.AGENT_KEY:
+        print("AGENT_KEY must be set in config.py to run the Tango agent")
+        sys.exit(1)
+    port = Config.AGENT_PORT
+    if len(sys.argv) > 1:
+        port = int(sys.argv[1])
+    # Agents that share a docker daemon must not share VM names
+    Config.PREFIX = "%s-agent%d" % (Config.PREFIX, port)
+
+    logging.basicConfig(
+        filename=Config.LOGFILE,
+        format="%(levelname)s|%(asctime)s|%(name)s|%(message)s",
+        level=Config.LOGLEVEL,
+    )
+    from vmms.localDocker import LocalDocker
+
+    asyncio.run(main(port, TangoAgent(LocalDocker())))
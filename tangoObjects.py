@@ -5,6 +5,7 @@
 from config import Config
 from queue import Queue
 import pickle
+import threading
 import redis
 
 redisConnection = None
@@ -24,12 +25,14 @@ class InputFile(object):
 
     """
     InputFile - Stores pointer to the path on the local machine and the
-    name of the file on the destination machine
+    name of the file on the destination machine. Shared files are lab
+    artifacts that are the same for every job of a courselab.
     """
 
-    def __init__(self, localFile, destFile):
+    def __init__(self, localFile, destFile, shared=False):
         self.localFile = localFile
         self.destFile = destFile
+        self.shared = shared
 
     def __repr__(self):
         return "InputFile(localFile: %s, destFile: %s)" % (
@@ -58,6 +61,7 @@ class TangoMachine(object):
         resume=None,
         id=None,
         instance_id=None,
+        tmpfs=None,
     ):
         self.name = name
         self.image = image
@@ -71,6 +75,8 @@ class TangoMachine(object):
         self.resume = resume
         self.id = id
         self.instance_id = id
+        # Size in MB of the tmpfs that jobs run in, if any
+        self.tmpfs = tmpfs
 
     def __repr__(self):
         return "TangoMachine(image: %s, vmms: %s)" % (self.image, self.vmms)
@@ -94,6 +100,7 @@ class TangoJob(object):
         accessKeyId=None,
         accessKey=None,
         disableNetwork=None,
+        courselab=None,
     ):
         self.assigned = False
         self.retries = 0
@@ -114,6 +121,9 @@ class TangoJob(object):
         self.accessKeyId = accessKeyId
         self.accessKey = accessKey
         self.disableNetwork = disableNetwork
+        self.courselab = courselab
+        # Resources the job used, as measured by the VMMS
+        self.usage = None
 
     def makeAssigned(self):
         self.syncRemote()
@@ -134,6 +144,11 @@ class TangoJob(object):
         self.syncRemote()
         return not self.assigned
 
+    def setUsage(self, usage):
+        self.syncRemote()
+        self.usage = usage
+        self.updateRemote()
+
     def appendTrace(self, trace_str):
         self.syncRemote()
         self.trace.append(trace_str)
@@ -175,6 +190,7 @@ class TangoJob(object):
         self.timeout = other_job.timeout
         self.trace = other_job.trace
         self.maxOutputFileSize = other_job.maxOutputFileSize
+        self.usage = other_job.usage
 
 
 def TangoIntValue(object_name, obj):
@@ -284,15 +300,6 @@ class TangoRemoteQueue(object):
         """Equivalent to get(False)."""
         return self.get(False)
 
-    def __getstate__(self):
-        ret = {}
-        ret["key"] = self.key
-        return ret
-
-    def __setstate__(self, dict):
-        self.__db = getRedisConnection()
-        self.__dict__.update(dict)
-
     def remove(self, item):
         items = self.__db.lrange(self.key, 0, -1)
         pickled_item = pickle.dumps(item)
@@ -302,6 +309,82 @@ class TangoRemoteQueue(object):
         self.__db.delete(self.key)
 
 
+def TangoSet(object_name):
+    if Config.USE_REDIS:
+        return TangoRemoteSet(object_name)
+    else:
+        return TangoNativeSet()
+
+
+class TangoRemoteSet(object):
+
+    """Set of strings with Redis Backend. Every operation is a single
+    Redis command, so concurrent updates from several processes are
+    never lost.
+    """
+
+    def __init__(self, name, namespace="set"):
+        self.__db = getRedisConnection()
+        self.key = "%s:%s" % (namespace, name)
+
+    def __contains__(self, item):
+        return self.__db.sismember(self.key, str(item))
+
+    def add(self, item):
+        """Add item to the set. Returns True if it was not already there."""
+        return self.__db.sadd(self.key, str(item)) == 1
+
+    def remove(self, item):
+        """Remove item from the set. Returns True if it was there."""
+        return self.__db.srem(self.key, str(item)) == 1
+
+    def members(self):
+        return [member.decode() for member in self.__db.smembers(self.key)]
+
+    def size(self):
+        return self.__db.scard(self.key)
+
+    def _clean(self):
+        self.__db.delete(self.key)
+
+
+class TangoNativeSet(object):
+
+    """Python thread safe set of strings"""
+
+    def __init__(self):
+        self.set = set()
+        self.mutex = threading.Lock()
+
+    def __contains__(self, item):
+        return str(item) in self.set
+
+    def add(self, item):
+        with self.mutex:
+            if str(item) in self.set:
+                return False
+            self.set.add(str(item))
+            return True
+
+    def remove(self, item):
+        with self.mutex:
+            if str(item) not in self.set:
+                return False
+            self.set.remove(str(item))
+            return True
+
+    def members(self):
+        with self.mutex:
+            return list(self.set)
+
+    def size(self):
+        return len(self.set)
+
+    def _clean(self):
+        with self.mutex:
+            self.set.clear()
+
+
 # This is an abstract class that decides on
 # if we should initiate a TangoRemoteDictionary or TangoNativeDictionary
 # Since there are no abstract classes in Python, we use a simple method
@@ -351,8 +434,11 @@ class TangoRemoteDictionary(object):
         return valslist
 
     def delete(self, id):
+        """Remove id from the dictionary. Returns True if this call
+        removed it, so concurrent callers can use it to claim an entry.
+        """
         self._remoteLocation = None
-        self.r.hdel(self.hash_name, id)
+        return self.r.hdel(self.hash_name, str(id)) == 1
 
     def _clean(self):
         # only for testing
@@ -391,8 +477,11 @@ class TangoNativeDictionary(object):
         return list(self.dict.values())
 
     def delete(self, id):
-        if str(id) in list(self.dict.keys()):
+        """Remove id from the dictionary. Returns True if it was present."""
+        if str(id) in self.dict:
             del self.dict[str(id)]
+            return True
+        return False
 
     def items(self):
         return iter(
@@ -0,0 +1,197 @@
+import unittest
+import asyncio
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+
+import tornado.httpserver
+import tornado.netutil
+
+from config import Config
+from tangoAgent import TangoAgent, makeApplication
+from tangoObjects import InputFile, TangoMachine
+from vmms.agentDocker import AgentDocker
+
+
+class FakeVMMS(object):
+    """FakeVMMS - Runs "jobs" in memory: the feedback of a job is its
+    input files, joined
+    """
+
+    def __init__(self):
+        self.started = 0
+        self.vms = {}
+
+    def initializeVM(self, vm):
+        return vm
+
+    def waitVM(self, vm, max_secs):
+        if vm.id not in self.vms:
+            self.started += 1
+            self.vms[vm.id] = {}
+        return 0
+
+    def copyIn(self, vm, inputFiles):
+        for file in inputFiles:
+            with open(file.localFile) as f:
+                self.vms[vm.id][file.destFile] = (f.read(), file.shared)
+        return 0
+
+    def runJob(self, vm, runTimeout, maxOutputFileSize, disableNetwork):
+        return 0
+
+    def getResourceUsage(self, vm):
+        return {"cpu_seconds": 1.0}
+
+    def copyOut(self, vm, destFile):
+        files = self.vms[vm.id]
+        with open(destFile, "w") as f:
+            f.write(" ".join(files[name][0] for name in sorted(files)))
+        return 0
+
+    def recycleVM(self, vm):
+        self.vms[vm.id] = {}
+
+    def destroyVM(self, vm):
+        self.vms.pop(vm.id, None)
+
+    def getVMs(self):
+        return []
+
+    def getImages(self):
+        return ["autograding_image"]
+
+    def getPartialOutput(self, vm, offset=0):
+        return b"partial"[offset:]
+
+
+class TestAgent(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.config = (
+            Config.AGENT_KEY,
+            Config.DOCKER_HOSTS,
+            Config.DOCKER_VOLUME_PATH,
+            Config.DOCKER_HOST_HEARTBEAT_INTERVAL,
+        )
+        Config.AGENT_KEY = "secret"
+        Config.DOCKER_VOLUME_PATH = self.dir
+        Config.DOCKER_HOST_HEARTBEAT_INTERVAL = 0.2
+        # The agent's status counts the host's containers with docker
+        docker = os.path.join(self.dir, "docker")
+        with open(docker, "w") as f:
+            f.write("#!/bin/sh\n")
+        os.chmod(docker, stat.S_IRWXU)
+        self.path = os.environ["PATH"]
+        os.environ["PATH"] = "%s:%s" % (self.dir, self.path)
+
+        # Run an agent on localhost, on its own IO loop
+        self.vmms = FakeVMMS()
+        self.agent = TangoAgent(self.vmms)
+        sockets = tornado.netutil.bind_sockets(0, "127.0.0.1")
+        self.host = "127.0.0.1:%d" % sockets[0].getsockname()[1]
+        Config.DOCKER_HOSTS = [self.host]
+        started = threading.Event()
+
+        async def serve():
+            self.agent.start()
+            server = tornado.httpserver.HTTPServer(makeApplication(self.agent))
+            server.add_sockets(sockets)
+            started.set()
+            await asyncio.Event().wait()
+
+        thread = threading.Thread(target=asyncio.run, args=(serve(),))
+        thread.daemon = True
+        thread.start()
+        started.wait()
+
+        self.docker = AgentDocker()
+        self.vm = TangoMachine(
+            name="job", image="autograding_image", cores=1, memory=512, id=1
+        )
+
+    def tearDown(self):
+        (
+            Config.AGENT_KEY,
+            Config.DOCKER_HOSTS,
+            Config.DOCKER_VOLUME_PATH,
+            Config.DOCKER_HOST_HEARTBEAT_INTERVAL,
+        ) = self.config
+        os.environ["PATH"] = self.path
+        shutil.rmtree(self.dir)
+
+    def inputFile(self, name, contents, shared=False):
+        path = os.path.join(self.dir, name)
+        with open(path, "w") as f:
+            f.write(contents)
+        return InputFile(path, name, shared)
+
+    def waitFor(self, condition):
+        for i in range(50):
+            if condition():
+                return True
+            time.sleep(0.1)
+        return False
+
+    def test_job(self):
+        self.assertEqual(self.docker.waitVM(self.vm, 5), 0)
+        self.assertEqual(self.vm.domain_name, self.host)
+        self.assertTrue(self.docker.existsVM(self.vm))
+        inputs = [
+            self.inputFile("Makefile", "autograde:", shared=True),
+            self.inputFile("handin.c", "int main;"),
+        ]
+        self.assertEqual(self.docker.copyIn(self.vm, inputs), 0)
+        self.assertEqual(self.docker.runJob(self.vm, 5, 1024, True), 0)
+        self.assertEqual(self.docker.getResourceUsage(self.vm), {"cpu_seconds": 1.0})
+        self.assertEqual(self.docker.getPartialOutput(self.vm, 2), b"rtial")
+        self.assertEqual(
+            [vm.name for vm in self.docker.getVMs()],
+            [self.docker.instanceName(1, "autograding_image")],
+        )
+
+        feedback = os.path.join(self.dir, "feedback")
+        self.assertEqual(self.docker.copyOut(self.vm, feedback), 0)
+        self.assertEqual(open(feedback).read(), "autograde: int main;")
+        self.assertEqual(self.docker.getVMs(), [])
+
+        # The agent keeps a warm pool for the image, and the next job
+        # gets one of its containers
+        self.assertTrue(
+            self.waitFor(lambda: self.vmms.started == 1 + Config.AGENT_WARM_CONTAINERS)
+        )
+        self.vm.id = 2
+        self.assertEqual(self.docker.waitVM(self.vm, 5), 0)
+        self.assertTrue(
+            self.waitFor(lambda: self.vmms.started == 2 + Config.AGENT_WARM_CONTAINERS)
+        )
+        self.docker.destroyVM(self.vm)
+        self.assertEqual(self.docker.getVMs(), [])
+        self.assertFalse(self.docker.existsVM(self.vm))
+
+    def test_unbound(self):
+        # Requests need the key, and a bound VM
+        self.vm.domain_name = self.host
+        self.assertEqual(self.docker.runJob(self.vm, 5, 1024, True), 1)
+        self.docker.sessions[self.host].headers["X-Tango-Agent-Key"] = "wrong"
+        self.assertEqual(self.docker.waitVM(self.vm, 0.5), -1)
+
+    def test_events(self):
+        # The agent's pushed status is its heartbeat and load report
+        self.assertEqual(self.docker.getImages(), ["autograding_image"])
+        self.assertTrue(
+            self.waitFor(
+                lambda: self.docker._heartbeat(self.host)
+                and self.host in self.docker.reports
+            )
+        )
+        self.assertEqual(
+            self.docker._probeHost(self.host), self.docker.reports[self.host]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+from coreAllocator import CoreAllocator, detectTopology, parseCPUList, formatCPUList
+
+
+class TestCoreAllocator(unittest.TestCase):
+    def setUp(self):
+        # Two NUMA nodes of two physical cores, each with two threads
+        self.allocator = CoreAllocator({0: [(0, 4), (1, 5)], 1: [(2, 6), (3, 7)]})
+
+    def test_parseCPUList(self):
+        self.assertEqual(parseCPUList("0-3,8\n"), [0, 1, 2, 3, 8])
+        self.assertEqual(parseCPUList(""), [])
+        self.assertEqual(formatCPUList([5, 1, 0]), "0,1,5")
+
+    def test_allocate(self):
+        # Whole physical cores, from a single node
+        (cpus, node) = self.allocator.allocate("a", 1)
+        self.assertEqual(cpus, [0, 4])
+
+        # The partly used node is filled first
+        (cpus, node2) = self.allocator.allocate("b", 1)
+        self.assertEqual(node2, node)
+        self.assertEqual(cpus, [1, 5])
+
+        (cpus, node3) = self.allocator.allocate("c", 2)
+        self.assertNotEqual(node3, node)
+        self.assertEqual(cpus, [2, 3, 6, 7])
+
+        # Nothing is left, so the next job runs unpinned
+        self.assertIsNone(self.allocator.allocate("d", 1))
+
+        # Allocating again for the same job returns what it holds
+        self.assertEqual(self.allocator.allocate("a", 1), ([0, 4], node))
+
+    def test_release(self):
+        self.allocator.allocate("a", 2)
+        self.allocator.allocate("b", 2)
+        self.assertIsNone(self.allocator.allocate("c", 1))
+
+        self.allocator.release("a")
+        self.allocator.release("a")
+        self.assertIsNotNone(self.allocator.allocate("c", 1))
+        stats = self.allocator.getStats()
+        self.assertEqual(sum(node["free"] for node in stats.values()), 1)
+
+    def test_detectTopology(self):
+        topology = detectTopology()
+        cpus = [cpu for cores in topology.values() for core in cores for cpu in core]
+        self.assertGreater(len(cpus), 0)
+        self.assertEqual(len(cpus), len(set(cpus)))
+
+
+if __name__ == "__main__":
+    unittest.main()
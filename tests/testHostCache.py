@@ -0,0 +1,118 @@
+import unittest
+import gzip
+import os
+import shutil
+import tarfile
+import tempfile
+
+from config import Config
+from tangoObjects import InputFile
+from vmms.hostCache import MISSING, HostCache
+from vmms.processSupervisor import run
+
+
+class TestHostCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.config = (Config.DOCKER_VOLUME_PATH, Config.DOCKER_HOST_CACHE_SIZE)
+        # The "host" is this machine, with its volumes under self.dir
+        Config.DOCKER_VOLUME_PATH = os.path.join(self.dir, "volumes", "")
+        self.cache = HostCache()
+        self.inputs = [
+            self.inputFile("autograde.tar", "grader" * 1000),
+            self.inputFile("Makefile", "autograde:"),
+            self.inputFile("handin.c", "int main;"),
+        ]
+
+    def tearDown(self):
+        (Config.DOCKER_VOLUME_PATH, Config.DOCKER_HOST_CACHE_SIZE) = self.config
+        shutil.rmtree(self.dir)
+
+    def inputFile(self, name, contents):
+        path = os.path.join(self.dir, name)
+        with open(path, "w") as f:
+            f.write(contents)
+        return InputFile(path, name)
+
+    def copyIn(self, name):
+        """copyIn - Run the command distDocker would on the host"""
+        volumePath = os.path.join(Config.DOCKER_VOLUME_PATH, name, "")
+        (keys, missing) = self.cache.missing("host1", self.inputs)
+
+        def writeTar(stdin):
+            with gzip.GzipFile(fileobj=stdin, mode="wb") as gz:
+                with tarfile.open(fileobj=gz, mode="w|") as tar:
+                    for (key, path) in missing.items():
+                        tar.add(path, arcname=key)
+
+        ret = run(
+            [
+                "sh",
+                "-c",
+                self.cache.command(volumePath, self.inputs, keys, missing, name),
+            ],
+            10,
+            input=writeTar if missing else None,
+        ).returncode
+        if ret == 0:
+            self.cache.stored("host1", self.inputs, keys, missing)
+        return (ret, volumePath, missing)
+
+    def test_copyIn(self):
+        (ret, volumePath, missing) = self.copyIn("job1")
+        self.assertEqual(ret, 0)
+        self.assertEqual(len(missing), 3)
+        self.assertEqual(open(volumePath + "Makefile").read(), "autograde:")
+
+        # The next job of the lab sends only its handin
+        self.inputs[2] = self.inputFile("handin.c", "int main() {}")
+        (ret, volumePath2, missing) = self.copyIn("job2")
+        self.assertEqual(ret, 0)
+        self.assertEqual(list(missing.values()), [self.inputs[2].localFile])
+        self.assertTrue(
+            os.path.samefile(
+                volumePath + "autograde.tar", volumePath2 + "autograde.tar"
+            )
+        )
+        self.assertEqual(open(volumePath2 + "handin.c").read(), "int main() {}")
+
+        stats = self.cache.getStats("host1")
+        self.assertEqual(stats["bytes_reused"], 6000 + len("autograde:"))
+
+    def test_missing(self):
+        self.copyIn("job1")
+        shutil.rmtree(self.cache.dir)
+
+        # The host lost its cache, so the command fails until Tango
+        # sends everything again
+        (ret, volumePath, missing) = self.copyIn("job2")
+        self.assertEqual(ret, MISSING)
+        self.cache.forget("host1")
+        (ret, volumePath, missing) = self.copyIn("job2")
+        self.assertEqual(ret, 0)
+        self.assertEqual(len(missing), 3)
+
+    def test_evict(self):
+        Config.DOCKER_HOST_CACHE_SIZE = 0
+        (ret, volumePath, missing) = self.copyIn("job1")
+        self.assertEqual(ret, 0)
+        oldHandin = self.cache.key(self.inputs[2].localFile)
+
+        # The next job evicts the files it does not use, but not its own,
+        # which Tango now counts as cached
+        self.inputs[2] = self.inputFile("handin.c", "int main() {}")
+        (ret, volumePath2, missing) = self.copyIn("job2")
+        self.assertEqual(ret, 0)
+        (keys, missing) = self.cache.missing("host1", self.inputs)
+        self.assertEqual(sorted(os.listdir(self.cache.dir)), sorted(keys))
+        self.assertNotIn(oldHandin, keys)
+        # Evicted files stay in the volumes that link them
+        self.assertEqual(open(volumePath + "handin.c").read(), "int main;")
+
+        (ret, volumePath3, missing) = self.copyIn("job3")
+        self.assertEqual(ret, 0)
+        self.assertEqual(missing, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
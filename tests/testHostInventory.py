@@ -0,0 +1,108 @@
+import unittest
+import time
+
+import redis
+
+from config import Config
+from tangoObjects import TangoMachine
+from vmms.hostInventory import HostInventory, parseProbe
+
+
+class TestHostInventory(unittest.TestCase):
+    def setUp(self):
+        if Config.USE_REDIS:
+            __db = redis.StrictRedis(Config.REDIS_HOSTNAME, Config.REDIS_PORT, db=0)
+            __db.flushall()
+
+        self.reports = {
+            "idle": parseProbe(b"4\n0.00\n8192000\n8000000\n0\n"),
+            "busy": parseProbe(b"4\n3.50\n8192000\n4000000\n3\n"),
+            "down": None,
+        }
+        self.inventory = HostInventory(
+            self.reports.get, hosts=lambda: ["idle", "busy", "down"]
+        )
+        self.vm = TangoMachine(name="autograding_image", cores=1, memory=512)
+
+    def test_parseProbe(self):
+        report = self.reports["idle"]
+        self.assertEqual(report["cores"], 4)
+        self.assertEqual(report["memory"], 8000)
+        self.assertEqual(report["other_containers"], 0)
+        self.assertIsNone(parseProbe(b"ssh: connect failed"))
+
+    def test_leastLoaded(self):
+        Config.DOCKER_PLACEMENT = "least_loaded"
+        # The idle host takes VMs until it is as loaded as the busy one
+        hosts = [self.inventory.place("vm%d" % i, self.vm) for i in range(4)]
+        self.assertEqual(hosts, ["idle", "idle", "idle", "idle"])
+        self.assertEqual(self.inventory.place("vm4", self.vm), "busy")
+
+        # Released VMs no longer count against their host
+        self.inventory.release("vm0")
+        self.inventory.release("vm0")
+        self.assertEqual(self.inventory.place("vm5", self.vm), "idle")
+
+        stats = self.inventory.getStats()
+        self.assertEqual(stats["idle"]["placements"], 5)
+        self.assertEqual(stats["idle"]["vms"], 4)
+        self.assertIsNone(stats["down"]["report"])
+
+    def test_twoChoices(self):
+        Config.DOCKER_PLACEMENT = "two_choices"
+        try:
+            for i in range(10):
+                self.assertNotEqual(self.inventory.place("vm%d" % i, self.vm), "down")
+        finally:
+            Config.DOCKER_PLACEMENT = "least_loaded"
+
+    def test_exclude(self):
+        Config.DOCKER_PLACEMENT = "least_loaded"
+        host = self.inventory.place("vm0", self.vm, exclude={"idle"})
+        self.assertEqual(host, "busy")
+        self.inventory.recordFailure(host)
+        self.assertEqual(self.inventory.getStats()["busy"]["failures"], 1)
+
+        # Placing a VM again moves it
+        self.assertEqual(self.inventory.place("vm0", self.vm), "idle")
+        self.assertEqual(self.inventory.getStats()["busy"]["vms"], 0)
+
+    def test_failureDetector(self):
+        events = []
+        inventory = HostInventory(
+            self.reports.get,
+            hosts=lambda: ["idle", "busy", "down"],
+            onDown=lambda host, keys: events.append(("down", host, keys)),
+            onUp=lambda host: events.append(("up", host)),
+        )
+        # Hosts that never answered are down from the start
+        self.assertEqual(inventory.place("vm0", self.vm), "idle")
+        self.assertEqual(inventory.hostOf("vm0"), "idle")
+        self.assertEqual(events, [("down", "down", [])])
+        self.assertTrue(inventory.isDown("down"))
+        self.assertNotIn("down", inventory.liveHosts())
+
+        # A host that stops answering is marked down once, with its VMs
+        now = time.time() + Config.DOCKER_HOST_FAILURE_TIMEOUT + 1
+        inventory.beat(["busy"], now)
+        inventory.beat(["busy"], now + 1)
+        self.assertEqual(events[1:], [("down", "idle", ["vm0"])])
+        self.assertTrue(inventory.isDown("idle"))
+        # and stops counting them
+        self.assertIsNone(inventory.hostOf("vm0"))
+        self.assertEqual(inventory.getStats()["idle"]["vms"], 0)
+        inventory.release("vm0")
+        self.assertEqual(inventory.getStats()["idle"]["vms"], 0)
+        for i in range(5):
+            self.assertEqual(inventory.place("vm%d" % i, self.vm), "busy")
+        self.assertEqual(inventory.getStats()["idle"]["status"], "down")
+
+        # Hosts that answer again are re-admitted
+        inventory.beat(["idle", "busy", "down"], now + 2)
+        self.assertEqual(events[2:], [("up", "idle"), ("up", "down")])
+        self.assertEqual(inventory.liveHosts(), ["idle", "busy", "down"])
+        self.assertEqual(inventory.getStats()["idle"]["status"], "up")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+import os
+import shutil
+import stat
+import tempfile
+
+from inputStore import InputStore, stage
+
+
+class TestInputStore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = InputStore(os.path.join(self.dir, ".store"))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def upload(self, name, contents):
+        path = os.path.join(self.dir, "upload.tmp")
+        with open(path, "w") as f:
+            f.write(contents)
+        dest = os.path.join(self.dir, name)
+        return (self.store.add(path, dest), dest)
+
+    def test_add(self):
+        (blob, dest) = self.upload("autograde.tar", "grader")
+        self.assertEqual(open(dest).read(), "grader")
+        self.assertTrue(os.path.samefile(blob, dest))
+        self.assertFalse(os.stat(blob).st_mode & stat.S_IWUSR)
+
+        # Identical contents are stored once
+        (blob2, dest2) = self.upload("Makefile", "grader")
+        self.assertEqual(blob, blob2)
+        self.assertEqual(os.stat(blob).st_nlink, 3)
+
+    def test_prune(self):
+        (blob, dest) = self.upload("handin.c", "v1")
+        (newBlob, dest) = self.upload("handin.c", "v2")
+        self.assertNotEqual(blob, newBlob)
+
+        self.store.prune(grace=0)
+        self.assertFalse(os.path.exists(blob))
+        self.assertTrue(os.path.exists(newBlob))
+
+    def test_addAfterPrune(self):
+        (blob, dest) = self.upload("handin.c", "v1")
+        # Another process pruned the stored file, as if dest had been
+        # replaced in the meantime
+        os.unlink(blob)
+        (blob2, dest2) = self.upload("handin2.c", "v1")
+        self.assertEqual(blob, blob2)
+        self.assertEqual(open(dest2).read(), "v1")
+        self.assertTrue(os.path.samefile(blob, dest2))
+
+    def test_stage(self):
+        (blob, dest) = self.upload("autograde.tar", "grader")
+        staged = os.path.join(self.dir, "staged")
+        stage(dest, staged)
+        self.assertTrue(os.path.samefile(blob, staged))
+
+        # Writable files are never linked
+        writable = os.path.join(self.dir, "writable")
+        with open(writable, "w") as f:
+            f.write("data")
+        stage(writable, staged)
+        self.assertFalse(os.path.samefile(writable, staged))
+        self.assertEqual(open(staged).read(), "data")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,7 +2,7 @@ import unittest
 import redis
 
 from jobQueue import JobQueue
-from tangoObjects import TangoIntValue, TangoJob
+from tangoObjects import TangoIntValue, TangoJob, TangoMachine
 from config import Config
 
 
@@ -112,6 +112,16 @@ class TestJobQueue(unittest.TestCase):
         job = self.jobQueue.getNextPendingJob()
         self.assertMultiLineEqual(str(job.id), self.jobId2)
 
+    def test_deferJob(self):
+        job = self.jobQueue.getNextPendingJob()
+        self.jobQueue.deferJob(job.id)
+        # The deferred job goes behind the others, and is not a retry
+        job = self.jobQueue.getNextPendingJob()
+        self.assertMultiLineEqual(str(job.id), self.jobId2)
+        job = self.jobQueue.getNextPendingJob()
+        self.assertMultiLineEqual(str(job.id), self.jobId1)
+        self.assertEqual(job.retries, 0)
+
     def test_assignJob(self):
         self.jobQueue.assignJob(self.jobId1)
         job = self.jobQueue.get(self.jobId1)
@@ -135,6 +145,23 @@ class TestJobQueue(unittest.TestCase):
         self.assertEqual(info["size_deadjobs"], 1)
         self.assertEqual(info["size_unassignedjobs"], 1)
 
+    def test_recordUsage(self):
+        vm = TangoMachine(name="autograding_image", image="autograding_image")
+        for (cpu, memory) in [(1.0, 100), (3.0, 300)]:
+            job = TangoJob(name="sample_job", vm=vm, courselab="lab")
+            job.setUsage({"cpu_seconds": cpu, "memory_peak": memory})
+            self.jobQueue.recordUsage(job)
+        # Jobs without usage are not counted
+        self.jobQueue.recordUsage(TangoJob(name="sample_job", vm=vm, courselab="lab"))
+
+        (usage,) = self.jobQueue.getUsage()
+        self.assertEqual(usage["courselab"], "lab")
+        self.assertEqual(usage["image"], "autograding_image")
+        self.assertEqual(usage["jobs"], 2)
+        self.assertEqual(usage["cpu_seconds"], 4.0)
+        self.assertEqual(usage["avg_cpu_seconds"], 2.0)
+        self.assertEqual(usage["max_memory_peak"], 300)
+
     def test__getNextID(self):
         init_id = self.jobQueue.nextID
         for i in range(1, Config.MAX_JOBID + 100):
@@ -0,0 +1,78 @@
+import unittest
+import os
+import shutil
+import stat
+import subprocess
+import tempfile
+
+from vmms.jobRunner import parseRunner, runnerScript
+from vmms.resourceUsage import parseUsage
+
+# Stands in for docker on the "host": the job's container prints its
+# usage and exits with status 3
+FAKE_DOCKER = """#!/bin/sh
+if [ "$1" = run ]; then
+    printf 'TANGO_RESOURCE_USAGE\\n== memory.peak\\n4096\\n'
+    exit 3
+fi
+"""
+
+
+class TestJobRunner(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        docker = os.path.join(self.dir, "docker")
+        with open(docker, "w") as f:
+            f.write(FAKE_DOCKER)
+        os.chmod(docker, stat.S_IRWXU)
+        self.volume = os.path.join(self.dir, "tango-1-image", "")
+        os.mkdir(self.volume)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def runScript(self, maxFeedback=1024):
+        script = runnerScript(
+            "tango-1-image",
+            self.volume,
+            "image",
+            "",
+            "su autolab -c 'make'",
+            maxFeedback,
+        )
+        env = dict(os.environ, PATH="%s:%s" % (self.dir, os.environ["PATH"]))
+        return subprocess.run(
+            ["sh", "-c", script], env=env, stdout=subprocess.PIPE, check=True
+        ).stdout
+
+    def test_run(self):
+        with open(self.volume + "feedback", "wb") as f:
+            f.write(b"Autodriver: Job exited with status 0\nTANGO_STATUS 9 9\n")
+        (status, containerOutput, feedback, timings) = parseRunner(self.runScript())
+        self.assertEqual(status, 3)
+        self.assertEqual(
+            feedback, b"Autodriver: Job exited with status 0\nTANGO_STATUS 9 9\n"
+        )
+        self.assertEqual(parseUsage(containerOutput), {"memory_peak": 4096})
+        self.assertGreaterEqual(timings["run_seconds"], 0)
+        # The volume is cleaned up
+        self.assertFalse(os.path.exists(self.volume))
+
+    def test_noFeedback(self):
+        (status, containerOutput, feedback, timings) = parseRunner(self.runScript())
+        self.assertIsNone(feedback)
+
+    def test_truncated(self):
+        with open(self.volume + "feedback", "wb") as f:
+            f.write(b"x" * 200000)
+        feedback = parseRunner(self.runScript(maxFeedback=0))[2]
+        self.assertEqual(len(feedback), 64 * 1024)
+
+    def test_unfinished(self):
+        self.assertIsNone(parseRunner(None))
+        self.assertIsNone(parseRunner(b"ssh: connect to host failed\n"))
+        self.assertIsNone(parseRunner(b"\nTANGO_FEEDBACK 4\nabcd"))
+
+
+if __name__ == "__main__":
+    unittest.main()
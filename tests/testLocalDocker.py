@@ -0,0 +1,142 @@
+import unittest
+import os
+import shutil
+import stat
+import subprocess
+import tempfile
+import time
+
+from config import Config
+from tangoObjects import InputFile, TangoMachine
+from vmms.localDocker import ContainerStates, LocalDocker
+
+
+class TestLocalDocker(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.config = (
+            Config.TIMER_POLL_INTERVAL,
+            Config.DOCKER_VOLUME_PATH,
+            Config.DOCKER_TRACK_EVENTS,
+            Config.DOCKER_SHARED_ARTIFACTS,
+        )
+        Config.TIMER_POLL_INTERVAL = 0.05
+        Config.DOCKER_VOLUME_PATH = os.path.join(self.dir, "volumes", "")
+        Config.DOCKER_TRACK_EVENTS = False
+        Config.DOCKER_SHARED_ARTIFACTS = True
+        self.path = os.environ["PATH"]
+        os.environ["PATH"] = "%s:%s" % (self.dir, self.path)
+
+    def tearDown(self):
+        (
+            Config.TIMER_POLL_INTERVAL,
+            Config.DOCKER_VOLUME_PATH,
+            Config.DOCKER_TRACK_EVENTS,
+            Config.DOCKER_SHARED_ARTIFACTS,
+        ) = self.config
+        os.environ["PATH"] = self.path
+        shutil.rmtree(self.dir)
+
+    def fakeDocker(self, script):
+        """fakeDocker - Put a docker command running script first on
+        the PATH
+        """
+        docker = os.path.join(self.dir, "docker")
+        with open(docker, "w") as f:
+            f.write("#!/bin/sh\n%s\n" % script)
+        os.chmod(docker, stat.S_IRWXU)
+
+    def inputFile(self, name, contents, shared=False):
+        path = os.path.join(self.dir, name)
+        with open(path, "w") as f:
+            f.write(contents)
+        return InputFile(path, name, shared)
+
+    def copyIn(self, docker, id, inputFiles):
+        """copyIn - Copy inputFiles into a new VM, and return its volume"""
+        vm = TangoMachine(name="lab", image="autograding_image", id=id)
+        self.assertEqual(docker.copyIn(vm, inputFiles), 0)
+        return docker.getVolumePath(docker.instanceName(id, vm.image))
+
+    def waitFor(self, condition):
+        for i in range(100):
+            if condition():
+                return True
+            time.sleep(0.05)
+        return False
+
+    def test_resubscribe(self):
+        # Every event stream fails at once, but its process lives on
+        pids = os.path.join(self.dir, "pids")
+        self.fakeDocker(
+            'if [ "$1" = events ]; then echo $$ >> %s; echo garbled; '
+            "exec sleep 1000; fi" % pids
+        )
+        states = ContainerStates()
+        states.start()
+
+        def subscriptions():
+            if not os.path.exists(pids):
+                return []
+            with open(pids) as f:
+                return [int(pid) for pid in f.read().split()]
+
+        self.assertTrue(self.waitFor(lambda: len(subscriptions()) >= 3))
+        states.stop()
+
+        def alive(pid):
+            try:
+                os.kill(pid, 0)
+                return True
+            except ProcessLookupError:
+                return False
+
+        # The processes of past streams were killed and reaped
+        self.assertTrue(
+            self.waitFor(lambda: not any(alive(pid) for pid in subscriptions()))
+        )
+
+    def test_sharedArtifacts(self):
+        docker = LocalDocker()
+        grader = self.inputFile("autograde.tar", "grader", shared=True)
+        volumes = []
+        for id in (1, 2):
+            handin = self.inputFile("handin.c", "int main%d;" % id)
+            volumes.append(self.copyIn(docker, id, [grader, handin]))
+
+        # The grader is staged once for both jobs, which link to it
+        # through /home/shared, and the handins are their own
+        (name,) = os.listdir(docker.getSharedPath())
+        for (id, volume) in enumerate(volumes, 1):
+            self.assertEqual(
+                os.readlink(volume + "autograde.tar"), "/home/shared/" + name
+            )
+            self.assertEqual(open(volume + "handin.c").read(), "int main%d;" % id)
+        self.assertEqual(open(docker.getSharedPath() + name).read(), "grader")
+
+        # runJob's copy to the job directory keeps the symlinks
+        job = os.path.join(self.dir, "autolab")
+        os.mkdir(job)
+        subprocess.check_call(["sh", "-c", "cp -r %s* %s" % (volumes[0], job)])
+        self.assertTrue(os.path.islink(os.path.join(job, "autograde.tar")))
+
+        # Artifacts that no job has used for a while are pruned
+        docker.sharedUsed[name] -= 2 * Config.DOCKER_SHARED_ARTIFACTS_TTL
+        docker.sharedPruned = 0
+        other = self.inputFile("Makefile", "autograde:", shared=True)
+        self.copyIn(docker, 3, [other])
+        self.assertEqual(len(os.listdir(docker.getSharedPath())), 1)
+        self.assertNotIn(name, os.listdir(docker.getSharedPath()))
+
+    def test_unsharedArtifacts(self):
+        Config.DOCKER_SHARED_ARTIFACTS = False
+        docker = LocalDocker()
+        grader = self.inputFile("autograde.tar", "grader", shared=True)
+        volume = self.copyIn(docker, 1, [grader])
+        self.assertFalse(os.path.islink(volume + "autograde.tar"))
+        self.assertEqual(open(volume + "autograde.tar").read(), "grader")
+        self.assertFalse(os.path.exists(docker.getSharedPath()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,7 @@
 import unittest
 import redis
 
-from tangoObjects import TangoDictionary, TangoJob, TangoQueue
+from tangoObjects import TangoDictionary, TangoJob, TangoQueue, TangoSet
 from config import Config
 
 
@@ -42,8 +42,9 @@ class TestDictionary(unittest.TestCase):
         test_dict.set("key", "new_value")
         self.assertEqual(test_dict.get("key"), "new_value")
 
-        test_dict.delete("key")
+        self.assertTrue(test_dict.delete("key"))
         self.assertTrue("key" not in test_dict)
+        self.assertFalse(test_dict.delete("key"))
 
     def test_nativeDictionary(self):
         Config.USE_REDIS = False
@@ -54,6 +55,42 @@ class TestDictionary(unittest.TestCase):
         self.runDictionaryTests()
 
 
+class TestSet(unittest.TestCase):
+    def setUp(self):
+        if Config.USE_REDIS:
+            __db = redis.StrictRedis(Config.REDIS_HOSTNAME, Config.REDIS_PORT, db=0)
+            __db.flushall()
+
+    def runSetTests(self):
+        test_set = TangoSet("test")
+        self.assertEqual(test_set.size(), 0)
+        self.assertEqual(test_set.members(), [])
+
+        for x in range(5):
+            self.assertTrue(test_set.add(x))
+        self.assertFalse(test_set.add(0))
+        self.assertEqual(test_set.size(), 5)
+        self.assertEqual(sorted(test_set.members()), [str(x) for x in range(5)])
+        self.assertTrue(3 in test_set)
+        self.assertTrue("3" in test_set)
+
+        self.assertTrue(test_set.remove(3))
+        self.assertFalse(test_set.remove(3))
+        self.assertTrue(3 not in test_set)
+        self.assertEqual(test_set.size(), 4)
+
+        test_set._clean()
+        self.assertEqual(test_set.size(), 0)
+
+    def test_nativeSet(self):
+        Config.USE_REDIS = False
+        self.runSetTests()
+
+    def test_remoteSet(self):
+        Config.USE_REDIS = True
+        self.runSetTests()
+
+
 class TestQueue(unittest.TestCase):
     def setUp(self):
         if Config.USE_REDIS:
@@ -1,5 +1,7 @@
 import unittest
 import random
+import threading
+import time
 
 import redis
 from preallocator import *
@@ -100,13 +102,141 @@ class TestPreallocator(unittest.TestCase):
             # Allocating single, free machine
             self.preallocator.update(self.vm, 1)
             vm = self.preallocator.allocVM(self.vm.name)
+            self.assertTrue(self.preallocator.inPool(vm))
             self.preallocator.freeVM(vm)
             free = self.preallocator.getPool(self.vm.name)["free"]
             self.assertFalse(free == [])
 
+            # VMs created outside the pool are not in it
+            other = self.createTangoMachine("autograding_image", machine)
+            other.id = 1
+            self.assertFalse(self.preallocator.inPool(other))
+
+            # and are not recorded as idle when they are freed
+            other.id = 10000
+            self.preallocator.freeVM(other)
+            idleSince = self.preallocator._pool(self.vm.name)[2]
+            self.assertNotIn(10000, idleSince)
+
             # Revert pool for other tests
             self.preallocator.update(self.vm, 5)
 
+    def test_freeList(self):
+        for machine in self.testMachines:
+            Config.VMMS_NAME = machine
+            self.createVM()
+
+            self.preallocator.update(self.vm, 3)
+            pool = self.preallocator.getPool(self.vm.name)
+            self.assertEqual(sorted(pool["free"]), sorted(pool["total"]))
+
+            # An allocated VM leaves the free list but stays in the pool
+            vm = self.preallocator.allocVM(self.vm.name)
+            pool = self.preallocator.getPool(self.vm.name)
+            self.assertNotIn(vm.id, pool["free"])
+            self.assertIn(vm.id, pool["total"])
+            self.assertEqual(len(pool["free"]), 2)
+
+            # The pool is not quiescent, so no VM can be destroyed
+            res = self.preallocator.destroyVM(self.vm.name, pool["free"][0])
+            self.assertEqual(res, -1)
+
+            self.preallocator.freeVM(vm)
+            pool = self.preallocator.getPool(self.vm.name)
+            self.assertIn(vm.id, pool["free"])
+            self.assertEqual(len(pool["free"]), 3)
+
+    def test_checkPoolHealth(self):
+        for machine in self.testMachines:
+            Config.VMMS_NAME = machine
+            self.createVM()
+
+            self.preallocator.update(self.vm, 2)
+            self.preallocator.checkPoolHealth(self.vm.name)
+            pool = self.preallocator.getPool(self.vm.name)
+            self.assertEqual(pool["health"]["checks"], 2)
+            self.assertEqual(pool["health"]["failures"], 0)
+            self.assertEqual(len(pool["free"]), 2)
+
+    def test_failedReplacement(self):
+        for machine in self.testMachines:
+            Config.VMMS_NAME = machine
+            self.createVM()
+            self.preallocator.update(self.vm, 2)
+
+            def initializeVM(vm):
+                raise Exception("no capacity")
+
+            # An unhealthy VM leaves the pool even if it cannot be replaced
+            vmms = self.preallocator.vmms[machine]
+            vmms.checkVM = lambda vm: False
+            vmms.initializeVM = initializeVM
+            with self.assertRaises(Exception):
+                self.preallocator.checkPoolHealth(self.vm.name)
+            pool = self.preallocator.getPool(self.vm.name)
+            self.assertEqual(len(pool["total"]), 1)
+            self.assertEqual(pool["free"], pool["total"])
+            self.assertEqual(
+                self.preallocator.destroyVM(self.vm.name, pool["free"][0]), 0
+            )
+
+    def test_scaleDownPool(self):
+        for machine in self.testMachines:
+            Config.VMMS_NAME = machine
+            self.createVM()
+
+            self.preallocator.update(self.vm, 3)
+
+            # Nothing has been idle long enough yet
+            self.preallocator.setPolicy(self.vm.name, idleTTL=3600, minSize=1)
+            self.preallocator.scaleDownPool(self.vm.name)
+            self.assertEqual(self.preallocator.poolSize(self.vm.name), 3)
+
+            # Idle VMs are destroyed, but never below the minimum size
+            self.preallocator.setPolicy(self.vm.name, idleTTL=0.1, minSize=1)
+            time.sleep(0.2)
+            self.preallocator.scaleDownPool(self.vm.name)
+            pool = self.preallocator.getPool(self.vm.name)
+            self.assertEqual(len(pool["total"]), 1)
+            self.assertEqual(pool["free"], pool["total"])
+            self.assertEqual(pool["scale_down"]["destroyed"], 2)
+
+    def test_hostCapacity(self):
+        for machine in self.testMachines:
+            Config.VMMS_NAME = machine
+            self.createVM()
+
+            # Pools only grow as far as the host's cores allow, even
+            # when they grow concurrently
+            Config.HOST_CORES = 2
+            try:
+                threads = [
+                    threading.Thread(target=self.preallocator.update, args=(self.vm, 5))
+                    for i in range(4)
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                self.assertEqual(self.preallocator.poolSize(self.vm.name), 2)
+
+                # VMs outside the pools hold capacity too
+                self.preallocator.update(self.vm, 1)
+                self.assertTrue(self.preallocator.reserveCapacity(self.vm, 1))
+                self.assertFalse(self.preallocator.reserveCapacity(self.vm, 2))
+                self.preallocator.update(self.vm, 2)
+                self.assertEqual(self.preallocator.poolSize(self.vm.name), 1)
+                self.preallocator.releaseCapacity(1)
+                self.preallocator.update(self.vm, 2)
+            finally:
+                Config.HOST_CORES = None
+            self.assertEqual(self.preallocator.poolSize(self.vm.name), 2)
+
+            capacity = self.preallocator.getCapacity(machine)
+            self.assertEqual(capacity["used_cores"], 2)
+            self.assertEqual(capacity["used_memory"], 1024)
+            self.assertIsNone(capacity["cores"])
+
     def test_getNextID(self):
         for machine in self.testMachines:
             Config.VMMS_NAME = machine
@@ -0,0 +1,54 @@
+import unittest
+import tempfile
+import time
+
+from vmms.processSupervisor import run, timeout
+
+
+class TestProcessSupervisor(unittest.TestCase):
+    def test_timeout(self):
+        self.assertEqual(timeout(["true"]), 0)
+        self.assertEqual(timeout(["sh", "-c", "exit 3"]), 3)
+
+        # A command is killed as soon as its deadline passes
+        start_time = time.time()
+        self.assertEqual(timeout(["sleep", "10"], 0.5), -1)
+        self.assertLess(time.time() - start_time, 2)
+
+    def test_exitIsNotPolled(self):
+        # A quick command returns well before a poll interval would
+        start_time = time.time()
+        timeout(["true"], 10)
+        self.assertLess(time.time() - start_time, 0.5)
+
+    def test_run(self):
+        result = run(["sh", "-c", "echo out; echo err >&2"], 5, capture=True)
+        self.assertEqual(result.returncode, 0)
+        self.assertFalse(result.timedOut)
+        self.assertEqual(result.output, b"out\nerr\n")
+        self.assertGreaterEqual(result.elapsed, 0)
+
+        result = run(["cat"], 5, capture=True, input=b"data")
+        self.assertEqual(result.output, b"data")
+
+        result = run(["sleep", "10"], 0.2, capture=True)
+        self.assertTrue(result.timedOut)
+
+    def test_streamedInput(self):
+        def write(stdin):
+            for i in range(1024):
+                stdin.write(b"x" * 1024)
+
+        # Input can be written by a function instead of held in memory
+        with tempfile.NamedTemporaryFile() as f:
+            result = run(["sh", "-c", "cat > %s" % f.name], 5, input=write)
+            self.assertEqual(result.returncode, 0)
+            self.assertEqual(len(f.read()), 1024 * 1024)
+
+        # A command may stop reading early
+        result = run(["head", "-c", "1"], 5, input=lambda stdin: stdin.write(b"ab"))
+        self.assertEqual(result.returncode, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
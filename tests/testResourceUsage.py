@@ -0,0 +1,59 @@
+import unittest
+import subprocess
+
+from vmms.resourceUsage import USAGE_COMMAND, parseUsage
+
+
+class TestResourceUsage(unittest.TestCase):
+    def test_parseUsageV2(self):
+        output = (
+            "cp: cannot stat 'x'\n"
+            "TANGO_RESOURCE_USAGE\n"
+            "== cpu.stat\nusage_usec 2500000\nuser_usec 2000000\n"
+            "== memory.peak\n1048576\n"
+            "== io.stat\n8:0 rbytes=100 wbytes=200 rios=1 wios=2\n"
+            "8:16 rbytes=1 wbytes=2 rios=1 wios=1\n"
+            "== pids.peak\n7\n"
+        )
+        self.assertEqual(
+            parseUsage(output.encode()),
+            {
+                "cpu_seconds": 2.5,
+                "memory_peak": 1048576,
+                "io_read_bytes": 101,
+                "io_write_bytes": 202,
+                "pids_peak": 7,
+            },
+        )
+
+    def test_parseUsageV1(self):
+        output = (
+            "TANGO_RESOURCE_USAGE\n"
+            "== cpuacct/cpuacct.usage\n1500000000\n"
+            "== memory/memory.max_usage_in_bytes\n4096\n"
+            "== blkio/blkio.throttle.io_service_bytes\n"
+            "8:0 Read 10\n8:0 Write 20\n8:0 Total 30\nTotal 30\n"
+        )
+        self.assertEqual(
+            parseUsage(output),
+            {
+                "cpu_seconds": 1.5,
+                "memory_peak": 4096,
+                "io_read_bytes": 10,
+                "io_write_bytes": 20,
+            },
+        )
+
+    def test_noUsage(self):
+        self.assertIsNone(parseUsage(None))
+        self.assertIsNone(parseUsage(b"no marker here"))
+        self.assertIsNone(parseUsage("TANGO_RESOURCE_USAGE\n"))
+
+    def test_usageCommand(self):
+        # The command keeps the exit status of the job before it
+        p = subprocess.run(["sh", "-c", "(exit 3); " + USAGE_COMMAND])
+        self.assertEqual(p.returncode, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
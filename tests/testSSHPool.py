@@ -0,0 +1,42 @@
+import unittest
+import os
+
+from config import Config
+from vmms.sshPool import SSHConnectionPool
+
+
+class TestSSHPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = SSHConnectionPool(["-o", "BatchMode=yes"])
+
+    def tearDown(self):
+        self.pool.close()
+
+    def controlPath(self, flags):
+        return [flag for flag in flags if flag.startswith("ControlPath=")][0]
+
+    def test_connect(self):
+        flags = self.pool.connect("autolab@host1")
+        self.assertEqual(flags[:2], ["-o", "BatchMode=yes"])
+        self.assertIn("ControlMaster=auto", flags)
+
+        # VMs on a host take turns over its connections
+        paths = [
+            self.controlPath(self.pool.connect("autolab@host1"))
+            for i in range(Config.DOCKER_SSH_CONNECTIONS)
+        ]
+        self.assertEqual(len(set(paths)), Config.DOCKER_SSH_CONNECTIONS)
+        self.assertIn(self.controlPath(flags), paths)
+
+        # Hosts do not share connections
+        self.assertNotIn(self.controlPath(self.pool.connect("autolab@host2")), paths)
+
+    def test_close(self):
+        self.pool.connect("autolab@host1")
+        self.assertTrue(os.path.isdir(self.pool.controlDir))
+        self.pool.close()
+        self.assertFalse(os.path.exists(self.pool.controlDir))
+
+
+if __name__ == "__main__":
+    unittest.main()
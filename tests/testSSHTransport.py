@@ -0,0 +1,77 @@
+import unittest
+
+from config import Config
+from vmms.distDocker import DistDocker
+from vmms.sshTransport import (
+    BinaryTransport,
+    ParamikoTransport,
+    makeTransport,
+    parseFlags,
+)
+
+
+class TestSSHTransport(unittest.TestCase):
+    def setUp(self):
+        self.transport = Config.SSH_TRANSPORT
+
+    def tearDown(self):
+        Config.SSH_TRANSPORT = self.transport
+
+    def test_makeTransport(self):
+        Config.SSH_TRANSPORT = "binary"
+        transport = makeTransport(["-o", "BatchMode=yes"])
+        self.assertIsInstance(transport, BinaryTransport)
+        self.assertIsNone(transport.pool)
+        self.assertIsNotNone(makeTransport([], multiplex=True).pool)
+
+        # Without paramiko, ssh is forked instead
+        Config.SSH_TRANSPORT = "paramiko"
+        try:
+            import paramiko
+
+            expected = ParamikoTransport
+        except ImportError:
+            expected = BinaryTransport
+        self.assertIsInstance(makeTransport([]), expected)
+
+    def test_parseFlags(self):
+        options = parseFlags(DistDocker._SSH_FLAGS + DistDocker._SSH_AUTH_FLAGS)
+        self.assertEqual(options["key_file"], DistDocker._SSH_AUTH_FLAGS[1])
+        self.assertEqual(options["strict"], "no")
+        self.assertEqual(options["port"], 22)
+
+        # The defaults are as strict as ssh's
+        options = parseFlags(["-o", "BatchMode=yes"])
+        self.assertEqual((options["strict"], options["known_hosts"]), ("yes", None))
+
+        options = parseFlags(
+            ["-p", "2222", "-o", "StrictHostKeyChecking accept-new"]
+            + ["-o", "UserKnownHostsFile=/etc/tango/known_hosts"]
+        )
+        self.assertEqual(options["port"], 2222)
+        self.assertEqual(options["strict"], "accept-new")
+        self.assertEqual(options["known_hosts"], "/etc/tango/known_hosts")
+        self.assertEqual(parseFlags(["-o", "Port=2200"])["port"], 2200)
+
+        # Flags the in-process transport cannot honour are refused
+        for flags in (
+            ["-o", "ProxyJump=bastion"],
+            ["-o", "GSSAPIAuthentication=yes"],
+            ["-A"],
+            ["-i"],
+        ):
+            with self.assertRaises(ValueError):
+                parseFlags(flags)
+
+    def test_unreachable(self):
+        transport = BinaryTransport(["-o", "BatchMode=yes", "-o", "ConnectTimeout=5"])
+        result = transport.run("autolab@tango-test.invalid", "(:)", 10)
+        self.assertEqual(result.returncode, 255)
+        self.assertIn("tango-test.invalid", result.error)
+
+        result = transport.get("autolab@tango-test.invalid", "output", "/dev/null", 10)
+        self.assertNotEqual(result.returncode, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
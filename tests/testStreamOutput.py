@@ -0,0 +1,136 @@
+import unittest
+import json
+import os
+import sys
+
+import redis
+import tornado.testing
+import tornado.web
+
+from config import Config
+from tangoObjects import TangoJob, TangoMachine
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "restful_tango")
+)
+import server
+
+
+class FakeVMMS(object):
+    """FakeVMMS - Serves a job's output from memory. onRead is called
+    after each read, to let the job write more or finish.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.onRead = None
+
+    def getPartialOutput(self, vm, offset=0):
+        data = self.data
+        if self.onRead:
+            self.onRead()
+            self.onRead = None
+        return data[offset:]
+
+
+class TestStreamOutput(tornado.testing.AsyncHTTPTestCase):
+    def get_app(self):
+        return tornado.web.Application(
+            [(r"/streamOutput/(.+)/([0-9]+)/", server.StreamOutputHandler)]
+        )
+
+    def setUp(self):
+        if Config.USE_REDIS:
+            __db = redis.StrictRedis(Config.REDIS_HOSTNAME, Config.REDIS_PORT, db=0)
+            __db.flushall()
+        super().setUp()
+        self.interval = Config.OUTPUT_STREAM_INTERVAL
+        Config.OUTPUT_STREAM_INTERVAL = 0.05
+
+        self.tango = server.tangoREST.tango
+        self.jobQueue = self.tango.jobQueue
+        self.vmms = FakeVMMS(b"")
+        self.realVMMS = self.tango.preallocator.vmms[Config.VMMS_NAME]
+        self.tango.preallocator.vmms[Config.VMMS_NAME] = self.vmms
+
+        vm = TangoMachine(name="autograding_image", vmms=Config.VMMS_NAME)
+        job = TangoJob(
+            name="sample_job",
+            vm=vm,
+            outputFile="sample_job_output",
+            input=[],
+            timeout=30,
+            maxOutputFileSize=4096,
+        )
+        self.jobId = str(self.jobQueue.add(job))
+        vm.id = int(self.jobId)
+        self.jobQueue.assignJob(self.jobId, vm)
+        self.key = Config.KEYS[0]
+
+    def tearDown(self):
+        self.tango.preallocator.vmms[Config.VMMS_NAME] = self.realVMMS
+        Config.OUTPUT_STREAM_INTERVAL = self.interval
+        super().tearDown()
+
+    def stream(self, headers=None):
+        """stream - Returns the events of a streamOutput request"""
+        response = self.fetch(
+            "/streamOutput/%s/%s/" % (self.key, self.jobId), headers=headers
+        )
+        events = []
+        for block in response.body.decode().split("\n\n"):
+            fields = dict(
+                line.split(": ", 1) for line in block.splitlines() if ": " in line
+            )
+            if fields:
+                events.append(fields)
+        return events
+
+    def test_partialOutput(self):
+        # A character cut off at the end is left for the next read
+        self.vmms.data = b"h\xc3"
+        self.assertEqual(self.tango.getPartialOutput(self.jobId, 0), ("h", 1))
+        self.vmms.data = b"h\xc3\xa9!"
+        self.assertEqual(self.tango.getPartialOutput(self.jobId, 1), ("\xe9!", 4))
+
+    def test_stream(self):
+        self.vmms.data = b"abc"
+
+        def finish():
+            # The job writes more and finishes right after the first read
+            self.vmms.data = b"abcdef"
+            self.jobQueue.makeDead(self.jobId, "done")
+
+        self.vmms.onRead = finish
+        events = self.stream()
+        self.assertEqual(
+            [json.loads(event["data"]) for event in events[:2]],
+            [{"output": "abc", "offset": 3}, {"output": "def", "offset": 6}],
+        )
+        self.assertEqual(events[1]["id"], "6")
+        self.assertEqual(events[2]["event"], "end")
+        self.assertEqual(len(events), 3)
+
+    def test_resume(self):
+        self.vmms.data = b"abcdef"
+        self.jobQueue.makeDead(self.jobId, "done")
+        events = self.stream({"Last-Event-ID": "3"})
+        self.assertEqual(json.loads(events[0]["data"]), {"output": "def", "offset": 6})
+        self.assertEqual(events[1]["event"], "end")
+
+    def test_wrongKey(self):
+        response = self.fetch("/streamOutput/wrong/%s/" % self.jobId)
+        self.assertEqual(json.loads(response.body)["statusId"], -1)
+
+    def test_invalidOffset(self):
+        for (query, headers) in (("?offset=abc", None), ("", {"Last-Event-ID": "-3"})):
+            response = self.fetch(
+                "/streamOutput/%s/%s/%s" % (self.key, self.jobId, query),
+                headers=headers,
+            )
+            self.assertEqual(response.code, 400)
+            self.assertEqual(json.loads(response.body)["statusId"], -1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,398 @@
+#
+# agentDocker.py - Implements the Tango VMMS interface to run Tango jobs
+# in docker containers on a cluster of worker hosts, each of which runs
+# a Tango agent (tangoAgent.py).
+#
+# The hosts are DOCKER_HOSTS, given as host or host:port (the port
+# defaults to AGENT_PORT), and VMs are placed on them by load as with
+# distDocker. Every agent pushes its load as events, which are also
+# its heartbeat: an agent that goes quiet is marked down, its jobs are
+# rescheduled, and it is re-admitted once its events resume. The VM
+# operations are requests to the agent of the VM's host, over
+# persistent connections; the agent keeps warm containers for them.
+#
+import gzip
+import json
+import logging
+import tarfile
+import tempfile
+import threading
+import time
+
+import requests
+
+import config
+from tangoObjects import TangoMachine
+from vmms.hostInventory import HostInventory
+
+
+class AgentDocker(object):
+    def __init__(self):
+        self.log = logging.getLogger("AgentDocker")
+        # Resources used by the last job of each VM, keyed off
+        # instance name, until the worker collects them
+        self.usage = {}
+        # host -> session, with its persistent connections to the agent
+        self.sessions = {}
+        # host -> latest load the agent pushed
+        self.reports = {}
+        # host -> when the last event of its agent arrived
+        self.lastEvent = {}
+        # Hosts whose events are being followed
+        self.following = set()
+        self.lock = threading.Lock()
+
+        # Load and health of the hosts, which decide where VMs run
+        self.inventory = HostInventory(
+            self._probeHost, heartbeat=self._heartbeat, onDown=self._hostDown
+        )
+
+    def instanceName(self, id, name):
+        """instanceName - Constructs a Docker instance name. Always use
+        this function when you need a Docker instance name. Never generate
+        instance names manually.
+        """
+        return "%s-%s-%s" % (config.Config.PREFIX, id, name)
+
+    #
+    # Talking to the agents
+    #
+    def _url(self, host, path):
+        if ":" not in host:
+            host = "%s:%d" % (host, config.Config.AGENT_PORT)
+        return "http://%s/%s" % (host, path)
+
+    def _request(self, host, method, path, time_out, **kwargs):
+        """_request - Make a request to the agent on host, and return
+        the response. Raises a requests.RequestException if the agent
+        cannot be reached or the request fails.
+        """
+        with self.lock:
+            session = self.sessions.get(host)
+            if session is None:
+                session = self.sessions[host] = requests.Session()
+                session.headers["X-Tango-Agent-Key"] = config.Config.AGENT_KEY
+        response = session.request(
+            method, self._url(host, path), timeout=time_out, **kwargs
+        )
+        response.raise_for_status()
+        return response
+
+    def _status(self, host, error):
+        """_status - Returns the status of an operation that failed
+        with error: 255 if the agent could not be reached, as for ssh,
+        and 1 if the agent failed it
+        """
+        self.log.error("Agent on %s: %s" % (host, error))
+        if isinstance(error, requests.HTTPError):
+            return 1
+        return 255
+
+    def _follow(self, host):
+        """_follow - Start following the events of host's agent"""
+        with self.lock:
+            if host in self.following:
+                return
+            self.following.add(host)
+        thread = threading.Thread(target=self.__events, args=(host,))
+        thread.daemon = True
+        thread.start()
+
+    def __events(self, host):
+        interval = config.Config.DOCKER_HOST_HEARTBEAT_INTERVAL
+        while True:
+            try:
+                with requests.get(
+                    self._url(host, "events"),
+                    headers={"X-Tango-Agent-Key": config.Config.AGENT_KEY},
+                    stream=True,
+                    timeout=(interval, 3 * interval),
+                ) as response:
+                    response.raise_for_status()
+                    for line in response.iter_lines():
+                        if line.startswith(b"data: "):
+                            self._event(host, json.loads(line[6:]))
+            except Exception as e:
+                self.log.debug("Events of %s interrupted: %s" % (host, e))
+            time.sleep(interval)
+
+    def _event(self, host, event):
+        self.lastEvent[host] = time.time()
+        if event["type"] == "status":
+            self.reports[host] = event["load"]
+        else:
+            self.log.debug("Agent on %s: %s" % (host, event))
+
+    def _probeHost(self, host):
+        """_probeHost - Returns the load report of a host, or None if
+        its agent does not answer. The agent's latest pushed report is
+        used while its events keep coming.
+        """
+        self._follow(host)
+        if self._heartbeat(host) and host in self.reports:
+            return self.reports[host]
+        try:
+            status = self._request(
+                host, "GET", "status", config.Config.DOCKER_HOST_LOAD_INTERVAL
+            ).json()
+        except requests.RequestException:
+            return None
+        self.lastEvent[host] = time.time()
+        return status["load"]
+
+    def _heartbeat(self, host):
+        """_heartbeat - Returns True if the agent on host has pushed an
+        event lately
+        """
+        self._follow(host)
+        last = self.lastEvent.get(host, 0)
+        return time.time() - last <= 2 * config.Config.DOCKER_HOST_HEARTBEAT_INTERVAL
+
+    def _hostDown(self, host, instanceNames):
+        """_hostDown - Drop the connections to a failed host. Its jobs
+        notice that it is down and are rescheduled.
+        """
+        with self.lock:
+            session = self.sessions.pop(host, None)
+        if session:
+            session.close()
+
+    def hostFailed(self, vm):
+        """hostFailed - Returns True if the host vm was placed on has
+        failed, so that its job should run elsewhere
+        """
+        return vm.domain_name is not None and self.inventory.isDown(vm.domain_name)
+
+    def getHostStats(self):
+        """getHostStats - Returns the load and placement metrics of
+        every host
+        """
+        return self.inventory.getStats()
+
+    #
+    # VMMS API functions
+    #
+    def initializeVM(self, vm):
+        """initializeVM - VMs are placed on a host when they are
+        waited for, so there is nothing to do yet
+        """
+        return vm
+
+    def waitVM(self, vm, max_secs):
+        """waitVM - Place the VM on a host, and have its agent bind it
+        to a running container, moving to another host each time that
+        fails. Return -1 if that takes more than max_secs.
+        """
+        start_time = time.time()
+        instanceName = self.instanceName(vm.id, vm.image)
+        spec = {"id": vm.id, "image": vm.image, "cores": vm.cores, "memory": vm.memory}
+
+        failedHosts = set()
+        while True:
+            host = self.inventory.place(instanceName, vm, exclude=failedHosts)
+            if host is None:
+                self.log.error("No hosts to set up vm %s on." % (vm.name))
+                return -1
+            vm.domain_name = host
+
+            remaining = max_secs - (time.time() - start_time)
+            if remaining <= 0:
+                self.log.info("VM %s: not ready after %d secs" % (vm.name, max_secs))
+                return -1
+
+            try:
+                status = self._request(
+                    host,
+                    "POST",
+                    "acquire/%s" % instanceName,
+                    remaining + config.Config.TIMER_POLL_INTERVAL,
+                    json={"vm": spec, "timeout": remaining},
+                ).json()["status"]
+            except requests.RequestException as e:
+                status = self._status(host, e)
+            if status == 0:
+                return 0
+            self.inventory.recordFailure(host)
+            failedHosts.add(host)
+            time.sleep(config.Config.TIMER_POLL_INTERVAL)
+
+    def copyIn(self, vm, inputFiles):
+        """copyIn - Send the input files to the VM's agent as one
+        gzipped tar
+        """
+        instanceName = self.instanceName(vm.id, vm.image)
+        with tempfile.TemporaryFile() as tarFile:
+            # Most inputs are already compressed, so compress quickly
+            with gzip.GzipFile(fileobj=tarFile, mode="wb", compresslevel=1) as gz:
+                with tarfile.open(fileobj=gz, mode="w|", dereference=True) as tar:
+                    for file in inputFiles:
+                        tar.add(file.localFile, arcname=file.destFile)
+            tarFile.seek(0)
+            shared = [
+                file.destFile for file in inputFiles if getattr(file, "shared", False)
+            ]
+            try:
+                return self._request(
+                    vm.domain_name,
+                    "PUT",
+                    "input/%s" % instanceName,
+                    config.Config.COPYIN_TIMEOUT,
+                    params={"shared": shared},
+                    data=tarFile,
+                ).json()["status"]
+            except requests.RequestException as e:
+                return self._status(vm.domain_name, e)
+
+    def runJob(self, vm, runTimeout, maxOutputFileSize, disableNetwork):
+        """runJob - Have the VM's agent run the job, and wait for its
+        result. Returns 255 as soon as the host is marked down.
+        """
+        instanceName = self.instanceName(vm.id, vm.image)
+        host = vm.domain_name
+        interval = config.Config.DOCKER_HOST_HEARTBEAT_INTERVAL
+        try:
+            self._request(
+                host,
+                "POST",
+                "run/%s" % instanceName,
+                config.Config.COPYIN_TIMEOUT,
+                json={
+                    "runTimeout": runTimeout,
+                    "maxOutputFileSize": maxOutputFileSize,
+                    "disableNetwork": disableNetwork,
+                },
+            )
+        except requests.RequestException as e:
+            return self._status(host, e)
+
+        # runTimeout * 2 is a temporary hack. The driver will handle the timout
+        deadline = time.time() + runTimeout * 2
+        while time.time() < deadline:
+            if self.inventory.isDown(host):
+                self.log.error("Host %s failed running %s" % (host, instanceName))
+                return 255
+            wait = min(interval, max(deadline - time.time(), 0))
+            try:
+                result = self._request(
+                    host,
+                    "GET",
+                    "result/%s" % instanceName,
+                    wait + interval,
+                    params={"wait": wait},
+                ).json()
+            except requests.HTTPError as e:
+                return self._status(host, e)
+            except requests.RequestException as e:
+                # Keep trying until the host is known to be down
+                self.log.debug("Waiting for %s: %s" % (instanceName, e))
+                time.sleep(config.Config.TIMER_POLL_INTERVAL)
+                continue
+            if result["done"]:
+                self.usage[instanceName] = result["usage"]
+                self.log.debug("runJob return status %d" % result["status"])
+                return result["status"]
+        return -1
+
+    def getResourceUsage(self, vm):
+        """getResourceUsage - Returns what the last job run in the VM
+        used, as measured by its container's cgroup, or None
+        """
+        return self.usage.pop(self.instanceName(vm.id, vm.image), None)
+
+    def copyOut(self, vm, destFile):
+        """copyOut - Copy the autograder feedback from the VM's agent to
+        destFile on the Tango host. The agent then puts the container
+        back in its warm pool.
+        """
+        instanceName = self.instanceName(vm.id, vm.image)
+        try:
+            response = self._request(
+                vm.domain_name,
+                "GET",
+                "output/%s" % instanceName,
+                config.Config.COPYOUT_TIMEOUT,
+            )
+        except requests.RequestException as e:
+            return self._status(vm.domain_name, e)
+        with open(destFile, "wb") as f:
+            f.write(response.content)
+        self.inventory.release(instanceName)
+        self.log.debug("Copied feedback file to %s" % destFile)
+        return int(response.headers["X-Tango-Status"])
+
+    def destroyVM(self, vm):
+        """destroyVM - Have the VM's agent destroy its container"""
+        instanceName = self.instanceName(vm.id, vm.image)
+        # A failed host's agent removes its containers when it restarts
+        if vm.domain_name is not None and not self.hostFailed(vm):
+            try:
+                self._request(
+                    vm.domain_name,
+                    "POST",
+                    "destroy/%s" % instanceName,
+                    config.Config.DOCKER_RM_TIMEOUT,
+                )
+            except requests.RequestException as e:
+                self._status(vm.domain_name, e)
+        self.inventory.release(instanceName)
+
+    def safeDestroyVM(self, vm):
+        return self.destroyVM(vm)
+
+    def getVMs(self):
+        """getVMs - Lists the VMs bound on every agent that answers"""
+        machines = []
+        for host in self.inventory.liveHosts():
+            try:
+                vms = self._request(
+                    host, "GET", "vms", config.Config.DOCKER_RM_TIMEOUT
+                ).json()["vms"]
+            except requests.RequestException as e:
+                self._status(host, e)
+                continue
+            for vm in vms:
+                machines.append(
+                    TangoMachine(
+                        name=vm["name"],
+                        vmms="agentDocker",
+                        image=vm["image"],
+                        id=vm["id"],
+                        domain_name=host,
+                    )
+                )
+        return machines
+
+    def existsVM(self, vm):
+        """existsVM - Returns true if an agent has the VM"""
+        instanceName = self.instanceName(vm.id, vm.image)
+        return instanceName in [machine.name for machine in self.getVMs()]
+
+    def getImages(self):
+        """getImages - Returns the images that every agent that answers
+        can boot containers from, since a job may be placed on any of them
+        """
+        result = None
+        for host in self.inventory.liveHosts():
+            try:
+                images = self._request(
+                    host, "GET", "images", config.Config.DOCKER_RM_TIMEOUT
+                ).json()["images"]
+            except requests.RequestException as e:
+                self._status(host, e)
+                continue
+            result = set(images) if result is None else result & set(images)
+        return list(result or [])
+
+    def getPartialOutput(self, vm, offset=0):
+        """getPartialOutput - Get the partial output of a job, as bytes,
+        starting at offset. Nothing past the first MAX_OUTPUT_FILE_SIZE
+        bytes is returned.
+        """
+        instanceName = self.instanceName(vm.id, vm.image)
+        return self._request(
+            vm.domain_name,
+            "GET",
+            "partial/%s" % instanceName,
+            config.Config.COPYOUT_TIMEOUT,
+            params={"offset": offset},
+        ).content
@@ -9,72 +9,22 @@
 #
 
 import random
-import subprocess
 import re
 import time
 import logging
 import threading
 import os
-import sys
-import shutil
-import tempfile
-import socket
+import tarfile
+import gzip
 import config
+from vmms.resourceUsage import USAGE_COMMAND, parseUsage
+from vmms.hostCache import MISSING, HostCache
+from vmms.jobRunner import parseRunner, runnerScript
+from vmms.hostInventory import HostInventory, parseProbe, probeCommand
+from vmms.sshTransport import makeTransport
 from tangoObjects import TangoMachine
 
 
-def timeout(command, time_out=1):
-    """timeout - Run a unix command with a timeout. Return -1 on
-    timeout, otherwise return the return value from the command, which
-    is typically 0 for success, 1-255 for failure.
-    """
-
-    # Launch the command
-    p = subprocess.Popen(
-        command, stdout=open("/dev/null", "w"), stderr=subprocess.STDOUT
-    )
-
-    # Wait for the command to complete
-    t = 0.0
-    while t < time_out and p.poll() is None:
-        time.sleep(config.Config.TIMER_POLL_INTERVAL)
-        t += config.Config.TIMER_POLL_INTERVAL
-
-    # Determine why the while loop terminated
-    if p.poll() is None:
-        try:
-            os.kill(p.pid, 9)
-        except OSError:
-            pass
-        returncode = -1
-    else:
-        returncode = p.poll()
-    return returncode
-
-
-def timeoutWithReturnStatus(command, time_out, returnValue=0):
-    """timeoutWithReturnStatus - Run a Unix command with a timeout,
-    until the expected value is returned by the command; On timeout,
-    return last error code obtained from the command.
-    """
-    p = subprocess.Popen(
-        command, stdout=open("/dev/null", "w"), stderr=subprocess.STDOUT
-    )
-    t = 0.0
-    while t < time_out:
-        ret = p.poll()
-        if ret is None:
-            time.sleep(config.Config.TIMER_POLL_INTERVAL)
-            t += config.Config.TIMER_POLL_INTERVAL
-        elif ret == returnValue:
-            return ret
-        else:
-            p = subprocess.Popen(
-                command, stdout=open("/dev/null", "w"), stderr=subprocess.STDOUT
-            )
-    return ret
-
-
 class DistDocker(object):
 
     _SSH_FLAGS = ["-q", "-o", "BatchMode=yes"]
@@ -86,9 +36,6 @@ class DistDocker(object):
         "-o",
         "GSSAPIAuthentication=no",
     ]
-    _SSH_MASTER_FLAGS = ["-o", "ControlMaster=yes", "-o", "ControlPersist=600"]
-    _SSH_MASTER_CHECK_FLAG = ["-O", "check"]
-    _SSH_MASTER_EXIT_FLAG = ["-O", "exit"]
     HOSTS_FILE = "hosts"
 
     def __init__(self):
@@ -97,7 +44,6 @@ class DistDocker(object):
         """
         try:
             self.log = logging.getLogger("DistDocker")
-            self.hostDNSPoolname = config.Config.HOST_ALIAS
             self.hostUser = "ubuntu"
 
             if len(config.Config.DOCKER_HOST_USER) > 0:
@@ -107,6 +53,37 @@ class DistDocker(object):
             if len(config.Config.DOCKER_VOLUME_PATH) == 0:
                 raise Exception("DOCKER_VOLUME_PATH not defined in config.")
 
+            # Resources used by the last job of each VM, keyed off
+            # instance name, until the worker collects them
+            self.usage = {}
+
+            # Feedback of the last job of each VM, keyed off instance
+            # name, until copyOut writes it
+            self.feedback = {}
+
+            # host -> instance names of the VMs that were on it when it
+            # failed, to be removed once it recovers
+            self.orphans = {}
+
+            # Load and health of the worker hosts, which decide where
+            # VMs run
+            self.inventory = HostInventory(
+                self._probeHost,
+                heartbeat=self._heartbeat,
+                onDown=self._hostDown,
+                onUp=self._hostUp,
+            )
+
+            # Input files cached on the worker hosts, if enabled
+            self.cache = None
+            if config.Config.DOCKER_HOST_CACHE_SIZE > 0:
+                self.cache = HostCache()
+
+            # Persistent SSH connections to the worker hosts
+            self.ssh = makeTransport(
+                DistDocker._SSH_FLAGS + DistDocker._SSH_AUTH_FLAGS, multiplex=True
+            )
+
         except Exception as e:
             self.log.error(str(e))
             exit(1)
@@ -124,6 +101,77 @@ class DistDocker(object):
         volumePath = os.path.join(volumePath, instanceName, "")
         return volumePath
 
+    def _target(self, host):
+        return "%s@%s" % (self.hostUser, host)
+
+    def _probeHost(self, host):
+        """_probeHost - Returns the load report of a worker host, or
+        None if it does not answer within DOCKER_HOST_LOAD_INTERVAL
+        """
+        result = self.ssh.run(
+            self._target(host),
+            probeCommand(),
+            config.Config.DOCKER_HOST_LOAD_INTERVAL,
+            capture=True,
+        )
+        if result.returncode != 0:
+            return None
+        return parseProbe(result.output)
+
+    def _heartbeat(self, host):
+        """_heartbeat - Returns True if host answers within
+        DOCKER_HOST_HEARTBEAT_INTERVAL
+        """
+        result = self.ssh.run(
+            self._target(host), "(:)", config.Config.DOCKER_HOST_HEARTBEAT_INTERVAL
+        )
+        return result.returncode == 0
+
+    def _hostDown(self, host, instanceNames):
+        """_hostDown - Give up on a failed host. Closing its
+        connections ends the commands running on it, so that the
+        workers of its jobs reschedule them right away.
+        """
+        self.orphans.setdefault(host, []).extend(instanceNames)
+        if self.cache is not None:
+            self.cache.forget(host)
+        self.ssh.disconnect(self._target(host))
+
+    def _hostUp(self, host):
+        """_hostUp - Remove the containers and volumes left on a
+        recovered host by the jobs that were moved off it
+        """
+        instanceNames = self.orphans.pop(host, [])
+        if not instanceNames:
+            return
+        self.log.info("Removing %s from recovered host %s" % (instanceNames, host))
+        self.ssh.run(
+            self._target(host),
+            "(docker rm -f %s; rm -rf %s)"
+            % (
+                " ".join(instanceNames),
+                " ".join(self.getVolumePath(name) for name in instanceNames),
+            ),
+            config.Config.DOCKER_RM_TIMEOUT,
+        )
+
+    def hostFailed(self, vm):
+        """hostFailed - Returns True if the host vm was placed on has
+        failed, so that its job should run elsewhere
+        """
+        return vm.domain_name is not None and self.inventory.isDown(vm.domain_name)
+
+    def getHostStats(self):
+        """getHostStats - Returns the load and placement metrics of
+        every worker host, and how much input its cache saved sending
+        """
+        stats = self.inventory.getStats()
+        if self.cache is not None:
+            for (host, metrics) in stats.items():
+                if metrics is not None:
+                    metrics["input_cache"] = self.cache.getStats(host)
+        return stats
+
     #
     # VMMS API functions
     #
@@ -138,22 +186,15 @@ class DistDocker(object):
         ready. Return error if it takes too long.
         """
         start_time = time.time()
-        vm.ssh_control_dir = tempfile.mkdtemp(prefix="tango-docker-ssh")
-        vm.ssh_flags = [
-            "-o",
-            "ControlPath=" + os.path.join(vm.ssh_control_dir, "control"),
-        ]
-        vm.use_ssh_master = True
-
-        # Wait for SSH to work before declaring that the VM is ready
+        instanceName = self.instanceName(vm.id, vm.image)
+
+        # Wait for SSH to work before declaring that the VM is ready,
+        # moving to another host each time it does not
+        failedHosts = set()
         while True:
-            try:
-                addr = socket.gethostbyname(self.hostDNSPoolname)
-                host = socket.gethostbyaddr(addr)[0]
-            except EnvironmentError:
-                self.log.exception(
-                    "DNS lookup failed while setting up vm %s." % (vm.name)
-                )
+            host = self.inventory.place(instanceName, vm, exclude=failedHosts)
+            if host is None:
+                self.log.error("No hosts to set up vm %s on." % (vm.name))
                 return -1
 
             vm.domain_name = host
@@ -168,21 +209,19 @@ class DistDocker(object):
                 )
                 return -1
 
-            # If the call to ssh returns timeout (-1) or ssh error
-            # (255), then success. Otherwise, keep trying until we run
-            # out of time.
-            ret = timeout(
-                ["ssh"]
-                + DistDocker._SSH_FLAGS
-                + vm.ssh_flags
-                + DistDocker._SSH_AUTH_FLAGS
-                + DistDocker._SSH_MASTER_FLAGS
-                + ["%s@%s" % (self.hostUser, vm.domain_name), "(:)"],
-                max_secs - elapsed_secs,
+            # Unless ssh times out or cannot connect, the host is
+            # ready. Otherwise, keep trying until we run out of time.
+            result = self.ssh.run(
+                self._target(vm.domain_name), "(:)", max_secs - elapsed_secs
+            )
+            self.log.debug(
+                "VM %s: ssh returned with %d" % (vm.domain_name, result.returncode)
             )
-            self.log.debug("VM %s: ssh returned with %d" % (vm.domain_name, ret))
-            if (ret != -1) and (ret != 255):
+            if result.error is None:
                 return 0
+            self.log.info(result.error)
+            self.inventory.recordFailure(host)
+            failedHosts.add(host)
 
             # Sleep a bit before trying again
             time.sleep(config.Config.TIMER_POLL_INTERVAL)
@@ -190,63 +229,67 @@ class DistDocker(object):
     def copyIn(self, vm, inputFiles):
         """copyIn - Create a directory to be mounted as a volume
         for the docker containers on the host machine for this VM.
-        Copy input files to this directory on the host machine.
+        Copy input files to this directory on the host machine, as a
+        single compressed tar stream over one ssh session. With the
+        host cache, only the files the host has not cached are sent.
         """
         instanceName = self.instanceName(vm.id, vm.image)
         volumePath = self.getVolumePath(instanceName)
 
-        if vm.use_ssh_master:
-            ret = timeout(
-                ["ssh"]
-                + DistDocker._SSH_FLAGS
-                + vm.ssh_flags
-                + DistDocker._SSH_MASTER_CHECK_FLAG
-                + ["%s@%s" % (self.hostUser, vm.domain_name)]
-            )
-            if ret != 0:
-                self.log.debug("Lost persistent SSH connection")
-                return ret
-
-        # Create a fresh volume
-        ret = timeout(
-            ["ssh"]
-            + DistDocker._SSH_FLAGS
-            + vm.ssh_flags
-            + [
-                "%s@%s" % (self.hostUser, vm.domain_name),
-                "(rm -rf %s; mkdir %s)" % (volumePath, volumePath),
-            ],
-            config.Config.COPYIN_TIMEOUT,
-        )
-        if ret == 0:
-            self.log.debug("Volume directory created on VM.")
-        else:
-            return ret
+        def tarWriter(files):
+            def writeTar(stdin):
+                # Most inputs are already compressed, so compress quickly
+                with gzip.GzipFile(fileobj=stdin, mode="wb", compresslevel=1) as gz:
+                    with tarfile.open(fileobj=gz, mode="w|", dereference=True) as tar:
+                        for (path, name) in files:
+                            tar.add(path, arcname=name)
 
-        for file in inputFiles:
-            ret = timeout(
-                ["scp"]
-                + DistDocker._SSH_FLAGS
-                + vm.ssh_flags
-                + [file.localFile]
-                + [
-                    "%s@%s:%s/%s"
-                    % (self.hostUser, vm.domain_name, volumePath, file.destFile)
-                ],
-                config.Config.COPYIN_TIMEOUT,
-            )
-            if ret == 0:
-                self.log.debug(
-                    "Copied in file %s to %s"
-                    % (file.localFile, volumePath + file.destFile)
+            return writeTar
+
+        # If the host turns out to have lost a file it cached, forget
+        # what it cached and send everything once more
+        retried = False
+        while True:
+            if self.cache is None:
+                # Create a fresh volume and unpack the files into it
+                command = "(rm -rf %s; mkdir %s && tar -xzf - -C %s)" % (
+                    volumePath,
+                    volumePath,
+                    volumePath,
                 )
+                files = [(file.localFile, file.destFile) for file in inputFiles]
             else:
-                self.log.error(
-                    "Error: failed to copy file %s to VM %s with status %s"
-                    % (file.localFile, vm.domain_name, str(ret))
+                (keys, missing) = self.cache.missing(vm.domain_name, inputFiles)
+                command = self.cache.command(
+                    volumePath, inputFiles, keys, missing, instanceName
                 )
-                return ret
+                files = [(path, key) for (key, path) in missing.items()]
+
+            ret = self.ssh.run(
+                self._target(vm.domain_name),
+                command,
+                config.Config.COPYIN_TIMEOUT,
+                input=tarWriter(files) if files else None,
+            ).returncode
+            if self.cache is None or ret != MISSING or retried:
+                break
+            self.log.info("Host %s lost cached input files" % vm.domain_name)
+            self.cache.forget(vm.domain_name)
+            retried = True
+
+        if ret != 0:
+            self.log.error(
+                "Error: failed to copy files %s to VM %s with status %s"
+                % ([file.localFile for file in inputFiles], vm.domain_name, str(ret))
+            )
+            return ret
 
+        if self.cache is not None:
+            self.cache.stored(vm.domain_name, inputFiles, keys, missing)
+        self.log.debug(
+            "Copied in files %s to %s"
+            % ([file.destFile for file in inputFiles], volumePath)
+        )
         return 0
 
     def runJob(self, vm, runTimeout, maxOutputFileSize, disableNetwork):
@@ -255,22 +298,12 @@ class DistDocker(object):
           in the container
         - run autodriver with corresponding ulimits and timeout as
           autolab user
+        - return the feedback, and remove the container and its
+          volume, in the same ssh session (see jobRunner.py)
         """
         instanceName = self.instanceName(vm.id, vm.image)
         volumePath = self.getVolumePath(instanceName)
 
-        if vm.use_ssh_master:
-            ret = timeout(
-                ["ssh"]
-                + DistDocker._SSH_FLAGS
-                + vm.ssh_flags
-                + DistDocker._SSH_MASTER_CHECK_FLAG
-                + ["%s@%s" % (self.hostUser, vm.domain_name)]
-            )
-            if ret != 0:
-                self.log.debug("Lost persistent SSH connection")
-                return ret
-
         autodriverCmd = (
             "autodriver -u %d -f %d -t %d -o %d autolab > output/feedback 2>&1"
             % (
@@ -286,116 +319,118 @@ class DistDocker(object):
         #            bash commands.
         setupCmd = (
             'cp -r mount/* autolab/; su autolab -c "%s"; \
-                cp output/feedback mount/feedback'
-            % autodriverCmd
+                cp output/feedback mount/feedback; %s'
+            % (autodriverCmd, USAGE_COMMAND)
         )
 
         disableNetworkArg = "--network none" if disableNetwork else ""
 
-        args = "(docker run --name %s -v %s:/home/mount %s %s sh -c '%s')" % (
+        script = runnerScript(
             instanceName,
             volumePath,
-            disableNetworkArg,
             vm.image,
+            disableNetworkArg,
             setupCmd,
+            config.Config.MAX_OUTPUT_FILE_SIZE,
         )
 
-        self.log.debug("Running job: %s" % args)
+        self.log.debug("Running job: %s" % script)
 
-        ret = timeout(
-            ["ssh"]
-            + DistDocker._SSH_FLAGS
-            + vm.ssh_flags
-            + ["%s@%s" % (self.hostUser, vm.domain_name), args],
-            runTimeout * 2,
+        result = self.ssh.run(
+            self._target(vm.domain_name),
+            script,
+            runTimeout * 2 + config.Config.COPYOUT_TIMEOUT,
+            capture=True,
         )
+        runner = parseRunner(result.output)
+        if runner is None:
+            # copyOut fetches the feedback and cleans up on its own
+            ret = result.returncode
+            self.usage[instanceName] = parseUsage(result.output)
+        else:
+            (ret, containerOutput, feedback, timings) = runner
+            self.feedback[instanceName] = feedback
+            usage = parseUsage(containerOutput) or {}
+            usage.update(timings)
+            self.usage[instanceName] = usage or None
 
         self.log.debug("runJob return status %d" % ret)
 
         return ret
 
+    def getResourceUsage(self, vm):
+        """getResourceUsage - Returns what the last job run in the VM
+        used, as measured by its container's cgroup, or None
+        """
+        return self.usage.pop(self.instanceName(vm.id, vm.image), None)
+
     def copyOut(self, vm, destFile):
         """copyOut - Copy the autograder feedback from container to
-        destFile on the Tango host. Then, destroy that container.
-        Containers are never reused.
+        destFile on the Tango host, and destroy that container and its
+        volume in the same ssh session. Containers are never reused.
         """
         instanceName = self.instanceName(vm.id, vm.image)
         volumePath = self.getVolumePath(instanceName)
 
-        if vm.use_ssh_master:
-            ret = timeout(
-                ["ssh"]
-                + DistDocker._SSH_FLAGS
-                + vm.ssh_flags
-                + DistDocker._SSH_MASTER_CHECK_FLAG
-                + ["%s@%s" % (self.hostUser, vm.domain_name)]
-            )
-            if ret != 0:
-                self.log.debug("Lost persistent SSH connection")
-                return ret
-
-        ret = timeout(
-            ["scp"]
-            + DistDocker._SSH_FLAGS
-            + vm.ssh_flags
-            + [
-                "%s@%s:%s" % (self.hostUser, vm.domain_name, volumePath + "feedback"),
-                destFile,
-            ],
+        # Usually runJob has received the feedback and cleaned up
+        if instanceName in self.feedback:
+            feedback = self.feedback.pop(instanceName)
+            self.inventory.release(instanceName)
+            if feedback is None:
+                self.log.error("Error: VM %s left no feedback" % vm.domain_name)
+                return 1
+            with open(destFile, "wb") as f:
+                f.write(feedback)
+            self.log.debug("Copied feedback file to %s" % destFile)
+            return 0
+
+        # Only the feedback may reach stdout
+        result = self.ssh.run(
+            self._target(vm.domain_name),
+            "(exec 2>/dev/null; cat %sfeedback; s=$?; docker rm -f %s >/dev/null; "
+            "rm -rf %s; exit $s)" % (volumePath, instanceName, volumePath),
             config.Config.COPYOUT_TIMEOUT,
+            capture=True,
         )
+        if result.returncode == 0:
+            with open(destFile, "wb") as f:
+                f.write(result.output)
+            self.log.debug("Copied feedback file to %s" % destFile)
+        else:
+            self.log.error(
+                "Error: failed to copy feedback from VM %s with status %d"
+                % (vm.domain_name, result.returncode)
+            )
+            # Make sure the container is gone anyway
+            self.destroyVM(vm)
+            return result.returncode
 
-        self.log.debug("Copied feedback file to %s" % destFile)
-        self.destroyVM(vm)
-
+        self.inventory.release(instanceName)
         return 0
 
     def destroyVM(self, vm):
         """destroyVM - Delete the docker container."""
         instanceName = self.instanceName(vm.id, vm.image)
         volumePath = self.getVolumePath(instanceName)
-        if vm.use_ssh_master:
-            ret = timeout(
-                ["ssh"]
-                + DistDocker._SSH_FLAGS
-                + vm.ssh_flags
-                + DistDocker._SSH_MASTER_CHECK_FLAG
-                + ["%s@%s" % (self.hostUser, vm.domain_name)]
-            )
-            if ret != 0:
-                self.log.debug("Lost persistent SSH connection")
-                vm.use_ssh_master = False
-                shutil.rmtree(vm.ssh_control_dir, ignore_errors=True)
-                vm.ssh_flags = DistDocker._SSH_AUTH_FLAGS
-
+        self.feedback.pop(instanceName, None)
+        # A failed host's containers are removed once it recovers
+        if self.hostFailed(vm):
+            self.inventory.release(instanceName)
+            return
         # Do a hard kill on corresponding docker container.
         # Return status does not matter.
         args = "(docker rm -f %s)" % (instanceName)
-        timeout(
-            ["ssh"]
-            + DistDocker._SSH_FLAGS
-            + vm.ssh_flags
-            + ["%s@%s" % (self.hostUser, vm.domain_name), args],
-            config.Config.DOCKER_RM_TIMEOUT,
+        self.ssh.run(
+            self._target(vm.domain_name), args, config.Config.DOCKER_RM_TIMEOUT
         )
         # Destroy corresponding volume if it exists.
-        timeout(
-            ["ssh"]
-            + DistDocker._SSH_FLAGS
-            + vm.ssh_flags
-            + ["%s@%s" % (self.hostUser, vm.domain_name), "(rm -rf %s)" % (volumePath)],
+        self.ssh.run(
+            self._target(vm.domain_name),
+            "(rm -rf %s)" % (volumePath),
             config.Config.DOCKER_RM_TIMEOUT,
         )
         self.log.debug("Deleted volume %s" % instanceName)
-        if vm.use_ssh_master:
-            timeout(
-                ["ssh"]
-                + DistDocker._SSH_FLAGS
-                + vm.ssh_flags
-                + DistDocker._SSH_MASTER_EXIT_FLAG
-                + ["%s@%s" % (self.hostUser, vm.domain_name)]
-            )
-            shutil.rmtree(vm.ssh_control_dir, ignore_errors=True)
+        self.inventory.release(instanceName)
         return
 
     def safeDestroyVM(self, vm):
@@ -406,37 +441,32 @@ class DistDocker(object):
         while self.existsVM(vm):
             if time.time() - start_time > config.Config.DESTROY_SECS:
                 self.log.error("Failed to safely destroy container %s" % vm.name)
-                return
+                break
             self.destroyVM(vm)
+        # The container may never have been placed, or its host may be
+        # down, so the placement goes whether or not there was anything
+        # to destroy
+        self.inventory.release(self.instanceName(vm.id, vm.image))
         return
 
     def getVMs(self):
         """getVMs - Get all volumes of docker containers"""
         machines = []
-        try:
-            hosts = socket.gethostbyname_ex(self.hostDNSPoolname)[2]
-        except EnvironmentError:
-            return machines
+        hosts = self.inventory.liveHosts()
         volumePath = self.getVolumePath("")
         for host in hosts:
-            volumes = (
-                subprocess.check_output(
-                    ["ssh"]
-                    + DistDocker._SSH_FLAGS
-                    + DistDocker._SSH_AUTH_FLAGS
-                    + ["%s@%s" % (self.hostUser, host), "(ls %s)" % volumePath]
-                )
-                .decode("utf-8")
-                .split("\n")
+            result = self.ssh.run(
+                self._target(host), "(ls %s)" % volumePath, capture=True
             )
+            if result.returncode != 0:
+                raise Exception(result.error or "Listing volumes on %s failed" % host)
+            volumes = result.output.decode("utf-8").split("\n")
             for volume in volumes:
                 if re.match("%s-" % config.Config.PREFIX, volume):
                     machine = TangoMachine()
                     machine.vmms = "distDocker"
                     machine.name = volume
                     machine.domain_name = host
-                    machine.ssh_flags = DistDocker._SSH_AUTH_FLAGS
-                    machine.use_ssh_master = False
                     volume_l = volume.split("-")
                     machine.id = volume_l[1]
                     machine.image = volume_l[2]
@@ -445,11 +475,24 @@ class DistDocker(object):
 
     def existsVM(self, vm):
         """existsVM - Returns true if volume exists for corresponding
-        container.
+        container. Volumes are named after the container, not the pool.
+        Only the container's host is asked, unless it is not known.
         """
-        vms = self.getVMs()
-        vmnames = [vm.name for vm in vms]
-        return vm.name in vmnames
+        instanceName = self.instanceName(vm.id, vm.image)
+        host = vm.domain_name or self.inventory.hostOf(instanceName)
+        if host is None:
+            return instanceName in [machine.name for machine in self.getVMs()]
+        if self.inventory.isDown(host):
+            # A failed host's containers are removed once it recovers
+            return False
+        result = self.ssh.run(
+            self._target(host), "(test -d %s)" % self.getVolumePath(instanceName)
+        )
+        if result.returncode not in (0, 1):
+            raise Exception(
+                result.error or "Looking for %s on %s failed" % (instanceName, host)
+            )
+        return result.returncode == 0
 
     def getImages(self):
         """getImages - Executes `docker images` on every host and
@@ -458,17 +501,12 @@ class DistDocker(object):
         can break easily.
         """
         result = set()
-        try:
-            hosts = socket.gethostbyname_ex(self.hostDNSPoolname)[2]
-        except EnvironmentError:
-            return result
+        hosts = self.inventory.liveHosts()
         for host in hosts:
-            o = subprocess.check_output(
-                ["ssh"]
-                + DistDocker._SSH_FLAGS
-                + DistDocker._SSH_AUTH_FLAGS
-                + ["%s@%s" % (self.hostUser, host), "(docker images)"]
-            ).decode("utf-8")
+            images = self.ssh.run(self._target(host), "(docker images)", capture=True)
+            if images.returncode != 0:
+                raise Exception(images.error or "Listing images on %s failed" % host)
+            o = images.output.decode("utf-8")
             o_l = o.split("\n")
             o_l.pop()
             o_l.reverse()
@@ -479,38 +517,31 @@ class DistDocker(object):
 
         return list(result)
 
-    def getPartialOutput(self, vm):
-        """getPartialOutput - Get the partial output of a job.
+    def getPartialOutput(self, vm, offset=0):
+        """getPartialOutput - Get the partial output of a job, as bytes,
+        starting at offset.
         It does not check if the docker container exists before executing
         as the command will not fail even if the container does not exist.
-        Gets the first MAX_OUTPUT_FILE_SIZE bytes of the feedback file
+        Nothing past the first MAX_OUTPUT_FILE_SIZE bytes is returned.
         """
 
         instanceName = self.instanceName(vm.id, vm.image)
 
-        if vm.use_ssh_master:
-            ret = timeout(
-                ["ssh"]
-                + DistDocker._SSH_FLAGS
-                + vm.ssh_flags
-                + DistDocker._SSH_MASTER_CHECK_FLAG
-                + ["%s@%s" % (self.hostUser, vm.domain_name)]
-            )
-            if ret != 0:
-                self.log.debug("Lost persistent SSH connection")
-                return ret
-
-        cmd = "(docker exec %s head -c %s autograde/output.log)" % (
+        size = config.Config.MAX_OUTPUT_FILE_SIZE - offset
+        if size <= 0:
+            return b""
+        cmd = "(docker exec %s tail -c +%d autograde/output.log | head -c %d)" % (
             instanceName,
-            config.Config.MAX_OUTPUT_FILE_SIZE,
+            offset + 1,
+            size,
         )
 
-        output = subprocess.check_output(
-            ["ssh"]
-            + DistDocker._SSH_FLAGS
-            + vm.ssh_flags
-            + ["%s@%s" % (self.hostUser, vm.domain_name), cmd],
-            stderr=subprocess.STDOUT,
-        ).decode("utf-8")
+        result = self.ssh.run(self._target(vm.domain_name), cmd, capture=True)
+        if result.returncode != 0:
+            raise Exception(
+                result.error
+                or "Reading output on %s failed with status %d"
+                % (vm.domain_name, result.returncode)
+            )
 
-        return output
+        return result.output
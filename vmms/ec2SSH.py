@@ -2,7 +2,7 @@
 # ec2SSH.py - Implements the Tango VMMS interface to run Tango jobs on Amazon EC2.
 #
 # This implementation uses the AWS EC2 SDK to manage the virtual machines and
-# ssh and scp to access them. The following excecption are raised back
+# sshTransport.py to access them. The following excecption are raised back
 # to the caller:
 #
 #   Ec2Exception - EC2 raises this if it encounters any problem
@@ -10,71 +10,20 @@
 #
 # TODO: this currently probably does not work on Python 3 yet
 
-import subprocess
 import os
 import re
 import time
 import logging
 
 import config
+from vmms.processSupervisor import timeout
+from vmms.sshTransport import makeTransport
 
 import boto
 from boto import ec2
 from tangoObjects import TangoMachine
 
 
-def timeout(command, time_out=1):
-    """timeout - Run a unix command with a timeout. Return -1 on
-    timeout, otherwise return the return value from the command, which
-    is typically 0 for success, 1-255 for failure.
-    """
-
-    # Launch the command
-    p = subprocess.Popen(
-        command, stdout=open("/dev/null", "w"), stderr=subprocess.STDOUT
-    )
-
-    # Wait for the command to complete
-    t = 0.0
-    while t < time_out and p.poll() is None:
-        time.sleep(config.Config.TIMER_POLL_INTERVAL)
-        t += config.Config.TIMER_POLL_INTERVAL
-
-    # Determine why the while loop terminated
-    if p.poll() is None:
-        try:
-            os.kill(p.pid, 9)
-        except OSError:
-            pass
-        returncode = -1
-    else:
-        returncode = p.poll()
-    return returncode
-
-
-def timeoutWithReturnStatus(command, time_out, returnValue=0):
-    """timeoutWithReturnStatus - Run a Unix command with a timeout,
-    until the expected value is returned by the command; On timeout,
-    return last error code obtained from the command.
-    """
-    p = subprocess.Popen(
-        command, stdout=open("/dev/null", "w"), stderr=subprocess.STDOUT
-    )
-    t = 0.0
-    while t < time_out:
-        ret = p.poll()
-        if ret is None:
-            time.sleep(config.Config.TIMER_POLL_INTERVAL)
-            t += config.Config.TIMER_POLL_INTERVAL
-        elif ret == returnValue:
-            return ret
-        else:
-            p = subprocess.Popen(
-                command, stdout=open("/dev/null", "w"), stderr=subprocess.STDOUT
-            )
-            return ret
-
-
 #
 # User defined exceptions
 #
@@ -103,6 +52,7 @@ class Ec2SSH(object):
         VM created
         """
         self.ssh_flags = Ec2SSH._SSH_FLAGS
+        self.ssh = makeTransport(self.ssh_flags)
         if accessKeyId:
             self.connection = ec2.connect_to_region(
                 config.Config.EC2_REGION,
@@ -115,6 +65,9 @@ class Ec2SSH(object):
             self.useDefaultKeyPair = True
         self.log = logging.getLogger("Ec2SSH")
 
+    def _target(self, domain_name):
+        return "%s@%s" % (config.Config.EC2_USER_NAME, domain_name)
+
     def instanceName(self, id, name):
         """instanceName - Constructs a VM instance name. Always use
         this function when you need a VM instance name. Never generate
@@ -286,12 +239,7 @@ class Ec2SSH(object):
         start_time = time.time()
         domain_name = self.domainName(vm)
         while instance_down:
-            instance_down = subprocess.call(
-                "ping -c 1 %s" % (domain_name),
-                shell=True,
-                stdout=open("/dev/null", "w"),
-                stderr=subprocess.STDOUT,
-            )
+            instance_down = timeout(["ping", "-c", "1", domain_name], max_secs)
 
             # Wait a bit and then try again if we haven't exceeded
             # timeout
@@ -315,52 +263,52 @@ class Ec2SSH(object):
                 )
                 return -1
 
-            # If the call to ssh returns timeout (-1) or ssh error
-            # (255), then success. Otherwise, keep trying until we run
-            # out of time.
-            ret = timeout(
-                ["ssh"]
-                + self.ssh_flags
-                + ["%s@%s" % (config.Config.EC2_USER_NAME, domain_name), "(:)"],
-                max_secs - elapsed_secs,
+            # Unless ssh times out or cannot connect, the VM is ready.
+            # Otherwise, keep trying until we run out of time.
+            result = self.ssh.run(
+                self._target(domain_name), "(:)", max_secs - elapsed_secs
             )
 
-            self.log.debug("VM %s: ssh returned with %d" % (instanceName, ret))
+            self.log.debug(
+                "VM %s: ssh returned with %d" % (instanceName, result.returncode)
+            )
 
-            if (ret != -1) and (ret != 255):
+            if result.error is None:
                 return 0
 
             # Sleep a bit before trying again
             time.sleep(config.Config.TIMER_POLL_INTERVAL)
 
+    def checkVM(self, vm):
+        """checkVM - Returns True if the VM accepts SSH connections."""
+        result = self.ssh.run(
+            self._target(self.domainName(vm)), "(:)", config.Config.WAITVM_TIMEOUT
+        )
+        return result.returncode == 0
+
     def copyIn(self, vm, inputFiles):
         """copyIn - Copy input files to VM"""
         domain_name = self.domainName(vm)
 
         # Create a fresh input directory
-        ret = subprocess.call(
-            ["ssh"]
-            + self.ssh_flags
-            + [
-                "%s@%s" % (config.Config.EC2_USER_NAME, domain_name),
-                "(rm -rf autolab; mkdir autolab)",
-            ]
+        self.ssh.run(
+            self._target(domain_name),
+            "(rm -rf autolab; mkdir autolab)",
+            config.Config.COPYIN_TIMEOUT,
         )
 
         # Copy the input files to the input directory
         for file in inputFiles:
-            ret = timeout(
-                ["scp"]
-                + self.ssh_flags
-                + [
-                    file.localFile,
-                    "%s@%s:autolab/%s"
-                    % (config.Config.EC2_USER_NAME, domain_name, file.destFile),
-                ],
+            result = self.ssh.put(
+                self._target(domain_name),
+                file.localFile,
+                "autolab/%s" % file.destFile,
                 config.Config.COPYIN_TIMEOUT,
             )
-            if ret != 0:
-                return ret
+            if result.returncode != 0:
+                if result.error:
+                    self.log.error(result.error)
+                return result.returncode
 
         return 0
 
@@ -383,13 +331,9 @@ class Ec2SSH(object):
                 maxOutputFileSize,
             )
         )
-        ret = timeout(
-            ["ssh"]
-            + self.ssh_flags
-            + ["%s@%s" % (config.Config.EC2_USER_NAME, domain_name), runcmd],
-            runTimeout * 2,
-        )
-        return ret
+        return self.ssh.run(
+            self._target(domain_name), runcmd, runTimeout * 2
+        ).returncode
         # runTimeout * 2 is a temporary hack. The driver will handle the timout
 
     def copyOut(self, vm, destFile):
@@ -401,47 +345,26 @@ class Ec2SSH(object):
         # Optionally log finer grained runtime info. Adds about 1 sec
         # to the job latency, so we typically skip this.
         if config.Config.LOG_TIMING:
-            try:
-                # regular expression matcher for error message from cat
-                no_file = re.compile("No such file or directory")
-
-                time_info = (
-                    subprocess.check_output(
-                        ["ssh"]
-                        + self.ssh_flags
-                        + [
-                            "%s@%s" % (config.Config.EC2_USER_NAME, domain_name),
-                            "cat time.out",
-                        ]
-                    )
-                    .decode("utf-8")
-                    .rstrip("\n")
-                )
+            result = self.ssh.run(
+                self._target(domain_name), "cat time.out", capture=True
+            )
 
-                # If the output is empty, then ignore it (timing info wasn't
-                # collected), otherwise let's log it!
-                if no_file.match(time_info):
-                    # runJob didn't produce an output file
-                    pass
-
-                else:
-                    # remove newline character printed in timing info
-                    # replaces first '\n' character with a space
-                    time_info = re.sub("\n", " ", time_info, count=1)
-                    self.log.info("Timing (%s): %s" % (domain_name, time_info))
-
-            except subprocess.CalledProcessError as xxx_todo_changeme:
-                # Error copying out the timing data (probably runJob failed)
-                re.error = xxx_todo_changeme
-                # Error copying out the timing data (probably runJob failed)
-                pass
-
-        return timeout(
-            ["scp"]
-            + self.ssh_flags
-            + ["%s@%s:output" % (config.Config.EC2_USER_NAME, domain_name), destFile],
+            # If cat failed, then ignore it (timing info wasn't
+            # collected, probably because runJob failed), otherwise
+            # let's log it!
+            if result.returncode == 0:
+                # remove newline character printed in timing info
+                # replaces first '\n' character with a space
+                time_info = result.output.decode("utf-8").rstrip("\n")
+                time_info = re.sub("\n", " ", time_info, count=1)
+                self.log.info("Timing (%s): %s" % (domain_name, time_info))
+
+        return self.ssh.get(
+            self._target(domain_name),
+            "output",
+            destFile,
             config.Config.COPYOUT_TIMEOUT,
-        )
+        ).returncode
 
     def destroyVM(self, vm):
         """destroyVM - Removes a VM from the system"""
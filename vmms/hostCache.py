@@ -0,0 +1,131 @@
+#
+# hostCache.py - Caches distDocker's input files on the worker hosts,
+# so that a file is sent to a host once rather than with every job.
+#
+# Files are cached in a .cache directory under DOCKER_VOLUME_PATH on
+# each host, named by the SHA-256 of their contents (with an "x" added
+# for executables), and read-only. copyIn sends only the files that a
+# host's cache lacks, and the job's volume is assembled from the cache
+# with hardlinks. Tango remembers which files it sent to each host; if
+# the host has lost one since (it was evicted, or the host was
+# reinstalled), the command fails with MISSING and copyIn sends every
+# file again. The cache is bounded by DOCKER_HOST_CACHE_SIZE MB, and
+# the least recently used files beyond that are evicted after each
+# copyIn, except for the files of the job being copied in, which Tango
+# then records as cached.
+#
+import hashlib
+import os
+import shlex
+import threading
+
+import config
+
+# Exit status of a copyIn command that found a file missing from the
+# host's cache
+MISSING = 97
+
+
+class HostCache(object):
+    def __init__(self):
+        self.dir = os.path.join(config.Config.DOCKER_VOLUME_PATH, ".cache")
+        # (device, inode, size, mtime) of a local file -> its key
+        self.keys = {}
+        # host -> keys of the files Tango has cached on it
+        self.cached = {}
+        # host -> bytes of input files sent, and reused from its cache
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def key(self, path):
+        """key - Returns the name that the file at path is cached
+        under. Files are hashed once for as long as they do not change.
+        """
+        st = os.stat(path)
+        fileId = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        with self.lock:
+            if fileId in self.keys:
+                return self.keys[fileId]
+
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(chunk)
+        key = sha.hexdigest() + ("x" if st.st_mode & 0o111 else "")
+        with self.lock:
+            self.keys[fileId] = key
+        return key
+
+    def missing(self, host, inputFiles):
+        """missing - Returns the keys of inputFiles, and a dictionary
+        from the key of each file that host's cache lacks to its path
+        """
+        keys = [self.key(file.localFile) for file in inputFiles]
+        with self.lock:
+            cached = self.cached.get(host, set())
+            missing = dict(
+                (key, file.localFile)
+                for (key, file) in zip(keys, inputFiles)
+                if key not in cached
+            )
+        return (keys, missing)
+
+    def command(self, volumePath, inputFiles, keys, missing, instanceName):
+        """command - Returns the shell command that creates the volume
+        at volumePath, caches the files in missing, which it reads as a
+        gzipped tar from its input, links inputFiles into the volume,
+        and then evicts files beyond the cache's size, other than the
+        ones in keys
+        """
+        incoming = ".incoming-%s" % instanceName
+        steps = [
+            "rm -rf %s" % volumePath,
+            "mkdir -p %s %s || exit 1" % (self.dir, volumePath),
+            "cd %s || exit 1" % self.dir,
+        ]
+        if missing:
+            steps += [
+                "rm -rf %s; mkdir %s && tar -xzf - -C %s || exit 1"
+                % (incoming, incoming, incoming),
+                "chmod a-w %s/* && mv -f %s/* . && rmdir %s || exit 1"
+                % (incoming, incoming, incoming),
+            ]
+        for (key, file) in zip(keys, inputFiles):
+            dest = shlex.quote(os.path.join(volumePath, file.destFile))
+            steps.append(
+                "touch -c %s; ln %s %s 2>/dev/null || cp -p %s %s 2>/dev/null "
+                "|| exit %d" % (key, key, dest, key, dest, MISSING)
+            )
+        steps.append(
+            "find . -maxdepth 1 -type f -printf '%%T@ %%s %%f\\n' | sort -rn | "
+            'awk \'BEGIN {split("%s", keys); for (i in keys) keep[keys[i]]} '
+            "{total += $2} total > %d && !($3 in keep) {print $3}' | "
+            "xargs -r rm -f"
+            % (" ".join(keys), config.Config.DOCKER_HOST_CACHE_SIZE * 1024 * 1024)
+        )
+        return "(%s)" % "; ".join(steps)
+
+    def stored(self, host, inputFiles, keys, missing):
+        """stored - Record that a copyIn to host cached the files in
+        missing and reused the rest
+        """
+        sent = sum(os.path.getsize(path) for path in missing.values())
+        reused = sum(
+            os.path.getsize(file.localFile)
+            for (key, file) in zip(keys, inputFiles)
+            if key not in missing
+        )
+        with self.lock:
+            self.cached.setdefault(host, set()).update(keys)
+            stats = self.stats.setdefault(host, {"bytes_sent": 0, "bytes_reused": 0})
+            stats["bytes_sent"] += sent
+            stats["bytes_reused"] += reused
+
+    def forget(self, host):
+        """forget - Stop assuming that host has any file cached"""
+        with self.lock:
+            self.cached.pop(host, None)
+
+    def getStats(self, host):
+        with self.lock:
+            return dict(self.stats.get(host, {"bytes_sent": 0, "bytes_reused": 0}))
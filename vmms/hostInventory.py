@@ -0,0 +1,347 @@
+#
+# hostInventory.py - Tracks the load of distDocker's worker hosts and
+# decides which host each VM runs on.
+#
+# Every DOCKER_HOST_LOAD_INTERVAL seconds each host is probed over SSH
+# for its cores, load average, memory, and running containers. The VMs
+# Tango has placed on a host are counted as it places and destroys
+# them rather than taken from the probe, so a burst of placements does
+# not pile onto the host that looked idlest at the last probe.
+# Placement is either to the least loaded host, or to the less loaded
+# of two hosts picked at random ("two_choices"). Per-host metrics are
+# kept in a TangoDictionary, so that every Tango process can report
+# them.
+#
+# Hosts also heartbeat every DOCKER_HOST_HEARTBEAT_INTERVAL seconds (a
+# successful load probe counts as one). A host with no heartbeat for
+# DOCKER_HOST_FAILURE_TIMEOUT seconds is marked down, and no VMs are
+# placed on it until it heartbeats again. The owner is told of both,
+# so that it can abandon the VMs on a failed host and clean up after
+# it once it recovers.
+#
+import logging
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from tangoObjects import TangoDictionary
+
+
+def probeCommand():
+    """probeCommand - Returns a shell command that prints a host's
+    cores, load average, total and available memory (kB), and the
+    number of running containers that Tango did not start, one per line
+    """
+    return (
+        "(nproc; cut -d ' ' -f 1 /proc/loadavg; "
+        "awk '/^MemTotal:/ {print $2} /^MemAvailable:/ {print $2}' /proc/meminfo; "
+        "docker ps --format '{{.Names}}' | grep -cv '^%s-')" % config.Config.PREFIX
+    )
+
+
+def parseProbe(output):
+    """parseProbe - Turns the output of probeCommand() into a load
+    report, or returns None if it is malformed
+    """
+    if isinstance(output, bytes):
+        output = output.decode("utf-8", "replace")
+    try:
+        (cores, load, memTotal, memAvailable, others) = output.split()
+        return {
+            "cores": int(cores),
+            "load": float(load),
+            "memory": int(memTotal) // 1024,
+            "free_memory": int(memAvailable) // 1024,
+            "other_containers": int(others),
+        }
+    except (AttributeError, ValueError):
+        return None
+
+
+class HostInventory(object):
+    def __init__(self, probe, hosts=None, heartbeat=None, onDown=None, onUp=None):
+        """probe is a function from a host to its load report (see
+        parseProbe), or None if the host cannot be reached. hosts is a
+        function that returns the current host names. heartbeat is a
+        function from a host to whether it answered. onDown is called
+        with a host that has failed and the keys of the VMs placed on
+        it, and onUp with a failed host that has recovered.
+        """
+        self.probe = probe
+        self.listHosts = hosts or self.configuredHosts
+        self.heartbeat = heartbeat
+        self.onDown = onDown
+        self.onUp = onUp
+        # host -> time of its last heartbeat
+        self.lastHeartbeat = {}
+        # Hosts that are marked down
+        self.down = set()
+        # host -> latest load report, None if the host did not answer
+        self.reports = {}
+        # host -> number of Tango's VMs on it
+        self.vmCounts = {}
+        # host -> MB of memory placed on it since its last report
+        self.placedMemory = {}
+        # key -> (host, MB of memory) of every VM placed
+        self.placements = {}
+        self.lock = threading.Lock()
+        self.started = False
+        self.metrics = TangoDictionary("distDockerHosts")
+        self.log = logging.getLogger("HostInventory")
+
+    @staticmethod
+    def configuredHosts():
+        """configuredHosts - DOCKER_HOSTS, or else every address that
+        HOST_ALIAS resolves to
+        """
+        if config.Config.DOCKER_HOSTS:
+            return list(config.Config.DOCKER_HOSTS)
+        try:
+            return socket.gethostbyname_ex(config.Config.HOST_ALIAS)[2]
+        except EnvironmentError:
+            return []
+
+    def start(self):
+        """start - Probe every host now, and then again every
+        DOCKER_HOST_LOAD_INTERVAL seconds in the background
+        """
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        self.refresh()
+        thread = threading.Thread(target=self.__monitor)
+        thread.daemon = True
+        thread.start()
+        if self.heartbeat:
+            thread = threading.Thread(target=self.__heartbeats)
+            thread.daemon = True
+            thread.start()
+
+    def __monitor(self):
+        while True:
+            time.sleep(config.Config.DOCKER_HOST_LOAD_INTERVAL)
+            try:
+                self.refresh()
+            except Exception as e:
+                self.log.error("Host load refresh failed: %s" % e)
+
+    def __heartbeats(self):
+        while True:
+            time.sleep(config.Config.DOCKER_HOST_HEARTBEAT_INTERVAL)
+            try:
+                hosts = self.hosts()
+                with ThreadPoolExecutor(max_workers=max(len(hosts), 1)) as pool:
+                    answers = dict(zip(hosts, pool.map(self.heartbeat, hosts)))
+                self.beat([host for host in hosts if answers[host]])
+            except Exception as e:
+                self.log.error("Host heartbeat failed: %s" % e)
+
+    def refresh(self):
+        """refresh - Probe the load of every host"""
+        hosts = self.listHosts()
+        with ThreadPoolExecutor(max_workers=max(len(hosts), 1)) as pool:
+            reports = dict(zip(hosts, pool.map(self.probe, hosts)))
+        with self.lock:
+            self.reports = reports
+            self.placedMemory = dict((host, 0) for host in hosts)
+            scores = dict((host, self.score(host)) for host in hosts)
+        self.beat([host for host in hosts if reports[host] is not None])
+        for (host, report) in reports.items():
+            if report is None:
+                self.log.info("Host %s did not report its load" % host)
+            metrics = self._getMetrics(host)
+            metrics["report"] = report
+            metrics["reported_at"] = time.time()
+            metrics["score"] = scores[host] if report else None
+            self.metrics.set(host, metrics)
+
+    def beat(self, hosts, now=None):
+        """beat - Record a heartbeat from each of hosts, and mark the
+        hosts that have missed theirs for too long down, and the ones
+        that are back up
+        """
+        now = now or time.time()
+        failed = []
+        recovered = []
+        with self.lock:
+            for host in hosts:
+                self.lastHeartbeat[host] = now
+            for host in self.reports:
+                last = self.lastHeartbeat.get(host)
+                alive = (
+                    last is not None
+                    and now - last <= config.Config.DOCKER_HOST_FAILURE_TIMEOUT
+                )
+                if not alive and host not in self.down:
+                    self.down.add(host)
+                    keys = [
+                        key
+                        for (key, (placed, memory)) in self.placements.items()
+                        if placed == host
+                    ]
+                    # The host's containers are lost with it, so their
+                    # placements no longer count against it
+                    for key in keys:
+                        self._release(key)
+                    failed.append((host, keys))
+                elif alive and host in self.down:
+                    self.down.discard(host)
+                    recovered.append(host)
+
+        for host in hosts:
+            metrics = self._getMetrics(host)
+            metrics["last_heartbeat"] = now
+            self.metrics.set(host, metrics)
+        for (host, keys) in failed:
+            self.log.error("Host %s is down" % host)
+            self._setStatus(host, "down")
+            if self.onDown:
+                self.onDown(host, keys)
+        for host in recovered:
+            self.log.info("Host %s is back up" % host)
+            self._setStatus(host, "up")
+            if self.onUp:
+                self.onUp(host)
+
+    def _setStatus(self, host, status):
+        metrics = self._getMetrics(host)
+        metrics["status"] = status
+        self.metrics.set(host, metrics)
+
+    def isDown(self, host):
+        """isDown - Returns True if host is marked down"""
+        with self.lock:
+            return host in self.down
+
+    def liveHosts(self):
+        """liveHosts - Returns the current hosts, but for those that
+        are marked down
+        """
+        with self.lock:
+            down = set(self.down)
+        return [host for host in self.listHosts() if host not in down]
+
+    def hosts(self):
+        """hosts - Returns the hosts in the inventory"""
+        if not self.started:
+            self.start()
+        with self.lock:
+            return list(self.reports.keys())
+
+    def score(self, host):
+        """score - Returns how loaded host is, as the largest of the
+        fraction of its cores that are busy, by container count or by
+        load average, and the fraction of its memory in use. Hosts that
+        did not report score infinitely high. Expects the lock held.
+        """
+        report = self.reports.get(host)
+        if report is None:
+            return float("inf")
+        cores = max(report["cores"], 1)
+        containers = report["other_containers"] + self.vmCounts.get(host, 0)
+        busy = max(containers, report["load"]) / cores
+        free = report["free_memory"] - self.placedMemory.get(host, 0)
+        return max(busy, 1 - free / max(report["memory"], 1))
+
+    def _fits(self, host, memory):
+        report = self.reports.get(host)
+        if report is None:
+            return False
+        return report["free_memory"] - self.placedMemory.get(host, 0) >= memory
+
+    def place(self, key, vm, exclude=()):
+        """place - Pick the host for vm according to DOCKER_PLACEMENT,
+        skipping the hosts in exclude where possible, and count vm
+        against it until it is released under key. A VM that is placed
+        again is moved. Returns None if there are no hosts.
+        """
+        if not self.started:
+            self.start()
+        memory = vm.memory or 0
+        with self.lock:
+            self._release(key)
+            live = [host for host in self.reports if host not in self.down]
+            candidates = [host for host in live if host not in exclude]
+            if not candidates:
+                candidates = live
+            if not candidates:
+                return None
+            # Prefer hosts that have the memory to spare
+            fitting = [host for host in candidates if self._fits(host, memory)]
+            candidates = fitting or candidates
+
+            if config.Config.DOCKER_PLACEMENT == "two_choices":
+                choices = random.sample(candidates, min(2, len(candidates)))
+                host = min(choices, key=self.score)
+            else:
+                # Break ties randomly, so that idle hosts share the work
+                random.shuffle(candidates)
+                host = min(candidates, key=self.score)
+
+            self.placements[key] = (host, memory)
+            self.vmCounts[host] = self.vmCounts.get(host, 0) + 1
+            self.placedMemory[host] = self.placedMemory.get(host, 0) + memory
+            score = self.score(host)
+
+        metrics = self._getMetrics(host)
+        metrics["placements"] += 1
+        metrics["score"] = score
+        self.metrics.set(host, metrics)
+        self.log.debug("Placed %s on host %s (score %.2f)" % (key, host, score))
+        return host
+
+    def hostOf(self, key):
+        """hostOf - Returns the host the VM under key is placed on, or
+        None if it is not placed
+        """
+        with self.lock:
+            placement = self.placements.get(key)
+        return placement[0] if placement else None
+
+    def release(self, key):
+        """release - Stop counting the VM placed under key"""
+        with self.lock:
+            self._release(key)
+
+    def _release(self, key):
+        if key not in self.placements:
+            return
+        (host, memory) = self.placements.pop(key)
+        self.vmCounts[host] -= 1
+        if host in self.placedMemory:
+            self.placedMemory[host] = max(0, self.placedMemory[host] - memory)
+
+    def recordFailure(self, host):
+        """recordFailure - Count a VM that could not be set up on host"""
+        metrics = self._getMetrics(host)
+        metrics["failures"] += 1
+        self.metrics.set(host, metrics)
+
+    def _getMetrics(self, host):
+        metrics = self.metrics.get(host)
+        if metrics is None:
+            metrics = {
+                "placements": 0,
+                "failures": 0,
+                "score": None,
+                "report": None,
+                "reported_at": None,
+                "status": "up",
+                "last_heartbeat": None,
+            }
+        return metrics
+
+    def getStats(self):
+        """getStats - Returns the metrics of every host, with the number
+        of Tango's VMs on it
+        """
+        stats = {}
+        for host in self.metrics.keys():
+            stats[host] = self.metrics.get(host)
+            if stats[host] is not None:
+                stats[host]["vms"] = self.vmCounts.get(host, 0)
+        return stats
@@ -0,0 +1,100 @@
+#
+# jobRunner.py - Runs a distDocker job, returns its feedback, and
+# cleans up after it, all in one ssh session.
+#
+# runnerScript() is a shell script that distDocker's runJob runs on the
+# worker host. It runs the container, prints the feedback after a
+# header giving its length, removes the container and its volume, and
+# ends with the container's exit status and the times each stage took.
+# parseRunner() takes the output apart again. copyOut then only has to
+# write the feedback that runJob already received.
+#
+import shlex
+
+# autodriver's own messages come on top of the job's output
+_FEEDBACK_SLACK = 64 * 1024
+
+_FEEDBACK = b"\nTANGO_FEEDBACK "
+
+
+def runnerScript(instanceName, volumePath, image, runArgs, command, maxFeedback):
+    """runnerScript - Returns the script that runs command in a
+    container called instanceName from image, with volumePath mounted
+    at /home/mount and the extra docker run arguments runArgs. At most
+    maxFeedback bytes of feedback are returned.
+    """
+    feedback = shlex.quote(volumePath + "feedback")
+    return """
+t0=$(date +%%s.%%N)
+docker run --name %(name)s -v %(volume)s:/home/mount %(args)s %(image)s sh -c %(command)s
+s=$?
+t1=$(date +%%s.%%N)
+echo
+if [ -f %(feedback)s ]; then
+    n=$(wc -c < %(feedback)s)
+    [ "$n" -gt %(max)d ] && n=%(max)d
+    echo "TANGO_FEEDBACK $n"
+    head -c "$n" %(feedback)s
+else
+    echo "TANGO_FEEDBACK none"
+fi
+t2=$(date +%%s.%%N)
+docker rm -f %(name)s >/dev/null 2>&1
+rm -rf %(volume)s
+t3=$(date +%%s.%%N)
+echo
+echo "TANGO_STATUS $s $t0 $t1 $t2 $t3"
+""" % {
+        "name": shlex.quote(instanceName),
+        "volume": shlex.quote(volumePath),
+        "args": runArgs,
+        "image": shlex.quote(image),
+        "command": shlex.quote(command),
+        "feedback": feedback,
+        "max": maxFeedback + _FEEDBACK_SLACK,
+    }
+
+
+def parseRunner(output):
+    """parseRunner - Returns (status, containerOutput, feedback,
+    timings) from the output of runnerScript(). status is the
+    container's exit status, feedback is None if the job left none,
+    and timings gives the seconds spent in the run, copyout, and
+    cleanup stages. Returns None if the script did not finish.
+    """
+    if output is None:
+        return None
+    start = output.find(_FEEDBACK)
+    if start < 0:
+        return None
+    containerOutput = output[:start]
+    (header, rest) = output[start + len(_FEEDBACK) :].split(b"\n", 1)
+    feedback = None
+    if header != b"none":
+        try:
+            size = int(header)
+        except ValueError:
+            return None
+        (feedback, rest) = (rest[:size], rest[size:])
+
+    for line in rest.splitlines():
+        fields = line.split()
+        if fields[:1] != [b"TANGO_STATUS"]:
+            continue
+        try:
+            status = int(fields[1])
+        except (IndexError, ValueError):
+            return None
+        timings = {}
+        try:
+            times = [float(field) for field in fields[2:6]]
+            timings = {
+                "run_seconds": times[1] - times[0],
+                "copyout_seconds": times[2] - times[1],
+                "cleanup_seconds": times[3] - times[2],
+            }
+        except (IndexError, ValueError):
+            # The host's date cannot print fractions of seconds
+            pass
+        return (status, containerOutput, feedback, timings)
+    return None
@@ -4,6 +4,7 @@
 #
 import random
 import subprocess
+import json
 import re
 import time
 import logging
@@ -12,78 +13,216 @@ import os
 import sys
 import shutil
 import config
+from vmms.processSupervisor import run, timeout
+from vmms.resourceUsage import USAGE_COMMAND, parseUsage
+from inputStore import digest, stage
+from coreAllocator import CoreAllocator, formatCPUList
 from tangoObjects import TangoMachine
 
+# Printed by a job that filled its tmpfs
+_TMPFS_FULL = "TANGO_TMPFS_FULL"
 
-def timeout(command, time_out=1):
-    """timeout - Run a unix command with a timeout. Return -1 on
-    timeout, otherwise return the return value from the command, which
-    is typically 0 for success, 1-255 for failure.
-    """
+#
+# User defined exceptions
+#
 
-    # Launch the command
-    p = subprocess.Popen(
-        command, stdout=open("/dev/null", "w"), stderr=subprocess.STDOUT
-    )
 
-    # Wait for the command to complete
-    t = 0.0
-    while t < time_out and p.poll() is None:
-        time.sleep(config.Config.TIMER_POLL_INTERVAL)
-        t += config.Config.TIMER_POLL_INTERVAL
+class ContainerStates(object):
 
-    # Determine why the while loop terminated
-    if p.poll() is None:
-        try:
-            os.kill(p.pid, 9)
-        except OSError:
-            pass
-        returncode = -1
-    else:
-        returncode = p.poll()
-    return returncode
-
-
-def timeoutWithReturnStatus(command, time_out, returnValue=0):
-    """timeoutWithReturnStatus - Run a Unix command with a timeout,
-    until the expected value is returned by the command; On timeout,
-    return last error code obtained from the command.
     """
-    p = subprocess.Popen(
-        command, stdout=open("/dev/null", "w"), stderr=subprocess.STDOUT
-    )
-    t = 0.0
-    while t < time_out:
-        ret = p.poll()
-        if ret is None:
+    ContainerStates - The state ("created", "running" or "exited") of
+    every Tango container, kept up to date by following the docker
+    event stream, so that lifecycle calls can wait for a state change
+    instead of polling the daemon. Containers that no longer exist are
+    not in the table. The table is only authoritative while synced.
+    """
+
+    _ACTIONS = {"create": "created", "start": "running", "die": "exited"}
+
+    def __init__(self, api=None):
+        self.api = api
+        self.states = {}
+        self.synced = False
+        self.cond = threading.Condition()
+        self.log = logging.getLogger("ContainerStates")
+        # The current event stream: the docker events process, or the
+        # API's stream
+        self.stream = None
+        self.stopped = False
+
+    def start(self):
+        thread = threading.Thread(target=self.__follow)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        """stop - Stop following events"""
+        self.stopped = True
+        self._close()
+
+    def __follow(self):
+        """__follow - Subscribe to container events, load the current
+        containers, and apply events until the stream ends. Then
+        resubscribe, since the daemon may have been restarted.
+        """
+        while not self.stopped:
+            try:
+                events = self._events()
+                with self.cond:
+                    self.states = self._list()
+                    self.synced = True
+                    self.cond.notify_all()
+                for event in events:
+                    self._apply(event)
+            except Exception as e:
+                self.log.debug("Docker event stream failed: %s" % e)
+            self._close()
+            with self.cond:
+                self.synced = False
+                self.cond.notify_all()
             time.sleep(config.Config.TIMER_POLL_INTERVAL)
-            t += config.Config.TIMER_POLL_INTERVAL
-        elif ret == returnValue:
-            return ret
+
+    def _events(self):
+        """_events - Returns an iterator over decoded container events.
+        The subscription is made before this returns.
+        """
+        if self.api:
+            stream = self.api.events(filters={"type": "container"}, decode=True)
+            events = stream
         else:
-            p = subprocess.Popen(
-                command, stdout=open("/dev/null", "w"), stderr=subprocess.STDOUT
+            stream = subprocess.Popen(
+                ["docker", "events", "--filter", "type=container"]
+                + ["--format", "{{json .}}"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
             )
-    return ret
+            events = (json.loads(line) for line in stream.stdout)
+        with self.cond:
+            self.stream = stream
+        if self.stopped:
+            self._close()
+        return events
+
+    def _close(self):
+        """_close - End the current event stream, and reap its process"""
+        with self.cond:
+            (stream, self.stream) = (self.stream, None)
+        if stream is None:
+            return
+        if isinstance(stream, subprocess.Popen):
+            stream.kill()
+            stream.wait()
+            stream.stdout.close()
+        else:
+            stream.close()
+
+    def _list(self):
+        """_list - Returns the current state of every Tango container"""
+        if self.api:
+            containers = [
+                (container["Names"][0].lstrip("/"), container["State"])
+                for container in self.api.containers(all=True)
+            ]
+        else:
+            o = subprocess.check_output(
+                ["docker", "ps", "-a", "--format", "{{.Names}} {{.State}}"]
+            ).decode("utf-8")
+            containers = [tuple(row.split(" ")) for row in o.split("\n") if row]
+
+        states = {}
+        for (name, state) in containers:
+            if name.startswith("%s-" % config.Config.PREFIX):
+                states[name] = state if state in ("created", "running") else "exited"
+        return states
+
+    def _apply(self, event):
+        name = event.get("Actor", {}).get("Attributes", {}).get("name", "")
+        if not name.startswith("%s-" % config.Config.PREFIX):
+            return
+        action = event.get("Action", event.get("status"))
+        with self.cond:
+            if action == "destroy":
+                self.states.pop(name, None)
+            elif action in ContainerStates._ACTIONS:
+                self.states[name] = ContainerStates._ACTIONS[action]
+            else:
+                return
+            self.cond.notify_all()
 
+    def get(self, name):
+        """get - Returns the state of a container, or None if it does
+        not exist
+        """
+        with self.cond:
+            return self.states.get(name)
 
-#
-# User defined exceptions
-#
+    def names(self):
+        with self.cond:
+            return list(self.states.keys())
+
+    def waitFor(self, name, states, time_out):
+        """waitFor - Wait at most time_out seconds for the container to
+        be in one of states (None for gone). Returns True if it is,
+        and False on timeout or if the table is no longer synced.
+        """
+        with self.cond:
+            self.cond.wait_for(
+                lambda: not self.synced or self.states.get(name) in states,
+                max(0, time_out),
+            )
+            return self.synced and self.states.get(name) in states
 
 
 class LocalDocker(object):
+
+    # Every container Tango creates carries these labels, so that it
+    # can be found without parsing container or volume names
+    _LABEL = "org.autolab.tango.%s"
+
     def __init__(self):
         """Checks if the machine is ready to run docker containers.
         Initialize boot2docker if running on OS X.
         """
         try:
             self.log = logging.getLogger("LocalDocker")
+            # Containers being recycled in the background, keyed off
+            # instance name
+            self.recycling = {}
+            self.recyclingLock = threading.Lock()
+            self.hostCapacity = None
+            # Resources used by the last job of each VM, keyed off
+            # instance name, until the worker collects them
+            self.usage = {}
+            # Name of each shared artifact -> when a job last used it
+            self.sharedUsed = {}
+            self.sharedPruned = 0
+            self.sharedLock = threading.Lock()
 
             # Check import docker constants are defined in config
             if len(config.Config.DOCKER_VOLUME_PATH) == 0:
                 raise Exception("DOCKER_VOLUME_PATH not defined in config.")
 
+            # Low-level Docker Engine API client, if we use the API
+            # rather than the docker CLI. Requests have no socket
+            # timeout; the calls that can block are bounded by
+            # waitVM and _exec.
+            self.api = None
+            if config.Config.DOCKER_USE_API:
+                import docker
+
+                self.api = docker.from_env(
+                    timeout=None, max_pool_size=config.Config.DOCKER_API_POOL_SIZE
+                ).api
+
+            self.containers = ContainerStates(self.api)
+            if config.Config.DOCKER_TRACK_EVENTS:
+                self.containers.start()
+
+            # Disjoint cores for the containers running jobs, if pinned
+            self.coreAllocator = None
+            if config.Config.DOCKER_CORE_PINNING:
+                self.coreAllocator = CoreAllocator()
+
         except Exception as e:
             self.log.error(str(e))
             exit(1)
@@ -101,11 +240,238 @@ class LocalDocker(object):
         volumePath = os.path.join(volumePath, instanceName, "")
         return volumePath
 
+    def getSharedPath(self):
+        """getSharedPath - Returns the directory of shared artifacts,
+        which is mounted read-only at /home/shared in every container.
+        It is kept apart from the volumes so that it cannot be written
+        through /home/mount.
+        """
+        return self.getVolumePath(".shared")
+
     def getDockerVolumePath(self, dockerPath, instanceName):
         # Last empty string to cause trailing '/'
         volumePath = os.path.join(dockerPath, instanceName, "")
         return volumePath
 
+    def getHostVolumePath(self, instanceName):
+        """getHostVolumePath - Returns the volume path as seen by the
+        docker daemon, which differs from ours if Tango itself runs in
+        a container.
+        """
+        if os.getenv("DOCKER_TANGO_HOST_VOLUME_PATH"):
+            return self.getDockerVolumePath(
+                os.getenv("DOCKER_TANGO_HOST_VOLUME_PATH"), instanceName
+            )
+        return self.getVolumePath(instanceName)
+
+    def getHostCapacity(self):
+        """getHostCapacity - Returns the (cores, memory in MB) that the
+        docker daemon can give containers, falling back to those of the
+        machine we run on.
+        """
+        if self.hostCapacity is None:
+            try:
+                if self.api:
+                    info = self.api.info()
+                    (cores, memory) = (info["NCPU"], info["MemTotal"])
+                else:
+                    result = run(
+                        ["docker", "info", "--format", "{{.NCPU}} {{.MemTotal}}"],
+                        config.Config.INITIALIZEVM_TIMEOUT,
+                        capture=True,
+                    )
+                    (cores, memory) = result.output.decode().split()
+                self.hostCapacity = (int(cores), int(memory) // (1024 * 1024))
+            except Exception as e:
+                self.log.debug("docker info failed, using local capacity: %s" % e)
+                memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+                self.hostCapacity = (os.cpu_count(), memory // (1024 * 1024))
+        return self.hostCapacity
+
+    def waitRecycled(self, vm, max_secs=None):
+        """waitRecycled - Wait for a background recycle of this VM's
+        container, if any, to finish.
+        """
+        instanceName = self.instanceName(vm.id, vm.image)
+        with self.recyclingLock:
+            thread = self.recycling.get(instanceName)
+        if thread:
+            thread.join(max_secs)
+
+    def recycleVM(self, vm):
+        """recycleVM - Replace the container of a VM that has run a
+        job with a fresh idle one, so the VM can go back to its pool
+        warm. The work is done in the background; waitVM and destroyVM
+        wait for it.
+        """
+        instanceName = self.instanceName(vm.id, vm.image)
+
+        def recycle():
+            try:
+                self.destroyVM(vm, waitRecycled=False)
+                self.initializeVM(vm)
+            finally:
+                with self.recyclingLock:
+                    self.recycling.pop(instanceName, None)
+
+        thread = threading.Thread(target=recycle)
+        thread.daemon = True
+        with self.recyclingLock:
+            self.recycling[instanceName] = thread
+        thread.start()
+
+    def _labels(self, vm):
+        """_labels - Returns the labels of the container of vm"""
+        return {
+            LocalDocker._LABEL % "prefix": config.Config.PREFIX,
+            LocalDocker._LABEL % "vm_id": str(vm.id),
+            LocalDocker._LABEL % "pool": str(vm.name),
+            LocalDocker._LABEL % "image": str(vm.image),
+        }
+
+    def _startContainer(self, instanceName, vm):
+        """_startContainer - Start a detached container that idles
+        until jobs are exec'd in it. Returns 0 on success.
+        """
+        hostVolumePath = self.getHostVolumePath(instanceName)
+        binds = {hostVolumePath: {"bind": "/home/mount", "mode": "rw"}}
+        if config.Config.DOCKER_SHARED_ARTIFACTS:
+            hostSharedPath = self.getHostVolumePath(".shared")
+            binds[hostSharedPath] = {"bind": "/home/shared", "mode": "ro"}
+        tmpfs = {}
+        if self._tmpfsSize(vm):
+            tmpfs["/home/tmpfs"] = "rw,exec,size=%dm,mode=1777" % self._tmpfsSize(vm)
+        command = ["tail", "-f", "/dev/null"]
+        labels = self._labels(vm)
+        if self.api:
+            try:
+                hostConfig = self.api.create_host_config(
+                    binds=binds,
+                    tmpfs=tmpfs,
+                    nano_cpus=int(vm.cores * 1e9) if vm.cores else None,
+                    mem_limit="%dm" % vm.memory if vm.memory else None,
+                )
+                container = self.api.create_container(
+                    vm.image,
+                    command,
+                    name=instanceName,
+                    labels=labels,
+                    host_config=hostConfig,
+                )
+                self.api.start(container["Id"])
+                return 0
+            except Exception as e:
+                self.log.error("Docker API failed to start %s: %s" % (instanceName, e))
+                return -1
+
+        args = ["docker", "run", "-d", "--name", instanceName]
+        for (path, bind) in binds.items():
+            args = args + ["-v", "%s:%s:%s" % (path, bind["bind"], bind["mode"])]
+        for (path, options) in tmpfs.items():
+            args = args + ["--tmpfs", "%s:%s" % (path, options)]
+        for (label, value) in labels.items():
+            args = args + ["--label", "%s=%s" % (label, value)]
+        if vm.cores:
+            args = args + [f"--cpus={vm.cores}"]
+        if vm.memory:
+            args = args + ["-m", f"{vm.memory}m"]
+        args = args + [vm.image] + command
+
+        self.log.debug("Starting container: %s" % str(args))
+        return timeout(args, config.Config.INITIALIZEVM_TIMEOUT)
+
+    def _exec(self, instanceName, command, time_out, capture=False):
+        """_exec - Run command in a running container, giving up after
+        time_out seconds. Returns the (exit status, output) pair, where
+        the status is -1 on timeout and output is only kept if capture
+        is set.
+        """
+        if not self.api:
+            result = run(
+                ["docker", "exec", instanceName] + command, time_out, capture=capture
+            )
+            return (result.returncode, result.output)
+
+        # exec_start returns when the command exits, so wait for it in
+        # a thread that we can stop waiting on at the deadline.
+        result = {"ret": -1, "output": None}
+
+        def execute():
+            try:
+                execId = self.api.exec_create(instanceName, command)["Id"]
+                output = self.api.exec_start(execId)
+                result["output"] = output if capture else None
+                result["ret"] = self.api.exec_inspect(execId)["ExitCode"]
+            except Exception as e:
+                self.log.debug("Docker API exec in %s failed: %s" % (instanceName, e))
+                result["ret"] = 1
+
+        thread = threading.Thread(target=execute)
+        thread.daemon = True
+        thread.start()
+        thread.join(time_out)
+        if thread.is_alive():
+            return (-1, None)
+        return (result["ret"], result["output"])
+
+    def _pinCores(self, instanceName, vm):
+        """_pinCores - Confine a container about to run a job to cores,
+        and the memory of a NUMA node, that no other running job uses.
+        Jobs run unpinned if no such cores are free.
+        """
+        allocation = self.coreAllocator.allocate(instanceName, vm.cores or 1)
+        if allocation is None:
+            self.log.info("Running %s without pinned cores" % instanceName)
+            return
+        (cpus, node) = allocation
+        if self.api:
+            try:
+                self.api.update_container(
+                    instanceName,
+                    cpuset_cpus=formatCPUList(cpus),
+                    cpuset_mems=str(node),
+                )
+                ret = 0
+            except Exception as e:
+                self.log.debug("Docker API update of %s failed: %s" % (instanceName, e))
+                ret = 1
+        else:
+            ret = timeout(
+                ["docker", "update"]
+                + ["--cpuset-cpus", formatCPUList(cpus)]
+                + ["--cpuset-mems", str(node), instanceName],
+                config.Config.WAITVM_TIMEOUT,
+            )
+        if ret != 0:
+            self.log.error("Failed to pin %s (status=%d)" % (instanceName, ret))
+            self.coreAllocator.release(instanceName)
+
+    def releaseCores(self, vm):
+        """releaseCores - Give back the cores pinned to a VM's job"""
+        if self.coreAllocator:
+            self.coreAllocator.release(self.instanceName(vm.id, vm.image))
+
+    def _tmpfsSize(self, vm):
+        """_tmpfsSize - Returns the size in MB of the tmpfs of the VM's
+        container, or None if it has none
+        """
+        return getattr(vm, "tmpfs", None) or config.Config.DOCKER_TMPFS_SIZE
+
+    def _fitsTmpfs(self, vm):
+        """_fitsTmpfs - Returns True if the VM has a tmpfs and the job
+        inputs staged in its volume take at most half of it, leaving
+        the rest for what the job writes.
+        """
+        size = self._tmpfsSize(vm)
+        if not size:
+            return False
+        volumePath = self.getVolumePath(self.instanceName(vm.id, vm.image))
+        inputBytes = sum(
+            entry.stat(follow_symlinks=False).st_size
+            for entry in os.scandir(volumePath)
+        )
+        return inputBytes <= size * 1024 * 1024 / 2
+
     def domainName(self, vm):
         """Returns the domain name that is stored in the vm
         instance.
@@ -116,58 +482,163 @@ class LocalDocker(object):
     # VMMS API functions
     #
     def initializeVM(self, vm):
-        """initializeVM -  Nothing to do for initializeVM"""
+        """initializeVM - Start an idle container for this VM, with its
+        volume directory mounted at /home/mount, so that jobs can be
+        run in it right away with `docker exec`.
+        """
+        instanceName = self.instanceName(vm.id, vm.image)
+        volumePath = self.getVolumePath(instanceName)
+
+        # Create a fresh volume
+        shutil.rmtree(volumePath, ignore_errors=True)
+        os.makedirs(volumePath)
+        if config.Config.DOCKER_SHARED_ARTIFACTS:
+            os.makedirs(self.getSharedPath(), exist_ok=True)
+
+        ret = self._startContainer(instanceName, vm)
+        if ret != 0:
+            self.log.error(
+                "Failed to start container %s (status=%d)" % (instanceName, ret)
+            )
         return vm
 
     def waitVM(self, vm, max_secs):
-        """waitVM - Nothing to do for waitVM"""
-        return
+        """waitVM - Wait at most max_secs for the VM's container to be
+        running. Return -1 if it does not come up in time.
+        """
+        start_time = time.time()
+        instanceName = self.instanceName(vm.id, vm.image)
+        self.waitRecycled(vm, max_secs)
+
+        while True:
+            if self.containers.synced:
+                # Wait for the start event rather than polling
+                remaining = max_secs - (time.time() - start_time)
+                if self.containers.waitFor(instanceName, ["running"], remaining):
+                    return 0
+            elif self.checkVM(vm):
+                return 0
+
+            elapsed_secs = time.time() - start_time
+            if elapsed_secs > max_secs:
+                self.log.info(
+                    "Container %s not running after %d secs"
+                    % (instanceName, elapsed_secs)
+                )
+                return -1
+            time.sleep(config.Config.TIMER_POLL_INTERVAL)
+
+    def checkVM(self, vm):
+        """checkVM - Returns True if the VM's container is running and
+        accepts commands.
+        """
+        instanceName = self.instanceName(vm.id, vm.image)
+        # `docker exec` only succeeds if the container is running
+        (ret, output) = self._exec(instanceName, ["true"], config.Config.WAITVM_TIMEOUT)
+        return ret == 0
 
     def copyIn(self, vm, inputFiles):
-        """copyIn - Create a directory to be mounted as a volume
-        for the docker containers. Copy input files to this directory.
+        """copyIn - Stage input files in the directory that is mounted
+        as a volume in the VM's container, linking rather than copying
+        them where possible. Shared files are staged once in the shared
+        directory, and the volume gets a symlink to them, which the job
+        directory keeps.
         """
         instanceName = self.instanceName(vm.id, vm.image)
         volumePath = self.getVolumePath(instanceName)
 
-        # Create a fresh volume
-        os.makedirs(volumePath)
+        os.makedirs(volumePath, exist_ok=True)
         for file in inputFiles:
+            destPath = volumePath + file.destFile
             # Create output directory if it does not exist
-            os.makedirs(os.path.dirname(volumePath), exist_ok=True)
-
-            shutil.copy(file.localFile, volumePath + file.destFile)
-            self.log.debug(
-                "Copied in file %s to %s" % (file.localFile, volumePath + file.destFile)
-            )
+            os.makedirs(os.path.dirname(destPath), exist_ok=True)
+
+            if config.Config.DOCKER_SHARED_ARTIFACTS and getattr(file, "shared", False):
+                name = self._share(file.localFile)
+                if os.path.lexists(destPath):
+                    os.unlink(destPath)
+                os.symlink(os.path.join("/home/shared", name), destPath)
+            else:
+                stage(file.localFile, destPath)
+            self.log.debug("Copied in file %s to %s" % (file.localFile, destPath))
+
+        if config.Config.DOCKER_SHARED_ARTIFACTS:
+            self._pruneShared()
         return 0
 
+    def _share(self, path):
+        """_share - Stage the file at path in the shared directory, once
+        for every job that uses it, under the digest of its contents.
+        Returns its name there.
+        """
+        mode = os.stat(path).st_mode
+        name = digest(path) + ("x" if mode & 0o111 else "")
+        sharedPath = self.getSharedPath() + name
+        with self.sharedLock:
+            os.makedirs(self.getSharedPath(), exist_ok=True)
+            if not os.path.exists(sharedPath):
+                tmp = "%s.%d.tmp" % (sharedPath, os.getpid())
+                stage(path, tmp)
+                os.chmod(tmp, mode & 0o555)
+                os.rename(tmp, sharedPath)
+            self.sharedUsed[name] = time.time()
+        return name
+
+    def _pruneShared(self):
+        """_pruneShared - Remove the shared artifacts that no job has
+        used for DOCKER_SHARED_ARTIFACTS_TTL seconds. Does nothing if it
+        already ran in that time. Artifacts staged before Tango started
+        count as used when they are first seen here.
+        """
+        ttl = config.Config.DOCKER_SHARED_ARTIFACTS_TTL
+        now = time.time()
+        with self.sharedLock:
+            if now - self.sharedPruned < ttl:
+                return
+            self.sharedPruned = now
+            for entry in os.scandir(self.getSharedPath()):
+                if now - self.sharedUsed.setdefault(entry.name, now) > ttl:
+                    os.unlink(entry.path)
+                    del self.sharedUsed[entry.name]
+                    self.log.debug("Pruned shared artifact %s" % entry.name)
+
     def runJob(self, vm, runTimeout, maxOutputFileSize, disableNetwork):
-        """runJob - Run a docker container by doing the follows:
-        - mount directory corresponding to this job to /home/autolab
-          in the container
+        """runJob - Run a job in the VM's running container by doing
+        the follows:
+        - copy the input files from the mounted volume to /home/autolab
         - run autodriver with corresponding ulimits and timeout as
           autolab user
         """
         instanceName = self.instanceName(vm.id, vm.image)
-        volumePath = self.getVolumePath(instanceName)
-        if os.getenv("DOCKER_TANGO_HOST_VOLUME_PATH"):
-            volumePath = self.getDockerVolumePath(
-                os.getenv("DOCKER_TANGO_HOST_VOLUME_PATH"), instanceName
-            )
-        args = ["docker", "run", "--name", instanceName, "-v"]
-        args = args + ["%s:%s" % (volumePath, "/home/mount")]
-        if vm.cores:
-            args = args + [f"--cpus={vm.cores}"]
-        if vm.memory:
-            args = args + ["-m", f"{vm.memory}m"]
+
         if disableNetwork:
-            args = args + ["--network", "none"]
-        args = args + [vm.image]
-        args = args + ["sh", "-c"]
+            # The container was started on the default bridge network,
+            # and is thrown away after this job.
+            if self.api:
+                try:
+                    self.api.disconnect_container_from_network(
+                        instanceName, "bridge", force=True
+                    )
+                    ret = 0
+                except Exception as e:
+                    self.log.debug("Docker API disconnect failed: %s" % e)
+                    ret = 1
+            else:
+                ret = timeout(
+                    ["docker", "network", "disconnect", "-f", "bridge", instanceName],
+                    config.Config.WAITVM_TIMEOUT,
+                )
+            if ret != 0:
+                self.log.error(
+                    "Failed to disable network for %s (status=%d)" % (instanceName, ret)
+                )
+                return ret
+
+        if self.coreAllocator:
+            self._pinCores(instanceName, vm)
 
         autodriverCmd = (
-            "autodriver -u %d -f %d -t %d -o %d autolab > output/feedback 2>&1"
+            "autodriver -u %d -f %d -t %d -o %d autolab > /home/output/feedback 2>&1"
             % (
                 config.Config.VM_ULIMIT_USER_PROC,
                 config.Config.VM_ULIMIT_FILE_SIZE,
@@ -176,38 +647,94 @@ class LocalDocker(object):
             )
         )
 
-        args = args + [
-            'cp -r mount/* autolab/; su autolab -c "%s"; \
-                        cp output/feedback mount/feedback'
-            % autodriverCmd
+        setup = "cd /home; "
+        check = ""
+        if self._fitsTmpfs(vm):
+            # Build the job directory on the tmpfs, and move the grading
+            # user's home, with whatever the image put in it, there too,
+            # so autodriver's move is a rename
+            setup = (
+                "cd /home/tmpfs && mkdir autolab autograde && "
+                "chown autolab:autolab autolab && "
+                "{ [ ! -d /home/autograde ] || cp -a /home/autograde/. autograde; } && "
+                "chown autograde:autograde autograde && "
+                "rm -rf /home/autograde && ln -s /home/tmpfs/autograde /home/autograde; "
+            )
+            # A job that fills the tmpfs fails with ENOSPC; say so in its
+            # feedback, keeping the status of the commands before
+            check = (
+                "s=$?; free=$(df -P /home/tmpfs | awk 'NR == 2 {print $4}'); "
+                "if [ $free -lt 1024 ]; then echo %s; "
+                "echo 'Autograder: the job ran out of space in its %dMB tmpfs' "
+                ">> /home/mount/feedback; fi; (exit $s); "
+                % (_TMPFS_FULL, self._tmpfsSize(vm))
+            )
+        elif self._tmpfsSize(vm):
+            self.log.info(
+                "Inputs of %s do not fit its tmpfs, using disk" % instanceName
+            )
+
+        args = [
+            "sh",
+            "-c",
+            # Shared files stay symlinks into /home/shared
+            setup + "cp -r /home/mount/* autolab/; chmod -R u+w autolab; "
+            # autodriver writes the job's output to ~autograde/output.log;
+            # point that at the volume so getPartialOutput can read it
+            "touch /home/mount/output.log; "
+            "chown autograde:autograde /home/mount/output.log; "
+            "ln -sf /home/mount/output.log /home/autograde/output.log; "
+            'su autolab -c "%s"; '
+            "cp /home/output/feedback /home/mount/feedback; %s%s"
+            % (autodriverCmd, check, USAGE_COMMAND),
         ]
 
         self.log.debug("Running job: %s" % str(args))
-        ret = timeout(args, runTimeout * 2)
+        (ret, output) = self._exec(instanceName, args, runTimeout * 2, capture=True)
+        self.usage[instanceName] = parseUsage(output)
+        if output and _TMPFS_FULL.encode() in output:
+            self.log.warning("Job in %s filled its tmpfs" % instanceName)
         self.log.debug("runJob returning %d" % ret)
 
         return ret
 
+    def getResourceUsage(self, vm):
+        """getResourceUsage - Returns what the last job run in the VM
+        used, as measured by its container's cgroup, or None
+        """
+        return self.usage.pop(self.instanceName(vm.id, vm.image), None)
+
     def copyOut(self, vm, destFile):
         """copyOut - Copy the autograder feedback from container to
-        destFile on the Tango host. Then, destroy that container.
-        Containers are never reused.
+        destFile on the Tango host. Containers are never reused for
+        another job: the worker recycles the VM if it goes back to its
+        pool, and destroys it otherwise.
         """
         instanceName = self.instanceName(vm.id, vm.image)
         volumePath = self.getVolumePath(instanceName)
         shutil.move(volumePath + "feedback", destFile)
         self.log.debug("Copied feedback file to %s" % destFile)
-        self.destroyVM(vm)
 
         return 0
 
-    def destroyVM(self, vm):
+    def destroyVM(self, vm, waitRecycled=True):
         """destroyVM - Delete the docker container."""
+        if waitRecycled:
+            self.waitRecycled(vm)
         instanceName = self.instanceName(vm.id, vm.image)
         volumePath = self.getVolumePath("")
+        self.releaseCores(vm)
         # Do a hard kill on corresponding docker container.
         # Return status does not matter.
-        timeout(["docker", "rm", "-f", instanceName], config.Config.DOCKER_RM_TIMEOUT)
+        if self.api:
+            try:
+                self.api.remove_container(instanceName, force=True)
+            except Exception as e:
+                self.log.debug("Docker API remove of %s: %s" % (instanceName, e))
+        else:
+            timeout(
+                ["docker", "rm", "-f", instanceName], config.Config.DOCKER_RM_TIMEOUT
+            )
         # Destroy corresponding volume if it exists.
         if instanceName in os.listdir(volumePath):
             shutil.rmtree(volumePath + instanceName)
@@ -219,70 +746,167 @@ class LocalDocker(object):
         sure it is removed.
         """
         start_time = time.time()
+        instanceName = self.instanceName(vm.id, vm.image)
         while self.existsVM(vm):
             if time.time() - start_time > config.Config.DESTROY_SECS:
                 self.log.error("Failed to safely destroy container %s" % vm.name)
                 return
             self.destroyVM(vm)
+            if self.containers.synced:
+                # Wait for the destroy event rather than polling
+                remaining = config.Config.DESTROY_SECS - (time.time() - start_time)
+                self.containers.waitFor(instanceName, [None], remaining)
         return
 
     def getVMs(self):
-        """getVMs - Executes and parses `docker ps`. This function
-        is a lot of parsing and can break easily.
+        """getVMs - Lists the Tango containers of this PREFIX by their
+        labels, in one `docker ps` (or API) call, plus any volume left
+        behind by a container that no longer exists. Each machine is
+        named after its instance.
         """
-        # Get all volumes of docker containers
+        prefixLabel = "%s=%s" % (LocalDocker._LABEL % "prefix", config.Config.PREFIX)
+        labels = [LocalDocker._LABEL % key for key in ("vm_id", "pool", "image")]
+        if self.api:
+            containers = [
+                [container["Names"][0].lstrip("/")]
+                + [container["Labels"].get(label) for label in labels]
+                for container in self.api.containers(
+                    all=True, filters={"label": prefixLabel}
+                )
+            ]
+        else:
+            fields = ["{{.Names}}"] + ['{{.Label "%s"}}' % label for label in labels]
+            result = run(
+                ["docker", "ps", "-a", "--filter", "label=%s" % prefixLabel]
+                + ["--format", "\t".join(fields)],
+                config.Config.DOCKER_RM_TIMEOUT,
+                capture=True,
+            )
+            if result.returncode != 0:
+                raise Exception("docker ps failed (status=%d)" % result.returncode)
+            containers = [
+                row.split("\t")
+                for row in result.output.decode("utf-8").split("\n")
+                if row
+            ]
+
         machines = []
-        volumePath = self.getVolumePath("")
-        for volume in os.listdir(volumePath):
-            if re.match("%s-" % config.Config.PREFIX, volume):
-                machine = TangoMachine()
-                machine.vmms = "localDocker"
-                machine.name = volume
-                volume_l = volume.split("-")
-                machine.id = volume_l[1]
-                machine.image = volume_l[2]
-                machines.append(machine)
+        for (name, id, pool, image) in containers:
+            machines.append(
+                TangoMachine(name=name, vmms="localDocker", image=image, id=id)
+            )
+
+        # Volumes whose container is gone, e.g. after a crash
+        names = set(machine.name for machine in machines)
+        pattern = re.compile(r"^%s-(\d+)-(.+)$" % re.escape(config.Config.PREFIX))
+        for volume in os.listdir(self.getVolumePath("")):
+            match = pattern.match(volume)
+            if match and volume not in names:
+                machines.append(
+                    TangoMachine(
+                        name=volume,
+                        vmms="localDocker",
+                        image=match.group(2),
+                        id=match.group(1),
+                    )
+                )
         return machines
 
+    def destroyVMs(self, vms):
+        """destroyVMs - Delete many containers and their volumes at
+        once, with a single `docker rm -f`.
+        """
+        names = [self.instanceName(vm.id, vm.image) for vm in vms]
+        if not names:
+            return
+        if self.api:
+            for name in names:
+                try:
+                    self.api.remove_container(name, force=True)
+                except Exception as e:
+                    self.log.debug("Docker API remove of %s: %s" % (name, e))
+        else:
+            timeout(
+                ["docker", "rm", "-f"] + names,
+                config.Config.DOCKER_RM_TIMEOUT * len(names),
+            )
+        for name in names:
+            shutil.rmtree(self.getVolumePath(name), ignore_errors=True)
+        self.log.debug("Deleted containers and volumes %s" % names)
+
     def existsVM(self, vm):
-        """existsVM - Executes `docker inspect CONTAINER`, which returns
-        a non-zero status upon not finding a container.
+        """existsVM - Looks the container up in the container state
+        table, or executes `docker inspect CONTAINER`, which returns a
+        non-zero status upon not finding a container.
         """
-        instanceName = self.instanceName(vm.id, vm.name)
+        instanceName = self.instanceName(vm.id, vm.image)
+        if self.containers.synced:
+            return self.containers.get(instanceName) is not None
+        if self.api:
+            try:
+                self.api.inspect_container(instanceName)
+                return True
+            except Exception:
+                return False
         ret = timeout(["docker", "inspect", instanceName])
         return ret == 0
 
     def getImages(self):
-        """getImages - Executes `docker images` and returns a list of
-        images that can be used to boot a docker container with. This
-        function is a lot of parsing and so can break easily.
-        """
-        result = set()
-        cmd = "docker images"
-        o = subprocess.check_output(cmd, shell=True).decode("utf-8")
-        o_l = o.split("\n")
-        o_l.pop()
-        o_l.reverse()
-        o_l.pop()
-        for row in o_l:
-            row_l = row.split(" ")
-            result.add(re.sub(r".*/([^/]*)", r"\1", row_l[0]))
-        return list(result)
-
-    def getPartialOutput(self, vm):
-        """getPartialOutput - Get the partial output of a job.
-        It does not check if the docker container exists before executing
-        as the command will not fail even if the container does not exist.
-        Gets the first MAX_OUTPUT_FILE_SIZE bytes of the feedback file
+        """getImages - Returns a list of images that can be used to
+        boot a docker container with.
         """
+        return list(self.getImageDigests().keys())
 
+    def getImageDigests(self):
+        """getImageDigests - Executes `docker images` (or lists the
+        images through the Engine API) and returns a dictionary from
+        each image name to its image ID. Where a name has several tags,
+        the ID of its "latest" tag wins.
+        """
+        tags = []
+        if self.api:
+            for image in self.api.images():
+                for tag in image["RepoTags"] or []:
+                    tags.append((tag, image["Id"]))
+        else:
+            cmd = [
+                "docker",
+                "images",
+                "--no-trunc",
+                "--format",
+                "{{.Repository}}:{{.Tag}} {{.ID}}",
+            ]
+            o = subprocess.check_output(cmd).decode("utf-8")
+            for row in o.split("\n"):
+                if row:
+                    tags.append(tuple(row.split(" ")))
+
+        result = {}
+        for (tag, digest) in tags:
+            (repository, version) = tag.rsplit(":", 1)
+            if repository == "<none>":
+                continue
+            name = re.sub(r".*/([^/]*)", r"\1", repository)
+            if name not in result or version == "latest":
+                result[name] = digest
+        return result
+
+    def getPartialOutput(self, vm, offset=0):
+        """getPartialOutput - Get the partial output of a job, as bytes,
+        starting at offset. autodriver's output.log is linked into the
+        VM's volume, so it is read directly from the host. Nothing past
+        the first MAX_OUTPUT_FILE_SIZE bytes is returned.
+        """
         instanceName = self.instanceName(vm.id, vm.image)
-        cmd = "docker exec %s head -c %s autograde/output.log" % (
-            instanceName,
-            config.Config.MAX_OUTPUT_FILE_SIZE,
-        )
-        output = subprocess.check_output(
-            cmd, stderr=subprocess.STDOUT, shell=True
-        ).decode("utf-8")
+        logPath = os.path.join(self.getVolumePath(instanceName), "output.log")
+        size = config.Config.MAX_OUTPUT_FILE_SIZE - offset
+        if size <= 0:
+            return b""
 
-        return output
+        try:
+            with open(logPath, "rb") as f:
+                f.seek(offset)
+                return f.read(size)
+        except FileNotFoundError:
+            # The job has not started yet
+            return b""
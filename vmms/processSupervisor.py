@@ -0,0 +1,114 @@
+#
+# processSupervisor.py - Runs the docker, ssh, and scp commands of the
+# VMMS backends with deadlines.
+#
+# Children are waited on directly (Popen.wait/communicate with a
+# timeout) rather than polled once a TIMER_POLL_INTERVAL, so a command
+# is noticed the moment it exits and is killed the moment its deadline
+# passes. Killed children are always reaped, and output that is not
+# captured goes to os.devnull without opening a file per command.
+#
+import logging
+import subprocess
+import threading
+import time
+
+import config
+
+log = logging.getLogger("ProcessSupervisor")
+
+
+class CommandResult(object):
+
+    """
+    CommandResult - The outcome of one supervised command
+    """
+
+    def __init__(self, command, returncode, output=None, elapsed=0.0, error=None):
+        self.command = command
+        # -1 if the command was killed at its deadline
+        self.returncode = returncode
+        # Combined stdout and stderr (bytes), if it was captured
+        self.output = output
+        self.elapsed = elapsed
+        # Why the command could not be run to completion, if it was not
+        self.error = error
+
+    @property
+    def timedOut(self):
+        return self.returncode == -1
+
+    def __repr__(self):
+        return "CommandResult(returncode: %d, elapsed: %.3f)" % (
+            self.returncode,
+            self.elapsed,
+        )
+
+
+def run(command, time_out=None, capture=False, input=None, shell=False):
+    """run - Run a unix command, killing it if it has not exited after
+    time_out seconds (None waits forever). stdout and stderr are
+    captured together if capture is set, and discarded otherwise.
+    input is bytes to feed the command, or a function that writes its
+    input to the file object it is passed, for input too large to hold
+    in memory; the function cannot be combined with capture.
+    Returns a CommandResult.
+    """
+    start_time = time.time()
+    p = subprocess.Popen(
+        command,
+        stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE if capture else subprocess.DEVNULL,
+        stderr=subprocess.STDOUT,
+        shell=shell,
+    )
+    writer = None
+    if callable(input):
+        writer = threading.Thread(target=_feed, args=(input, p.stdin))
+        writer.daemon = True
+        writer.start()
+    try:
+        if writer:
+            output = None
+            returncode = p.wait(timeout=time_out)
+        else:
+            (output, _) = p.communicate(input, timeout=time_out)
+            returncode = p.returncode
+    except subprocess.TimeoutExpired:
+        p.kill()
+        if writer:
+            p.wait()
+        else:
+            (output, _) = p.communicate()
+        returncode = -1
+    if writer:
+        writer.join()
+
+    result = CommandResult(command, returncode, output, time.time() - start_time)
+    if config.Config.LOG_TIMING:
+        log.info("%s exited %d after %.3f secs" % (command, returncode, result.elapsed))
+    return result
+
+
+def _feed(write, stdin):
+    """_feed - Write a command's input with write, and then close its
+    stdin. The command sees truncated input if writing fails, and
+    may exit without reading all of it.
+    """
+    try:
+        write(stdin)
+    except Exception as e:
+        log.error("Input not fully written: %s" % e)
+    finally:
+        try:
+            stdin.close()
+        except OSError:
+            pass
+
+
+def timeout(command, time_out=1):
+    """timeout - Run a unix command with a timeout. Return -1 on
+    timeout, otherwise return the return value from the command, which
+    is typically 0 for success, 1-255 for failure.
+    """
+    return run(command, time_out).returncode
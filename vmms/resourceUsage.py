@@ -0,0 +1,98 @@
+#
+# resourceUsage.py - Measures what a job consumed from the cgroup of
+# the container it ran in.
+#
+# Tango containers run one job each, so the container's cgroup totals
+# are the job's. USAGE_COMMAND runs inside the container once the job
+# is over and prints the relevant cgroup files (v2, or v1 where the
+# host still uses it) after a marker line; parseUsage turns that into
+# a dictionary for the job record.
+#
+
+_MARKER = "TANGO_RESOURCE_USAGE"
+
+_FILES = [
+    # cgroup v2
+    "cpu.stat",
+    "memory.peak",
+    "io.stat",
+    "pids.peak",
+    # cgroup v1
+    "cpuacct/cpuacct.usage",
+    "memory/memory.max_usage_in_bytes",
+    "blkio/blkio.throttle.io_service_bytes",
+]
+
+# Shell command that dumps the cgroup files, and keeps the exit status
+# of the command before it. It contains no single quotes, so it can be
+# embedded in a single-quoted sh -c argument.
+USAGE_COMMAND = (
+    "s=$?; echo %s; cd /sys/fs/cgroup && for f in %s; do "
+    '[ -r $f ] && echo "== $f" && cat $f; done; exit $s' % (_MARKER, " ".join(_FILES))
+)
+
+
+def parseUsage(output):
+    """parseUsage - Returns the resources used by a job from the output
+    of USAGE_COMMAND: cpu_seconds, memory_peak and io_read_bytes /
+    io_write_bytes (in bytes), and pids_peak. Values the host's cgroups
+    do not provide are left out, and None is returned if the output
+    has no usage at all.
+    """
+    if output is None:
+        return None
+    if isinstance(output, bytes):
+        output = output.decode("utf-8", "replace")
+    if _MARKER not in output:
+        return None
+
+    files = {}
+    name = None
+    for line in output.split(_MARKER, 1)[1].splitlines():
+        if line.startswith("== "):
+            name = line[3:].strip()
+            files[name] = []
+        elif name and line.strip():
+            files[name].append(line.strip())
+
+    usage = {}
+    try:
+        if "cpu.stat" in files:
+            for line in files["cpu.stat"]:
+                (field, value) = line.split()
+                if field == "usage_usec":
+                    usage["cpu_seconds"] = int(value) / 1e6
+        elif "cpuacct/cpuacct.usage" in files:
+            usage["cpu_seconds"] = int(files["cpuacct/cpuacct.usage"][0]) / 1e9
+
+        for name in ("memory.peak", "memory/memory.max_usage_in_bytes"):
+            if files.get(name):
+                usage["memory_peak"] = int(files[name][0])
+                break
+
+        if "io.stat" in files:
+            usage["io_read_bytes"] = usage["io_write_bytes"] = 0
+            for line in files["io.stat"]:
+                for stat in line.split()[1:]:
+                    (field, value) = stat.split("=")
+                    if field == "rbytes":
+                        usage["io_read_bytes"] += int(value)
+                    elif field == "wbytes":
+                        usage["io_write_bytes"] += int(value)
+        elif "blkio/blkio.throttle.io_service_bytes" in files:
+            usage["io_read_bytes"] = usage["io_write_bytes"] = 0
+            for line in files["blkio/blkio.throttle.io_service_bytes"]:
+                fields = line.split()
+                if len(fields) != 3:
+                    continue
+                if fields[1] == "Read":
+                    usage["io_read_bytes"] += int(fields[2])
+                elif fields[1] == "Write":
+                    usage["io_write_bytes"] += int(fields[2])
+
+        if files.get("pids.peak"):
+            usage["pids_peak"] = int(files["pids.peak"][0])
+    except ValueError:
+        pass
+
+    return usage or None
@@ -0,0 +1,128 @@
+#
+# sshPool.py - Long-lived, multiplexed SSH connections to distDocker's
+# worker hosts, shared by all the VMs placed on them.
+#
+# Each user@host gets DOCKER_SSH_CONNECTIONS master connections, whose
+# control sockets live in one directory per Tango process. The masters
+# are opened on demand (ControlMaster=auto) by the first ssh that needs
+# one, so a dead master is simply replaced by the next command. A
+# background thread checks the masters every DOCKER_SSH_CHECK_INTERVAL
+# seconds and clears the sockets of dead ones. The directory and the
+# masters are removed when Tango exits.
+#
+import atexit
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import config
+from vmms.processSupervisor import timeout
+
+
+class SSHConnectionPool(object):
+    def __init__(self, flags):
+        """flags are the ssh options (authentication and the like) that
+        masters are opened with
+        """
+        self.flags = flags
+        self.controlDir = tempfile.mkdtemp(prefix="tango-docker-ssh")
+        # user@host -> number of the connection the next command uses
+        self.nextSlot = {}
+        self.lock = threading.Lock()
+        self.started = False
+        self.log = logging.getLogger("SSHConnectionPool")
+        atexit.register(self.close)
+
+    def controlPath(self, target, slot):
+        # Socket paths are short, so name them by a hash of user@host
+        name = hashlib.sha1(target.encode()).hexdigest()[:16]
+        return os.path.join(self.controlDir, "%s-%d" % (name, slot))
+
+    def _masterFlags(self, controlPath):
+        return [
+            "-o",
+            "ControlPath=%s" % controlPath,
+            "-o",
+            "ControlMaster=auto",
+            "-o",
+            "ControlPersist=%d" % config.Config.DOCKER_SSH_PERSIST,
+        ]
+
+    def connect(self, target):
+        """connect - Returns the ssh options for a command to target
+        (user@host). Commands are spread over the target's connections
+        in turn, since a connection carries a limited number of
+        sessions at once.
+        """
+        with self.lock:
+            if not self.started:
+                self.started = True
+                thread = threading.Thread(target=self.__monitor)
+                thread.daemon = True
+                thread.start()
+            slot = self.nextSlot.get(target, 0)
+            self.nextSlot[target] = (slot + 1) % config.Config.DOCKER_SSH_CONNECTIONS
+        return self.flags + self._masterFlags(self.controlPath(target, slot))
+
+    def _connections(self):
+        """_connections - Returns (target, controlPath) of every master
+        connection that may be open
+        """
+        with self.lock:
+            targets = list(self.nextSlot.keys())
+        return [
+            (target, self.controlPath(target, slot))
+            for target in targets
+            for slot in range(config.Config.DOCKER_SSH_CONNECTIONS)
+        ]
+
+    def __monitor(self):
+        while True:
+            time.sleep(config.Config.DOCKER_SSH_CHECK_INTERVAL)
+            for (target, controlPath) in self._connections():
+                if os.path.exists(controlPath) and not self.check(target, controlPath):
+                    self.log.info("Lost SSH connection to %s" % target)
+                    self._drop(target, controlPath)
+
+    def check(self, target, controlPath):
+        """check - Returns True if the master behind controlPath is up"""
+        ret = timeout(
+            ["ssh", "-q", "-O", "check", "-o", "ControlPath=%s" % controlPath]
+            + [target],
+            config.Config.DOCKER_SSH_CHECK_INTERVAL,
+        )
+        return ret == 0
+
+    def _drop(self, target, controlPath):
+        """_drop - Stop a master and remove its socket, so the next ssh
+        to the target opens a new one
+        """
+        timeout(
+            ["ssh", "-q", "-O", "exit", "-o", "ControlPath=%s" % controlPath]
+            + [target],
+            config.Config.DOCKER_SSH_CHECK_INTERVAL,
+        )
+        try:
+            os.unlink(controlPath)
+        except OSError:
+            pass
+
+    def disconnect(self, target):
+        """disconnect - Stop the masters to target, which ends every
+        command running over them
+        """
+        for slot in range(config.Config.DOCKER_SSH_CONNECTIONS):
+            controlPath = self.controlPath(target, slot)
+            if os.path.exists(controlPath):
+                self._drop(target, controlPath)
+
+    def close(self):
+        """close - Stop every master and remove the control directory"""
+        for (target, controlPath) in self._connections():
+            if os.path.exists(controlPath):
+                self._drop(target, controlPath)
+        shutil.rmtree(self.controlDir, ignore_errors=True)
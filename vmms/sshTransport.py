@@ -0,0 +1,364 @@
+#
+# sshTransport.py - How the remote VMMSs (distDocker, ec2SSH, tashiSSH)
+# run commands on and copy files to and from their hosts.
+#
+# Every transport has the same interface. run() runs a command on
+# user@host, put() and get() copy a file to or from it, and each
+# returns a CommandResult. The returncode is 255 if the host could not
+# be reached and -1 on timeout, as with the ssh binary, and the error
+# says what went wrong. disconnect() closes the connections to a host,
+# ending the commands running on it, e.g. once it has failed.
+# SSH_TRANSPORT picks the transport:
+#
+#   "binary"   - forks the ssh and scp binaries (the default)
+#   "paramiko" - runs SSH in-process, with one connection per host
+#                that all commands and file transfers are multiplexed
+#                over. Falls back to "binary" if paramiko is missing.
+#                It honours the same flags as ssh does (see parseFlags),
+#                and refuses flags it cannot honour.
+#
+import logging
+import os
+import re
+import socket
+import threading
+import time
+
+import config
+from vmms.processSupervisor import CommandResult, run
+from vmms.sshPool import SSHConnectionPool
+
+log = logging.getLogger("SSHTransport")
+
+# Seconds between keepalives on idle in-process connections
+_KEEPALIVE = 30
+
+
+# ssh -o options that do not change what the in-process transport does:
+# it never prompts, and never uses GSSAPI
+_IGNORED_OPTIONS = {"batchmode": "yes", "gssapiauthentication": "no"}
+
+
+def parseFlags(flags):
+    """parseFlags - Returns the ssh flags that the in-process transport
+    honours as a dictionary: the identity file ("key_file"), "port",
+    "connect_timeout", "strict" host key checking ("yes", "no" or
+    "accept-new", as with ssh) and "known_hosts" (None for the user's
+    own). Raises ValueError on any other flag.
+    """
+    options = {
+        "key_file": None,
+        "port": 22,
+        "connect_timeout": None,
+        "strict": "yes",
+        "known_hosts": None,
+    }
+    args = list(flags)
+    while args:
+        flag = args.pop(0)
+        if flag == "-q":
+            continue
+        if flag not in ("-i", "-p", "-P", "-o") or not args:
+            raise ValueError("Unsupported ssh flag %s" % flag)
+        value = args.pop(0)
+        if flag == "-i":
+            options["key_file"] = value
+            continue
+        if flag in ("-p", "-P"):
+            options["port"] = int(value)
+            continue
+        # -o Key=Value, or -o "Key Value"
+        option = re.split(r"\s*=\s*|\s+", value.strip(), maxsplit=1)
+        if len(option) != 2:
+            raise ValueError("Unsupported ssh option %s" % value)
+        key = option[0].lower()
+        value = option[1]
+        if key == "port":
+            options["port"] = int(value)
+        elif key == "identityfile":
+            options["key_file"] = value
+        elif key == "connecttimeout":
+            options["connect_timeout"] = int(value)
+        elif key == "stricthostkeychecking":
+            value = value.lower()
+            options["strict"] = {"ask": "yes", "off": "no"}.get(value, value)
+            if options["strict"] not in ("yes", "no", "accept-new"):
+                raise ValueError("Unsupported StrictHostKeyChecking=%s" % value)
+        elif key == "userknownhostsfile":
+            options["known_hosts"] = value
+        elif _IGNORED_OPTIONS.get(key) != value.lower():
+            raise ValueError("Unsupported ssh option %s=%s" % (key, value))
+    return options
+
+
+def makeTransport(flags, multiplex=False):
+    """makeTransport - Returns the transport that SSH_TRANSPORT selects.
+    flags are the ssh/scp options (identity file and the like), and
+    multiplex has the binary transport share pooled connections per
+    host, as the in-process transport always does.
+    """
+    if config.Config.SSH_TRANSPORT == "paramiko":
+        try:
+            return ParamikoTransport(flags)
+        except ImportError:
+            log.error("paramiko is not installed, forking ssh instead")
+    return BinaryTransport(flags, multiplex)
+
+
+class BinaryTransport(object):
+    def __init__(self, flags, multiplex=False):
+        self.flags = flags
+        self.pool = SSHConnectionPool(flags) if multiplex else None
+
+    def _flags(self, target):
+        if self.pool:
+            return self.pool.connect(target)
+        return self.flags
+
+    def _result(self, target, result):
+        if result.timedOut:
+            result.error = "Timed out talking to %s" % target
+        elif result.returncode == 255:
+            result.error = "SSH to %s failed" % target
+        return result
+
+    def run(self, target, command, time_out=None, capture=False, input=None):
+        """run - Run command on target (user@host)"""
+        return self._result(
+            target,
+            run(
+                ["ssh"] + self._flags(target) + [target, command],
+                time_out,
+                capture=capture,
+                input=input,
+            ),
+        )
+
+    def disconnect(self, target):
+        """disconnect - Close the pooled connections to target"""
+        if self.pool:
+            self.pool.disconnect(target)
+
+    def put(self, target, localFile, remotePath, time_out=None):
+        """put - Copy localFile to remotePath on target"""
+        return self._result(
+            target,
+            run(
+                ["scp"]
+                + self._flags(target)
+                + [localFile, "%s:%s" % (target, remotePath)],
+                time_out,
+            ),
+        )
+
+    def get(self, target, remotePath, localFile, time_out=None):
+        """get - Copy remotePath on target to localFile"""
+        return self._result(
+            target,
+            run(
+                ["scp"]
+                + self._flags(target)
+                + ["%s:%s" % (target, remotePath), localFile],
+                time_out,
+            ),
+        )
+
+
+class ParamikoTransport(object):
+    def __init__(self, flags):
+        import paramiko
+
+        self.paramiko = paramiko
+        # Read at connect time, since ec2SSH changes its identity file,
+        # but refused at once if they cannot be honoured
+        self.flags = flags
+        parseFlags(flags)
+        # user@host -> SSHClient
+        self.clients = {}
+        # user@host -> lock held while connecting to it
+        self.connecting = {}
+        self.lock = threading.Lock()
+
+    def _client(self, target, time_out):
+        """_client - Returns a live connection to target, connecting
+        (again) if there is none
+        """
+        with self.lock:
+            lock = self.connecting.setdefault(target, threading.Lock())
+        with lock:
+            client = self.clients.get(target)
+            if client and client.get_transport() and client.get_transport().is_active():
+                return client
+            (user, host) = target.split("@", 1)
+            options = parseFlags(self.flags)
+            client = self.paramiko.SSHClient()
+            # Check host keys as ssh would with the same flags
+            if options["strict"] != "no":
+                if options["known_hosts"] is None:
+                    client.load_system_host_keys()
+                elif os.path.exists(options["known_hosts"]):
+                    client.load_host_keys(options["known_hosts"])
+            if options["strict"] == "yes":
+                client.set_missing_host_key_policy(self.paramiko.RejectPolicy())
+            else:
+                client.set_missing_host_key_policy(self.paramiko.AutoAddPolicy())
+            connectTimeout = options["connect_timeout"]
+            if connectTimeout is None or (time_out and time_out < connectTimeout):
+                connectTimeout = time_out
+            client.connect(
+                host,
+                port=options["port"],
+                username=user,
+                key_filename=options["key_file"],
+                timeout=connectTimeout,
+                banner_timeout=time_out,
+                auth_timeout=time_out,
+                look_for_keys=False,
+                allow_agent=False,
+                gss_auth=False,
+            )
+            client.get_transport().set_keepalive(_KEEPALIVE)
+            self.clients[target] = client
+            return client
+
+    def _drop(self, target):
+        with self.lock:
+            client = self.clients.pop(target, None)
+        if client:
+            client.close()
+
+    def disconnect(self, target):
+        """disconnect - Close the connection to target"""
+        self._drop(target)
+
+    def run(self, target, command, time_out=None, capture=False, input=None):
+        """run - Run command on target (user@host)"""
+        start_time = time.time()
+        try:
+            client = self._client(target, time_out)
+            channel = client.get_transport().open_session(timeout=time_out)
+            channel.set_combine_stderr(True)
+            channel.exec_command(command)
+        except (self.paramiko.SSHException, OSError) as e:
+            self._drop(target)
+            return CommandResult(
+                command,
+                255,
+                elapsed=time.time() - start_time,
+                error="SSH to %s failed: %s" % (target, e),
+            )
+
+        writer = None
+        if input is not None:
+            writer = threading.Thread(target=self._feed, args=(channel, input))
+            writer.daemon = True
+            writer.start()
+
+        # Read until the command closes its output, then wait for its
+        # exit status; both are bounded by the deadline
+        output = []
+        returncode = None
+        while returncode is None:
+            remaining = None
+            if time_out is not None:
+                remaining = time_out - (time.time() - start_time)
+                if remaining <= 0:
+                    returncode = -1
+                    break
+            channel.settimeout(min(remaining, 1) if remaining else 1)
+            try:
+                data = channel.recv(64 * 1024)
+            except socket.timeout:
+                continue
+            if data:
+                if capture:
+                    output.append(data)
+            elif channel.status_event.wait(remaining):
+                returncode = channel.recv_exit_status()
+                # The connection closed before the command exited
+                if returncode == -1:
+                    returncode = 255
+            else:
+                returncode = -1
+        channel.close()
+        if writer:
+            writer.join()
+
+        result = CommandResult(
+            command,
+            returncode,
+            b"".join(output) if capture else None,
+            time.time() - start_time,
+        )
+        if result.timedOut:
+            result.error = "Timed out talking to %s" % target
+        elif returncode == 255:
+            result.error = "Lost connection to %s" % target
+        if config.Config.LOG_TIMING:
+            log.info(
+                "%s on %s exited %d after %.3f secs"
+                % (command, target, returncode, result.elapsed)
+            )
+        return result
+
+    def _feed(self, channel, input):
+        try:
+            if callable(input):
+                stdin = channel.makefile_stdin("wb")
+                input(stdin)
+                stdin.flush()
+            else:
+                channel.sendall(input)
+        except Exception as e:
+            log.error("Input not fully written: %s" % e)
+        finally:
+            channel.shutdown_write()
+
+    def _transfer(self, target, time_out, transfer):
+        """_transfer - Run transfer(sftp) over an SFTP session to
+        target, and return its outcome as a CommandResult
+        """
+        start_time = time.time()
+        try:
+            client = self._client(target, time_out)
+            sftp = client.open_sftp()
+        except (self.paramiko.SSHException, OSError) as e:
+            self._drop(target)
+            return CommandResult(
+                "sftp",
+                255,
+                elapsed=time.time() - start_time,
+                error="SSH to %s failed: %s" % (target, e),
+            )
+        try:
+            sftp.get_channel().settimeout(time_out)
+            transfer(sftp)
+            return CommandResult("sftp", 0, elapsed=time.time() - start_time)
+        except socket.timeout:
+            return CommandResult(
+                "sftp",
+                -1,
+                elapsed=time.time() - start_time,
+                error="Timed out talking to %s" % target,
+            )
+        except (self.paramiko.SSHException, OSError) as e:
+            return CommandResult(
+                "sftp",
+                1,
+                elapsed=time.time() - start_time,
+                error="Copy on %s failed: %s" % (target, e),
+            )
+        finally:
+            sftp.close()
+
+    def put(self, target, localFile, remotePath, time_out=None):
+        """put - Copy localFile to remotePath on target"""
+        return self._transfer(
+            target, time_out, lambda sftp: sftp.put(localFile, remotePath)
+        )
+
+    def get(self, target, remotePath, localFile, time_out=None):
+        """get - Copy remotePath on target to localFile"""
+        return self._transfer(
+            target, time_out, lambda sftp: sftp.get(remotePath, localFile)
+        )
@@ -2,7 +2,7 @@
 # tashiSSH.py - Implements the Tango VMMS interface.
 #
 # This implementation uses Tashi to manage the virtual machines and
-# ssh and scp to access them. The following excecption are raised back
+# sshTransport.py to access them. The following excecption are raised back
 # to the caller:
 #
 #   TashiException - Tashi raises this if it encounters any problem
@@ -10,7 +10,6 @@
 #
 # TODO: this currently probably does not work on Python 3 yet
 import random
-import subprocess
 import os
 import re
 import time
@@ -20,74 +19,13 @@ import os
 import sys
 
 import config
+from vmms.processSupervisor import timeout
+from vmms.sshTransport import makeTransport
 from tashi.rpycservices.rpyctypes import *
 from tashi.util import getConfig, createClient
 from tangoObjects import *
 
 
-def timeout(command, time_out=1):
-    """timeout - Run a unix command with a timeout. Return -1 on
-    timeout, otherwise return the return value from the command, which
-    is typically 0 for success, 1-255 for failure.
-    """
-    # Launch the command
-    p = subprocess.Popen(
-        command, stdout=open("/dev/null", "w"), stderr=subprocess.STDOUT
-    )
-
-    # Wait for the command to complete
-    t = 0.0
-    while t < time_out and p.poll() is None:
-        time.sleep(config.Config.TIMER_POLL_INTERVAL)
-        t += config.Config.TIMER_POLL_INTERVAL
-
-    # Determine why the while loop terminated
-    if p.poll() is None:
-        try:
-            os.kill(p.pid, 9)
-        except OSError:
-            pass
-        returncode = -1
-    else:
-        returncode = p.poll()
-
-    return returncode
-
-
-def timeoutWithReturnStatus(command, time_out, returnValue=0):
-    """timeoutWithReturnStatus - Run a Unix command with a timeout,
-    until the expected value is returned by the command; On timeout,
-    return last error code obtained from the command.
-    """
-    if (config.Config.LOGLEVEL is logging.DEBUG) and (
-        "ssh" in command or "scp" in command
-    ):
-        out = sys.stdout
-        err = sys.stderr
-    else:
-        out = open("/dev/null", "w")
-        err = sys.stdout
-
-    # Launch the command
-    p = subprocess.Popen(
-        command, stdout=open("/dev/null", "w"), stderr=subprocess.STDOUT
-    )
-
-    t = 0.0
-    while t < time_out:
-        ret = p.poll()
-        if ret is None:
-            time.sleep(config.Config.TIMER_POLL_INTERVAL)
-            t += config.Config.TIMER_POLL_INTERVAL
-        elif ret == returnValue:
-            return ret
-        else:
-            p = subprocess.Popen(
-                command, stdout=open("/dev/null", "w"), stderr=subprocess.STDOUT
-            )
-    return ret
-
-
 #
 # User defined exceptions
 #
@@ -115,6 +53,7 @@ class TashiSSH(object):
         self.config = getConfig(["Client"])[0]
         self.client = createClient(self.config)
         self.log = logging.getLogger("TashiSSH")
+        self.ssh = makeTransport(TashiSSH._SSH_FLAGS)
 
     #
     # VMMS helper functions
@@ -211,12 +150,7 @@ class TashiSSH(object):
         instance_down = 1
         start_time = time.time()
         while instance_down:
-            instance_down = subprocess.call(
-                "ping -c 1 %s" % (domain_name),
-                shell=True,
-                stdout=open("/dev/null", "w"),
-                stderr=subprocess.STDOUT,
-            )
+            instance_down = timeout(["ping", "-c", "1", domain_name], max_secs)
 
             # Wait a bit and then try again if we haven't exceeded
             # timeout
@@ -240,15 +174,15 @@ class TashiSSH(object):
                 )
                 return -1
 
-            # If the call to ssh returns timeout (-1) or ssh error
-            # (255), then success. Otherwise, keep trying until we run
-            # out of time.
-            ret = timeout(
-                ["ssh"] + TashiSSH._SSH_FLAGS + ["autolab@%s" % (domain_name), "(:)"],
-                max_secs - elapsed_secs,
+            # Unless ssh times out or cannot connect, the VM is ready.
+            # Otherwise, keep trying until we run out of time.
+            result = self.ssh.run(
+                "autolab@%s" % (domain_name), "(:)", max_secs - elapsed_secs
             )
-            self.log.debug("VM %s: ssh returned with %d" % (instance_name, ret))
-            if (ret != -1) and (ret != 255):
+            self.log.debug(
+                "VM %s: ssh returned with %d" % (instance_name, result.returncode)
+            )
+            if result.error is None:
                 return 0
 
             # Sleep a bit before trying again
@@ -259,25 +193,23 @@ class TashiSSH(object):
         domain_name = self.domainName(vm.id, vm.name)
         self.log.debug("Creating autolab directory on VM")
         # Create a fresh input directory
-        ret = subprocess.call(
-            ["ssh"]
-            + TashiSSH._SSH_FLAGS
-            + ["autolab@%s" % (domain_name), "(rm -rf autolab; mkdir autolab)"]
+        self.ssh.run(
+            "autolab@%s" % (domain_name),
+            "(rm -rf autolab; mkdir autolab)",
+            config.Config.COPYIN_TIMEOUT,
         )
         self.log.debug("Autolab directory created on VM")
         # Copy the input files to the input directory
         for file in inputFiles:
             self.log.debug("Copying file %s to VM %s" % (file.localFile, domain_name))
 
-            ret = timeout(
-                ["scp", "-vvv"]
-                + TashiSSH._SSH_FLAGS
-                + [
-                    file.localFile,
-                    "autolab@%s:autolab/%s" % (domain_name, file.destFile),
-                ],
+            result = self.ssh.put(
+                "autolab@%s" % (domain_name),
+                file.localFile,
+                "autolab/%s" % file.destFile,
                 config.Config.COPYIN_TIMEOUT,
             )
+            ret = result.returncode
 
             if ret == 0:
                 self.log.debug(
@@ -286,8 +218,8 @@ class TashiSSH(object):
                 )
             else:
                 self.log.debug(
-                    "Error: failed to copy file %s to VM %s with status %s"
-                    % (file.localFile, domain_name, str(ret))
+                    "Error: failed to copy file %s to VM %s with status %s (%s)"
+                    % (file.localFile, domain_name, str(ret), result.error)
                 )
                 return ret
         return 0
@@ -309,12 +241,9 @@ class TashiSSH(object):
                 config.Config.MAX_OUTPUT_FILE_SIZE,
             )
         )
-        ret = timeout(
-            ["ssh", "-vvv"]
-            + TashiSSH._SSH_FLAGS
-            + ["autolab@%s" % (domain_name), runcmd],
-            runTimeout * 2,
-        )
+        ret = self.ssh.run(
+            "autolab@%s" % (domain_name), runcmd, runTimeout * 2
+        ).returncode
         # runTimeout * 2 is a temporary hack. The driver will handle the timout
 
         return ret
@@ -328,44 +257,26 @@ class TashiSSH(object):
         # Optionally log finer grained runtime info. Adds about 1 sec
         # to the job latency, so we typically skip this.
         if config.Config.LOG_TIMING:
-            try:
-                # regular expression matcher for error message from cat
-                no_file = re.compile("No such file or directory")
-
-                time_info = (
-                    subprocess.check_output(
-                        ["ssh"]
-                        + TashiSSH._SSH_FLAGS
-                        + ["autolab@%s" % (domain_name), "cat time.out"]
-                    )
-                    .decode("utf-8")
-                    .rstrip("\n")
-                )
+            result = self.ssh.run(
+                "autolab@%s" % (domain_name), "cat time.out", capture=True
+            )
 
-                # If the output is empty, then ignore it (timing info wasn't
-                # collected), otherwise let's log it!
-                if no_file.match(time_info):
-                    # runJob didn't produce an output file
-                    pass
-
-                else:
-                    # remove newline character printed in timing info
-                    # replaces first '\n' character with a space
-                    time_info = re.sub("\n", " ", time_info, count=1)
-                    self.log.info("Timing (%s): %s" % (domain_name, time_info))
-
-            except subprocess.CalledProcessError as xxx_todo_changeme:
-                # Error copying out the timing data (probably runJob failed)
-                re.error = xxx_todo_changeme
-                # Error copying out the timing data (probably runJob failed)
-                pass
-
-        ret = timeout(
-            ["scp", "-vvv"]
-            + TashiSSH._SSH_FLAGS
-            + ["autolab@%s:output" % (domain_name), destFile],
+            # If cat failed, then ignore it (timing info wasn't
+            # collected, probably because runJob failed), otherwise
+            # let's log it!
+            if result.returncode == 0:
+                # remove newline character printed in timing info
+                # replaces first '\n' character with a space
+                time_info = result.output.decode("utf-8").rstrip("\n")
+                time_info = re.sub("\n", " ", time_info, count=1)
+                self.log.info("Timing (%s): %s" % (domain_name, time_info))
+
+        ret = self.ssh.get(
+            "autolab@%s" % (domain_name),
+            "output",
+            destFile,
             config.Config.COPYOUT_TIMEOUT,
-        )
+        ).returncode
 
         return ret
 
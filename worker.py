@@ -48,10 +48,23 @@ class Worker(threading.Thread):
         or not in the pool (replace_vm). The worker must always call
         this function before returning.
         """
+        # Cores pinned to the job are free as soon as it is over
+        if hasattr(self.vmms, "releaseCores"):
+            self.vmms.releaseCores(self.job.vm)
+        # As is the capacity held for a VM started for the job
+        self.preallocator.releaseCapacity(self.job.id)
+
         # job-owned instance, simply destroy after job is completed
         if self.job.accessKeyId:
             self.vmms.safeDestroyVM(self.job.vm)
         elif return_vm:
+            # VMs that go back to their pool must not carry this job's
+            # state to the next one. VMMSs that can replace a VM's
+            # container (recycleVM) do so; other VMs are destroyed.
+            if hasattr(self.vmms, "recycleVM") and self.preallocator.inPool(
+                self.job.vm
+            ):
+                self.vmms.recycleVM(self.job.vm)
             self.preallocator.freeVM(self.job.vm)
         else:
             self.vmms.safeDestroyVM(self.job.vm)
@@ -64,6 +77,12 @@ class Worker(threading.Thread):
             # pool is empty and creates a spurious vm.
             self.preallocator.removeVM(self.job.vm)
 
+    def hostFailed(self, vm):
+        """hostFailed - Returns True if the VMMS knows that the host vm
+        runs on has failed, in which case the job is run elsewhere
+        """
+        return hasattr(self.vmms, "hostFailed") and self.vmms.hostFailed(vm)
+
     def rescheduleJob(self, hdrfile, ret, err):
         """rescheduleJob - Reschedule a job that has failed because
         of a system error, such as a VM timing out or a connection
@@ -286,6 +305,12 @@ class Worker(threading.Thread):
                 % (datetime.now().ctime(), self.job.name, self.job.id, ret["copyin"])
             )
 
+            if ret["copyin"] != 0 and self.hostFailed(vm):
+                self.rescheduleJob(
+                    hdrfile, ret, "Internal error: host %s failed" % vm.domain_name
+                )
+                return
+
             # Run the job on the virtual machine
             ret["runjob"] = self.vmms.runJob(
                 vm,
@@ -306,6 +331,19 @@ class Worker(threading.Thread):
                 % (datetime.now().ctime(), self.job.name, self.job.id, ret["runjob"])
             )
 
+            if ret["runjob"] != 0 and self.hostFailed(vm):
+                self.rescheduleJob(
+                    hdrfile, ret, "Internal error: host %s failed" % vm.domain_name
+                )
+                return
+
+            # Record what the job used
+            if hasattr(self.vmms, "getResourceUsage"):
+                usage = self.vmms.getResourceUsage(vm)
+                if usage:
+                    self.job.setUsage(usage)
+                    self.jobQueue.recordUsage(self.job)
+
             # Copy the output back.
             ret["copyout"] = self.vmms.copyOut(vm, self.job.outputFile)
             if ret["copyout"] != 0: